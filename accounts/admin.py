@@ -1,12 +1,7 @@
-from datetime import timedelta
-
 from django.contrib import admin
 from django.urls import reverse
-from django.utils import timezone
 from django.utils.html import format_html
 
-from search.models import History, Search
-
 from .models import (
     IpTracker,
     Payout,
@@ -33,6 +28,7 @@ class UserProfileAdmin(admin.ModelAdmin):
     )
     search_fields = ("email",)
     readonly_fields = ("history", "search", "status")
+    list_select_related = ("earnings_balance",)
 
     def history(self, obj):  # pylint: disable=no-self-use
         url = reverse("admin:search_history_changelist")
@@ -53,34 +49,16 @@ class UserProfileAdmin(admin.ModelAdmin):
         )
 
     def status(self, obj):  # pylint: disable=no-self-use
-        activities_in_past_seven_days = "Inactive"
-        past_seven_date = timezone.now() - timedelta(days=6)
-        # Reset to begin of the day
-        past_seven_date = past_seven_date.replace(
-            hour=0, minute=0, second=0, microsecond=0
-        )
-
-        if obj.last_posting_time and obj.last_posting_time >= past_seven_date:
-            activities_in_past_seven_days = "Active"
-        else:
-            is_history = History.objects.filter(
-                user_id=obj.pk, created__gte=past_seven_date
-            )
-            is_search = Search.objects.filter(
-                user_id=obj.pk, created__gte=past_seven_date
-            )
-
-            if is_history.exists() or is_search.exists():
-                activities_in_past_seven_days = "Active"
-
-        return activities_in_past_seven_days
+        if obj.get_status():
+            return "Active"
+        return "Inactive"
 
     status.short_description = "Guppy status"  # type: ignore
 
     def total_unpaid_earnings(self, obj):  # pylint: disable=no-self-use
-        requesting_amount = obj.get_earned_amount(Payout.REQUESTING)
-        unpaid_amount = obj.get_earned_amount(Payout.UNPAID)
-        total_unpaid_earnings = requesting_amount + unpaid_amount
+        balance = obj.get_earnings_balance()
+        requesting_amount = balance.requesting
+        total_unpaid_earnings = requesting_amount + balance.unpaid
         payout_url = reverse("admin:accounts_payout_changelist")
         requesting_url = reverse("admin:accounts_payoutrequest_changelist")
 
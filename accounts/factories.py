@@ -1,8 +1,11 @@
 import uuid
+from datetime import timedelta
 
 import factory
 from django_reflinks.models import ReferralHit, ReferralLink
 
+from django.utils import timezone
+
 from .models import Payout, UserProfile, UserProfileReferralHit
 
 
@@ -41,3 +44,7 @@ class PayoutFactory(factory.django.DjangoModelFactory):
         model = Payout
 
     amount = 1
+    # A single activities payout is allowed per user and day
+    date = factory.Sequence(
+        lambda n: timezone.now().date() - timedelta(days=n + 1)
+    )
@@ -0,0 +1,54 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.models import UserProfile
+from accounts.utils import PayoutGenerator
+
+
+class Command(BaseCommand):
+    """
+    Time `PayoutGenerator.create_activities_payouts` for growing numbers of
+    active users. The generated users and payouts are rolled back.
+    """
+
+    help = "Benchmark the creation of the daily activities payouts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--users",
+            type=int,
+            nargs="+",
+            default=[10000, 100000, 1000000],
+            help="Numbers of active users to benchmark",
+        )
+        parser.add_argument("--batch-size", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        for number_of_users in options["users"]:
+            with transaction.atomic():
+                now = timezone.now()
+                for start in range(0, number_of_users, batch_size):
+                    end = min(start + batch_size, number_of_users)
+                    UserProfile.objects.bulk_create(
+                        UserProfile(
+                            email=f"benchmark-{index}@guppy.co",
+                            password="!",
+                            is_waitlisted=False,
+                            last_posting_time=now,
+                        )
+                        for index in range(start, end)
+                    )
+
+                started = time.monotonic()
+                created = PayoutGenerator.create_activities_payouts()
+                duration = time.monotonic() - started
+                transaction.set_rollback(True)
+
+            self.stdout.write(
+                f"{number_of_users} active users: {created} payouts created "
+                f"in {duration:.2f}s"
+            )
@@ -1,28 +1,150 @@
-from accounts.models import IpTracker
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Iterable, List, Tuple
+
+from kombu.exceptions import OperationalError
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+
+from accounts.tasks import save_ip_trackers
+from guppy.celery import publish_once
+
+LOGGER = logging.getLogger(__name__)
+IP_SEEN_CACHE_KEY = "ip_seen:{user_id}:{ip}:{interval}"
 
 
 class IpTrackerMiddleware:
     """
     Calling IpTracker will save all ip addresses of logged in users.
     As a piece of middleware, this is run upon every request.
+
+    A (user, ip) pair is saved once per IP_TRACKER_INTERVAL: the pairs seen
+    during the interval are remembered by the process, and by the cache for
+    all processes. The new pairs are saved by batches in a Celery task,
+    sent when a batch is full, after IP_TRACKER_FLUSH_INTERVAL and when the
+    process exits. A batch that could not be sent within
+    IP_TRACKER_PUBLISH_TIMEOUT is saved again by the next requests.
     """
 
     def __init__(self, get_response):
         self.get_response = get_response
+        self.lock = threading.Lock()
+        # Interval in which each (user id, ip) pair was last seen
+        self.seen = OrderedDict()  # type: OrderedDict[Tuple[int, str], int]
+        # (user id, ip, ISO time) sightings waiting to be sent
+        self.pending = []  # type: List[Tuple[int, str, str]]
+        self.pending_since = 0.0
+        atexit.register(self.send_pending, force=True)
 
     def __call__(self, request):
         user = request.user
         ip_address = self.get_client_ip(request)
 
         if user.is_authenticated:
-            IpTracker.objects.get_or_create(
-                user_profile=user,
-                ip=ip_address,
-            )
+            self.track(user.pk, ip_address)
 
         response = self.get_response(request)
         return response
 
+    def track(self, user_id: int, ip_address: str) -> None:
+        """
+        Save the ip of a user if it was not seen during the interval
+        """
+        if self.is_new(user_id, ip_address):
+            with self.lock:
+                if not self.pending:
+                    self.pending_since = time.monotonic()
+                    self.start_timer()
+                self.pending.append(
+                    (user_id, ip_address, timezone.now().isoformat())
+                )
+        self.send_pending()
+
+    def is_new(self, user_id: int, ip_address: str) -> bool:
+        key = (user_id, ip_address)
+        interval = int(time.time() // settings.IP_TRACKER_INTERVAL)
+        with self.lock:
+            if self.seen.get(key) == interval:
+                self.seen.move_to_end(key)
+                return False
+            self.seen[key] = interval
+            self.seen.move_to_end(key)
+            if len(self.seen) > settings.IP_TRACKER_CACHE_SIZE:
+                self.seen.popitem(last=False)
+
+        # Or seen by another process
+        return cache.add(
+            IP_SEEN_CACHE_KEY.format(
+                user_id=user_id, ip=ip_address, interval=interval
+            ),
+            True,
+            settings.IP_TRACKER_INTERVAL,
+        )
+
+    def start_timer(self) -> None:
+        # Send the pending sightings even if no request comes
+        timer = threading.Timer(
+            settings.IP_TRACKER_FLUSH_INTERVAL, self.send_idle
+        )
+        timer.daemon = True
+        timer.start()
+
+    def send_idle(self) -> None:
+        try:
+            self.send_pending(force=True)
+        finally:
+            # Opened by the thread if the task ran eagerly
+            connection.close()
+
+    def send_pending(self, force: bool = False) -> None:
+        with self.lock:
+            if not self.pending or (
+                not force
+                and len(self.pending) < settings.IP_TRACKER_BATCH_SIZE
+                and time.monotonic() - self.pending_since
+                < settings.IP_TRACKER_FLUSH_INTERVAL
+            ):
+                return
+            pending, self.pending = self.pending, []
+
+        try:
+            # The request does not wait for a slow or down broker
+            publish_once(
+                save_ip_trackers,
+                (pending,),
+                settings.IP_TRACKER_PUBLISH_TIMEOUT,
+            )
+        except (OperationalError, OSError):
+            LOGGER.exception("Could not send %s IPs to save.", len(pending))
+            self.forget(pending)
+
+    def forget(self, sightings: Iterable[Tuple[int, str, str]]) -> None:
+        """
+        Forget that the pairs of the sightings were seen, so that they are
+        saved by their next requests
+        """
+        keys = []
+        with self.lock:
+            for user_id, ip_address, seen in sightings:
+                self.seen.pop((user_id, ip_address), None)
+                interval = int(
+                    datetime.fromisoformat(seen).timestamp()
+                    // settings.IP_TRACKER_INTERVAL
+                )
+                keys.append(
+                    IP_SEEN_CACHE_KEY.format(
+                        user_id=user_id, ip=ip_address, interval=interval
+                    )
+                )
+        cache.delete_many(keys)
+
     @staticmethod
     def get_client_ip(request) -> str:
         """
@@ -0,0 +1,51 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:12
+
+from django.db import migrations, models
+
+
+# Keep the requested or paid payout of the duplicated ones
+DELETE_DUPLICATED_ACTIVITIES_PAYOUTS = """
+DELETE FROM accounts_payout
+USING accounts_payout AS kept
+WHERE accounts_payout.payout_type = 'activities'
+    AND kept.payout_type = 'activities'
+    AND accounts_payout.user_profile_id = kept.user_profile_id
+    AND accounts_payout.date = kept.date
+    AND accounts_payout.payment_status = 0
+    AND (
+        kept.payment_status > 0
+        OR (kept.payment_status = 0 AND accounts_payout.id > kept.id)
+    );
+"""
+# The duplicated payouts which were all requested or paid are kept for the
+# balances, but only the first one stays the activities payout of the day
+RETYPE_DUPLICATED_ACTIVITIES_PAYOUTS = """
+UPDATE accounts_payout
+SET payout_type = 'duplicated_activities'
+FROM accounts_payout AS kept
+WHERE accounts_payout.payout_type = 'activities'
+    AND kept.payout_type = 'activities'
+    AND accounts_payout.user_profile_id = kept.user_profile_id
+    AND accounts_payout.date = kept.date
+    AND accounts_payout.id > kept.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0008_payout_payout_type'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            DELETE_DUPLICATED_ACTIVITIES_PAYOUTS, migrations.RunSQL.noop
+        ),
+        migrations.RunSQL(
+            RETYPE_DUPLICATED_ACTIVITIES_PAYOUTS, migrations.RunSQL.noop
+        ),
+        migrations.AddConstraint(
+            model_name='payout',
+            constraint=models.UniqueConstraint(condition=models.Q(payout_type='activities'), fields=('user_profile', 'date', 'payout_type'), name='unique_activities_payout'),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:25
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+BACKFILL_EARNINGS_BALANCES = """
+INSERT INTO accounts_earningsbalance
+    (user_profile_id, paid, requesting, unpaid)
+SELECT
+    users.id,
+    COALESCE((
+        SELECT SUM(amount) FROM accounts_payoutrequest
+        WHERE user_profile_id = users.id AND payment_status = 1
+    ), 0),
+    COALESCE((
+        SELECT SUM(amount) FROM accounts_payoutrequest
+        WHERE user_profile_id = users.id AND payment_status = 0
+    ), 0),
+    COALESCE((
+        SELECT SUM(amount) FROM accounts_payout
+        WHERE user_profile_id = users.id AND payment_status = 0
+    ), 0)
+FROM accounts_userprofile AS users;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0009_payout_unique_activities_payout'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EarningsBalance',
+            fields=[
+                ('user_profile', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='earnings_balance', serialize=False, to='accounts.userprofile')),
+                ('paid', models.IntegerField(default=0)),
+                ('requesting', models.IntegerField(default=0)),
+                ('unpaid', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunSQL(BACKFILL_EARNINGS_BALANCES, migrations.RunSQL.noop),
+    ]
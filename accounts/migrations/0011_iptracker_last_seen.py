@@ -0,0 +1,25 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:00
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+BACKFILL_LAST_SEEN = """
+UPDATE accounts_iptracker SET last_seen = modified;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_earningsbalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='iptracker',
+            name='last_seen',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunSQL(BACKFILL_LAST_SEEN, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_iptracker_last_seen'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='userprofile',
+            name='last_posting_time',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+    ]
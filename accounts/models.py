@@ -1,7 +1,7 @@
 import json
 import uuid
 from datetime import timedelta
-from typing import Any, Dict, Union
+from typing import Any, Dict, Iterable, Optional, Union
 
 from django_extensions.db.models import TimeStampedModel
 from django_reflinks.models import ReferralHit, ReferralLink
@@ -11,14 +11,60 @@ from django.contrib.auth.models import (
     BaseUserManager,
     PermissionsMixin,
 )
-from django.db import IntegrityError, models, transaction
+from django.db import IntegrityError, connection, models, transaction
 from django.db.models import Sum
 from django.db.models.query import QuerySet  # pylint: disable=unused-import
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.translation import gettext as _
 
-from search.models import History, Search
+from search.models import UserDailyActivity
+
+EARNINGS_BALANCES_SQL = """
+SELECT
+    users.id AS user_profile_id,
+    COALESCE((
+        SELECT SUM(amount) FROM accounts_payoutrequest
+        WHERE user_profile_id = users.id AND payment_status = %(paid)s
+    ), 0) AS paid,
+    COALESCE((
+        SELECT SUM(amount) FROM accounts_payoutrequest
+        WHERE user_profile_id = users.id AND payment_status = %(requesting)s
+    ), 0) AS requesting,
+    COALESCE((
+        SELECT SUM(amount) FROM accounts_payout
+        WHERE user_profile_id = users.id AND payment_status = %(unpaid)s
+    ), 0) AS unpaid
+FROM accounts_userprofile AS users
+WHERE users.id = ANY(%(user_profile_ids)s)
+"""
+# Create the missing balances and lock them all, so that the refreshes of a
+# balance wait for each other and sum the payouts committed before them
+LOCK_EARNINGS_BALANCES_SQL = """
+INSERT INTO accounts_earningsbalance
+    (user_profile_id, paid, requesting, unpaid)
+SELECT id, 0, 0, 0 FROM accounts_userprofile
+WHERE id = ANY(%(user_profile_ids)s)
+ORDER BY id
+ON CONFLICT (user_profile_id) DO UPDATE SET
+    paid = accounts_earningsbalance.paid
+"""
+LOCK_EXISTING_EARNINGS_BALANCES_SQL = """
+SELECT user_profile_id FROM accounts_earningsbalance
+WHERE user_profile_id = ANY(%(user_profile_ids)s)
+ORDER BY user_profile_id
+FOR UPDATE
+"""
+UPDATE_EARNINGS_BALANCES_SQL = f"""
+UPDATE accounts_earningsbalance SET
+    paid = balances.paid,
+    requesting = balances.requesting,
+    unpaid = balances.unpaid
+FROM ({EARNINGS_BALANCES_SQL}) AS balances
+WHERE accounts_earningsbalance.user_profile_id = balances.user_profile_id
+"""
 
 
 class CustomUserManager(BaseUserManager):
@@ -79,7 +125,9 @@ class UserProfile(AbstractBaseUser, TimeStampedModel, PermissionsMixin):
     state = models.CharField(max_length=50)
     country = models.CharField(max_length=50, default="US")
     zip = models.CharField(max_length=50)
-    last_posting_time = models.DateTimeField(null=True, blank=True)
+    last_posting_time = models.DateTimeField(
+        null=True, blank=True, db_index=True
+    )
     is_waitlisted = models.BooleanField(
         _("Waitlist"),
         default=True,
@@ -138,15 +186,9 @@ class UserProfile(AbstractBaseUser, TimeStampedModel, PermissionsMixin):
         if self.last_posting_time and self.last_posting_time >= past_seven_date:
             activities_in_past_seven_days = True
         else:
-            is_history = History.objects.filter(
-                user_id=self.pk, created__gte=past_seven_date
-            )
-            is_search = Search.objects.filter(
-                user_id=self.pk, created__gte=past_seven_date
-            )
-
-            if is_history.exists() or is_search.exists():
-                activities_in_past_seven_days = True
+            activities_in_past_seven_days = UserDailyActivity.objects.filter(
+                user_id=self.pk, day__gte=past_seven_date.date()
+            ).exists()
 
         return activities_in_past_seven_days
 
@@ -157,15 +199,13 @@ class UserProfile(AbstractBaseUser, TimeStampedModel, PermissionsMixin):
             time = self.last_posting_time
 
         else:
-            last_history = History.objects.filter(user_id=self.pk).last()
-            if last_history:
-                time = last_history.created
-
-            last_search = Search.objects.filter(user_id=self.pk).last()
-            if last_search and (
-                time == "no data" or time < last_search.created
-            ):
-                time = last_search.created
+            last_activity = (
+                UserDailyActivity.objects.filter(user_id=self.pk)
+                .order_by("day")
+                .last()
+            )
+            if last_activity:
+                time = last_activity.last_activity
 
         if time != "no data":
             time = time.strftime("%Y-%m-%d %H:%M")
@@ -196,6 +236,15 @@ class UserProfile(AbstractBaseUser, TimeStampedModel, PermissionsMixin):
 
         return amount
 
+    def get_earnings_balance(self) -> "EarningsBalance":
+        """
+        Get the paid, requesting and unpaid amounts of the user
+        """
+        try:
+            return self.earnings_balance  # pylint: disable=no-member
+        except EarningsBalance.DoesNotExist:
+            return EarningsBalance(user_profile=self)
+
     def get_earned_payouts(self, status: int = None) -> "QuerySet[Payout]":
         """
         Get earned payouts by status
@@ -343,20 +392,33 @@ class Payout(TimeStampedModel):
     note = models.CharField(max_length=500, blank=True)
     date = models.DateField(default=timezone.now)
 
+    class Meta(TimeStampedModel.Meta):
+        constraints = [
+            # A single activities payout per user and day
+            models.UniqueConstraint(
+                fields=["user_profile", "date", "payout_type"],
+                condition=models.Q(payout_type="activities"),
+                name="unique_activities_payout",
+            )
+        ]
+
     def save(self, *args, **kwargs):
-        # Change UserProfileReferralHit payment status when updating Payout
-        if self.user_profile_referral_hit:
-            if self.payment_status == self.PAID:
-                payment_status = UserProfileReferralHit.PAID
-            elif self.payment_status == self.REQUESTING:
-                payment_status = UserProfileReferralHit.REQUESTING
-            else:
-                payment_status = UserProfileReferralHit.OPENED
-
-            self.user_profile_referral_hit.payment_status = payment_status
-            self.user_profile_referral_hit.save()
+        with transaction.atomic():
+            # Change UserProfileReferralHit payment status when updating
+            # Payout
+            if self.user_profile_referral_hit:
+                if self.payment_status == self.PAID:
+                    payment_status = UserProfileReferralHit.PAID
+                elif self.payment_status == self.REQUESTING:
+                    payment_status = UserProfileReferralHit.REQUESTING
+                else:
+                    payment_status = UserProfileReferralHit.OPENED
 
-        super().save(*args, **kwargs)
+                self.user_profile_referral_hit.payment_status = payment_status
+                self.user_profile_referral_hit.save()
+
+            super().save(*args, **kwargs)
+            EarningsBalance.refresh([self.user_profile_id])
 
 
 class PayoutRequest(TimeStampedModel):
@@ -391,31 +453,33 @@ class PayoutRequest(TimeStampedModel):
             payout_payment_status = Payout.REQUESTING
             referral_payment_status = UserProfileReferralHit.REQUESTING
 
-        payout_ids = json.loads(self.payout_ids)
-        payouts = Payout.objects.filter(
-            user_profile=self.user_profile,
-            pk__in=payout_ids,
-        )
-        payouts.update(
-            payment_status=payout_payment_status,
-        )
-        # Change UserProfileReferralHit payment status
-        # when updating PayoutRequest
-        user_profile_referral_hit_ids = []
-        for payout in payouts:
-            if payout.user_profile_referral_hit:
-                user_profile_referral_hit_ids.append(
-                    payout.user_profile_referral_hit.pk
-                )
-        if user_profile_referral_hit_ids:
-            UserProfileReferralHit.objects.filter(
+        with transaction.atomic():
+            payout_ids = json.loads(self.payout_ids)
+            payouts = Payout.objects.filter(
                 user_profile=self.user_profile,
-                pk__in=user_profile_referral_hit_ids,
-            ).update(
-                payment_status=referral_payment_status,
+                pk__in=payout_ids,
+            )
+            payouts.update(
+                payment_status=payout_payment_status,
             )
+            # Change UserProfileReferralHit payment status
+            # when updating PayoutRequest
+            user_profile_referral_hit_ids = []
+            for payout in payouts:
+                if payout.user_profile_referral_hit:
+                    user_profile_referral_hit_ids.append(
+                        payout.user_profile_referral_hit.pk
+                    )
+            if user_profile_referral_hit_ids:
+                UserProfileReferralHit.objects.filter(
+                    user_profile=self.user_profile,
+                    pk__in=user_profile_referral_hit_ids,
+                ).update(
+                    payment_status=referral_payment_status,
+                )
 
-        super().save(*args, **kwargs)
+            super().save(*args, **kwargs)
+            EarningsBalance.refresh([self.user_profile_id])
 
 
 class IpTracker(TimeStampedModel):
@@ -431,6 +495,8 @@ class IpTracker(TimeStampedModel):
         null=False,
     )
     ip = models.CharField(max_length=100, blank=False, null=False)
+    # Updated once per IP_TRACKER_INTERVAL at most
+    last_seen = models.DateTimeField(default=timezone.now)
 
     class Meta:
         constraints = [
@@ -438,3 +504,61 @@ class IpTracker(TimeStampedModel):
                 fields=["user_profile", "ip"], name="unique_ip"
             )
         ]
+
+
+class EarningsBalance(models.Model):
+    """
+    Paid, requesting and unpaid amounts (cents) of a user.
+    Refreshed in the transactions which change their payouts and payout
+    requests so that reading them is a primary key lookup.
+    """
+
+    user_profile = models.OneToOneField(
+        UserProfile,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="earnings_balance",
+    )
+    paid = models.IntegerField(default=0)
+    requesting = models.IntegerField(default=0)
+    unpaid = models.IntegerField(default=0)
+
+    def __str__(self):
+        return str(self.user_profile)
+
+    @staticmethod
+    def refresh(
+        user_profile_ids: Iterable[Optional[int]], create: bool = True
+    ) -> None:
+        """
+        Compute the balances of the users from their payouts and payout
+        requests in a single statement
+        """
+        params = {
+            "paid": PayoutRequest.PAID,
+            "requesting": PayoutRequest.REQUESTING,
+            "unpaid": Payout.UNPAID,
+            "user_profile_ids": [
+                user_profile_id
+                for user_profile_id in set(user_profile_ids)
+                if user_profile_id
+            ],
+        }
+        if not params["user_profile_ids"]:
+            return
+        with transaction.atomic(savepoint=False), connection.cursor() as cursor:
+            cursor.execute(
+                LOCK_EARNINGS_BALANCES_SQL
+                if create
+                else LOCK_EXISTING_EARNINGS_BALANCES_SQL,
+                params,
+            )
+            cursor.execute(UPDATE_EARNINGS_BALANCES_SQL, params)
+
+
+@receiver(post_delete, sender=Payout)
+@receiver(post_delete, sender=PayoutRequest)
+def refresh_earnings_balance(sender, instance, **kwargs):
+    # pylint: disable=unused-argument
+    # The balance is deleted along with its user
+    EarningsBalance.refresh([instance.user_profile_id], create=False)
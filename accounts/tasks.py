@@ -0,0 +1,17 @@
+from datetime import datetime
+from typing import List, Tuple
+
+from guppy.celery import APP
+
+from .utils import save_ips
+
+
+@APP.task
+def save_ip_trackers(ips: List[Tuple[int, str, str]]) -> None:
+    """
+    Save the IPs seen by the web processes, with their ISO last seen times
+    """
+    save_ips(
+        (user_id, ip_address, datetime.fromisoformat(last_seen))
+        for user_id, ip_address, last_seen in ips
+    )
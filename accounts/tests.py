@@ -1,16 +1,27 @@
 # pylint: disable=missing-docstring
+import threading
+import time
 from datetime import datetime, timedelta
 
+import mock
 from freezegun import freeze_time
+from kombu.exceptions import OperationalError
 from rest_framework.test import APITestCase
 
 from django.contrib.auth import authenticate
-from django.test import TestCase
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
 from django.urls import reverse
 from django.utils import timezone
 
 from accounts.jobs.daily.collect_payouts import Job
+from accounts.middlewares.ip_tracker import IpTrackerMiddleware
+from accounts.tasks import save_ip_trackers
+from guppy.celery import APP, PUBLISHERS, publish_once
 from search.factories import HistoryFactory, SearchFactory
+from search.utils import record_activities
 
 from .factories import (
     PayoutFactory,
@@ -20,6 +31,7 @@ from .factories import (
     UserProfileReferralHitFactory,
 )
 from .models import (
+    EarningsBalance,
     IpTracker,
     Payout,
     PayoutRequest,
@@ -27,8 +39,10 @@ from .models import (
     UserProfileReferralHit,
 )
 from .utils import (
+    PayoutGenerator,
     calculate_referral_amount,
     get_current_payout_per_referral,
+    save_ips,
     setup_tests,
 )
 
@@ -354,6 +368,9 @@ class UserProfileTest(APITestCase):
         self.assertTrue(profile["reflink"])
 
         search = SearchFactory(user_id=self.user.pk)
+        record_activities(
+            [{"user_id": self.user.pk, "time": search.created, "searches": 1}]
+        )
         response = self.client.get(profile_url)
         self.assertEqual(response.status_code, 200)
         profile = response.data["profile"]
@@ -363,6 +380,9 @@ class UserProfileTest(APITestCase):
         )
 
         history = HistoryFactory(user_id=self.user.pk)
+        record_activities(
+            [{"user_id": self.user.pk, "time": history.created, "histories": 1}]
+        )
         response = self.client.get(profile_url)
         self.assertEqual(response.status_code, 200)
         profile = response.data["profile"]
@@ -372,6 +392,9 @@ class UserProfileTest(APITestCase):
         )
 
         search_2 = SearchFactory(user_id=self.user.pk)
+        record_activities(
+            [{"user_id": self.user.pk, "time": search_2.created, "searches": 1}]
+        )
         response = self.client.get(profile_url)
         self.assertEqual(response.status_code, 200)
         profile = response.data["profile"]
@@ -386,6 +409,9 @@ class UserProfileTest(APITestCase):
         date = timezone.now() - timedelta(days=8)
         search.created = date
         search.save()
+        record_activities(
+            [{"user_id": self.user.pk, "time": date, "searches": 1}]
+        )
         response = self.client.get(profile_url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["profile"]["status"], False)
@@ -397,6 +423,9 @@ class UserProfileTest(APITestCase):
         history = HistoryFactory(user_id=self.user.pk)
         history.created = date
         history.save()
+        record_activities(
+            [{"user_id": self.user.pk, "time": date, "histories": 1}]
+        )
         response = self.client.get(profile_url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data["profile"]["status"], False)
@@ -409,6 +438,9 @@ class UserProfileTest(APITestCase):
         date = timezone.now() - timedelta(days=6)
         search_2.created = date
         search_2.save()
+        record_activities(
+            [{"user_id": self.user.pk, "time": date, "searches": 1}]
+        )
         response = self.client.get(profile_url)
         self.assertEqual(response.status_code, 200)
         self.assertTrue(response.data["profile"]["status"], True)
@@ -504,7 +536,7 @@ class PayoutTest(TestCase):
         with freeze_time(datetime(2022, 3, 1)):
             PostData.create_history(self)
             self.daily_job.execute()
-            payouts = Payout.objects.all()
+            payouts = Payout.objects.order_by("pk")
             self.assertEqual(payouts.count(), 2)
             payout = payouts[1]
             self.assertEqual(payout.user_profile.pk, self.user.pk)
@@ -548,6 +580,20 @@ class PayoutTest(TestCase):
         for payout in payouts:
             self.assertEqual(payout.amount, int(1000 / 31 / 10))
 
+    def test_payout_activities_once_a_day(self):
+        for user in self.users[:3]:
+            PostData.create_history(self, user)
+        PayoutFactory(user_profile=self.users[0], date=datetime.now().date())
+
+        # Count active users, then insert the missing payouts
+        with self.assertNumQueries(4):
+            created = PayoutGenerator.create_activities_payouts()
+        self.assertEqual(created, 2)
+        self.assertEqual(PayoutGenerator.create_activities_payouts(), 0)
+        self.assertEqual(Payout.objects.count(), 3)
+        for user in self.users[:3]:
+            self.assertEqual(user.payouts.count(), 1)
+
 
 def assert_amounts(response, amounts):
     """Helper function to assert amounts from response"""
@@ -964,6 +1010,90 @@ class PayoutAmountTest(TestCase):
             },
         )
 
+    def test_referral_payouts_in_bulk(self):
+        referral_link = self.user.get_refferal_link()
+        user_referral_hits = []
+        for user in self.users[1:]:
+            user_referral_hits.append(
+                UserProfileReferralHitFactory(
+                    user_profile=self.user,
+                    referral_hit=ReferralHitFactory(
+                        hit_user=user, referral_link=referral_link
+                    ),
+                )
+            )
+        for user in self.users[1:4]:
+            PayoutFactory.create_batch(90, user_profile=user)
+        PayoutFactory.create_batch(89, user_profile=self.users[4])
+
+        # Same number of queries whatever the number of referrals
+        with self.assertNumQueries(8):
+            PayoutGenerator.create_referral_payouts()
+        payouts = Payout.objects.filter(payout_type="referral").order_by(
+            "user_profile_referral_hit"
+        )
+        self.assertEqual(
+            [payout.user_profile_referral_hit for payout in payouts],
+            user_referral_hits[:3],
+        )
+        self.assertEqual([payout.amount for payout in payouts], [99, 97, 95])
+        self.assertEqual(payouts[2].note, "Total: 100, Referral #3")
+        for user_referral_hit in user_referral_hits[:3]:
+            self.assertTrue(
+                assert_payment_status(
+                    user_referral_hit, UserProfileReferralHit.OPENED
+                )
+            )
+        self.assertTrue(
+            assert_payment_status(
+                user_referral_hits[3], UserProfileReferralHit.NONE
+            )
+        )
+
+        PayoutFactory(user_profile=self.users[4])
+        with self.assertNumQueries(8):
+            PayoutGenerator.create_referral_payouts()
+        payout = Payout.objects.get(
+            user_profile_referral_hit=user_referral_hits[3]
+        )
+        self.assertEqual(payout.amount, 93)
+
+    def test_earnings_balance(self):
+        def get_balance():
+            balance = EarningsBalance.objects.get(user_profile=self.user)
+            return [balance.paid, balance.requesting, balance.unpaid]
+
+        payouts = PayoutFactory.create_batch(
+            3, user_profile=self.user, amount=500
+        )
+        PayoutFactory(user_profile=self.users[1], amount=500)
+        self.assertEqual(get_balance(), [0, 0, 1500])
+
+        payouts[0].delete()
+        self.assertEqual(get_balance(), [0, 0, 1000])
+
+        PostData.login(self)
+        response = self.client.get(reverse("payouts_request_api"))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(get_balance(), [0, 1000, 0])
+        response = self.client.get(reverse("payouts_request_api"))
+        self.assertEqual(response.status_code, 401)
+
+        payout_request = PayoutRequest.objects.get(user_profile=self.user)
+        payout_request.payment_status = PayoutRequest.PAID
+        payout_request.save()
+        self.assertEqual(get_balance(), [1000, 0, 0])
+        self.assertEqual(
+            get_balance(),
+            [
+                self.user.get_earned_amount(Payout.PAID),
+                self.user.get_earned_amount(Payout.REQUESTING),
+                self.user.get_earned_amount(Payout.UNPAID),
+            ],
+        )
+        balance = EarningsBalance.objects.get(user_profile=self.users[1])
+        self.assertEqual(balance.unpaid, 500)
+
     def test_referral_amount_calculator(self):
         total = 100
         self.assertEqual(calculate_referral_amount(0, total), 0)
@@ -985,9 +1115,46 @@ class PayoutAmountTest(TestCase):
         self.assertTrue(amount_total < 10000)
 
 
+class EarningsBalanceConcurrencyTests(TransactionTestCase):
+    def test_concurrent_payouts(self):
+        user = UserProfileFactory()
+
+        def create_payout():
+            PayoutFactory(user_profile=user, amount=300)
+            connection.close()
+
+        with transaction.atomic():
+            PayoutFactory(user_profile=user, amount=500)
+            # Waits for the balance locked by this transaction
+            thread = threading.Thread(target=create_payout)
+            thread.start()
+            time.sleep(0.2)
+        thread.join()
+        self.assertEqual(
+            EarningsBalance.objects.get(user_profile=user).unpaid, 800
+        )
+
+
+START_TIMER = IpTrackerMiddleware.start_timer
+
+
+def save_now(task, args, _timeout):
+    task(*args)
+
+
+@override_settings(IP_TRACKER_BATCH_SIZE=1)
 class IpTrackerTests(APITestCase):
     def setUp(self):
         self.user = setup_tests(self.client)
+        # Saved by the request, not by a worker or a timer thread
+        for patcher in (
+            mock.patch(
+                "accounts.middlewares.ip_tracker.publish_once", save_now
+            ),
+            mock.patch.object(IpTrackerMiddleware, "start_timer"),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
 
     def test_track_ip(self):
         ips = IpTracker.objects.count()
@@ -1001,3 +1168,119 @@ class IpTrackerTests(APITestCase):
         self.client.get(profile_url)
         ips = IpTracker.objects.count()
         self.assertEqual(ips, 1)
+
+    def test_track_ip_once_per_interval(self):
+        middleware = IpTrackerMiddleware(lambda request: HttpResponse())
+        with freeze_time(datetime(2022, 3, 1, 10, 30)):
+            with self.assertNumQueries(1):
+                middleware.track(self.user.pk, "10.0.0.1")
+            with self.assertNumQueries(0):
+                middleware.track(self.user.pk, "10.0.0.1")
+                # Seen by another process
+                IpTrackerMiddleware(lambda request: HttpResponse()).track(
+                    self.user.pk, "10.0.0.1"
+                )
+
+        with freeze_time(datetime(2022, 3, 1, 11, 5)):
+            with self.assertNumQueries(1):
+                middleware.track(self.user.pk, "10.0.0.1")
+        ip_tracker = IpTracker.objects.get()
+        self.assertEqual(ip_tracker.ip, "10.0.0.1")
+        self.assertEqual(
+            ip_tracker.last_seen,
+            datetime(2022, 3, 1, 11, 5, tzinfo=timezone.utc),
+        )
+
+    @override_settings(IP_TRACKER_FLUSH_INTERVAL=60, IP_TRACKER_BATCH_SIZE=3)
+    def test_track_ips_in_batches(self):
+        middleware = IpTrackerMiddleware(lambda request: HttpResponse())
+        with self.assertNumQueries(0):
+            middleware.track(self.user.pk, "10.0.0.1")
+            middleware.track(self.user.pk, "10.0.0.2")
+        with self.assertNumQueries(1):
+            middleware.track(self.user.pk, "10.0.0.3")
+        self.assertEqual(
+            sorted(IpTracker.objects.values_list("ip", flat=True)),
+            ["10.0.0.1", "10.0.0.2", "10.0.0.3"],
+        )
+
+    @override_settings(IP_TRACKER_FLUSH_INTERVAL=0.1, IP_TRACKER_BATCH_SIZE=3)
+    def test_send_ips_of_idle_process(self):
+        middleware = IpTrackerMiddleware(lambda request: HttpResponse())
+        # The timer thread only publishes the batch, it does not save it
+        with mock.patch.object(
+            IpTrackerMiddleware, "start_timer", START_TIMER
+        ), mock.patch(
+            "accounts.middlewares.ip_tracker.publish_once"
+        ) as publish_mock:
+            middleware.track(self.user.pk, "10.0.0.1")
+            # Until the timer sends it
+            self.assertEqual(publish_mock.call_count, 0)
+            time.sleep(0.3)
+        self.assertEqual(publish_mock.call_count, 1)
+        self.assertEqual(
+            publish_mock.call_args[0][1][0][0][:2], (self.user.pk, "10.0.0.1")
+        )
+
+    def test_track_ip_again_if_not_sent(self):
+        middleware = IpTrackerMiddleware(lambda request: HttpResponse())
+        with mock.patch(
+            "accounts.middlewares.ip_tracker.publish_once",
+            side_effect=OperationalError,
+        ) as publish_mock:
+            middleware.track(self.user.pk, "10.0.0.1")
+        self.assertEqual(publish_mock.call_args[0][2], 0.5)
+        self.assertEqual(IpTracker.objects.count(), 0)
+        middleware.track(self.user.pk, "10.0.0.1")
+        self.assertEqual(IpTracker.objects.count(), 1)
+
+    def test_publish_once(self):
+        with mock.patch.object(
+            save_ip_trackers, "apply_async"
+        ) as apply_async, mock.patch.object(
+            APP, "connection_for_write"
+        ) as connection_for_write:
+            publish_once(save_ip_trackers, ([],), 0.5)
+            publish_once(save_ip_trackers, ([],), 0.5)
+            # One connection per thread, which waits for the broker 0.5s
+            connection_for_write.assert_called_once_with(
+                connect_timeout=0.5, transport_options={"max_retries": 0}
+            )
+            self.assertEqual(
+                apply_async.call_args[1],
+                {
+                    "connection": connection_for_write.return_value,
+                    "retry": False,
+                    "timeout": 0.5,
+                },
+            )
+
+            apply_async.side_effect = OperationalError
+            with self.assertRaises(OperationalError):
+                publish_once(save_ip_trackers, ([],), 0.5)
+            connection_for_write.return_value.release.assert_called_once()
+            apply_async.side_effect = None
+            publish_once(save_ip_trackers, ([],), 0.5)
+            self.assertEqual(connection_for_write.call_count, 2)
+            PUBLISHERS.connection = None
+
+    def test_save_ips(self):
+        now = timezone.now()
+        user2 = UserProfileFactory()
+        deleted_user = UserProfileFactory()
+        deleted_user_id = deleted_user.pk
+        deleted_user.delete()
+        save_ips(
+            [
+                (self.user.pk, "10.0.0.1", now - timedelta(hours=1)),
+                (self.user.pk, "10.0.0.1", now),
+                (user2.pk, "10.0.0.1", now),
+                (deleted_user_id, "10.0.0.1", now),
+            ]
+        )
+        # An older sighting does not move last_seen back
+        save_ips([(self.user.pk, "10.0.0.1", now - timedelta(days=1))])
+        self.assertEqual(
+            sorted(IpTracker.objects.values_list("user_profile", "last_seen")),
+            sorted([(self.user.pk, now), (user2.pk, now)]),
+        )
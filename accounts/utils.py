@@ -1,15 +1,47 @@
 import calendar
 import logging
 from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Tuple
 
 from django.contrib.auth import authenticate
-from django.db.models import QuerySet
+from django.db import connection, transaction
+from django.db.models import Count, Exists, OuterRef, QuerySet
 from django.utils import timezone
 
-from .models import Payout, UserProfile, UserProfileReferralHit
+from .models import EarningsBalance, Payout, UserProfile, UserProfileReferralHit
 
 LOGGER = logging.getLogger(__name__)
 FIXED_AMOUNT = 1000  # $10 = 1000 cents
+# Also add the created payouts to the unpaid balances
+ACTIVITIES_PAYOUTS_SQL = """
+WITH payouts AS (
+    INSERT INTO accounts_payout
+        (created, modified, user_profile_id, amount, payment_status,
+        payout_type, note, date)
+    SELECT %s, %s, active_users.id, %s, %s, %s, %s, %s
+    FROM ({active_users}) AS active_users
+    ON CONFLICT DO NOTHING
+    RETURNING user_profile_id, amount
+)
+INSERT INTO accounts_earningsbalance
+    (user_profile_id, paid, requesting, unpaid)
+SELECT user_profile_id, 0, 0, amount FROM payouts
+ON CONFLICT (user_profile_id) DO UPDATE SET
+    unpaid = accounts_earningsbalance.unpaid + EXCLUDED.unpaid
+"""
+
+IP_TRACKERS_BATCH_SIZE = 1000
+# Skip the users deleted since their IPs were seen
+IP_TRACKERS_UPSERT_SQL = """
+INSERT INTO accounts_iptracker
+    (created, modified, user_profile_id, ip, last_seen)
+SELECT %s, %s, users.id, ips.ip, ips.last_seen
+FROM (VALUES {values}) AS ips (user_profile_id, ip, last_seen)
+JOIN accounts_userprofile AS users ON users.id = ips.user_profile_id
+ON CONFLICT (user_profile_id, ip) DO UPDATE SET
+    modified = EXCLUDED.modified,
+    last_seen = GREATEST(accounts_iptracker.last_seen, EXCLUDED.last_seen)
+"""
 
 
 def setup_tests(client):
@@ -29,6 +61,37 @@ def setup_tests_admin(client):
     return user
 
 
+def save_ips(ips: Iterable[Tuple[int, str, datetime]]) -> None:
+    """
+    Save the (user id, ip, last seen) sightings of the users
+    """
+    # A statement can not update the same row twice
+    last_seen = {}  # type: Dict[Tuple[int, str], datetime]
+    for user_id, ip_address, seen in ips:
+        key = (user_id, ip_address)
+        last_seen[key] = max(seen, last_seen.get(key, seen))
+    rows = [
+        (user_id, ip_address, seen)
+        for (user_id, ip_address), seen in last_seen.items()
+    ]
+
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), IP_TRACKERS_BATCH_SIZE):
+            end = start + IP_TRACKERS_BATCH_SIZE
+            batch = rows[start:end]
+            params = [now, now]  # type: List[Any]
+            params.extend(value for row in batch for value in row)
+            cursor.execute(
+                IP_TRACKERS_UPSERT_SQL.format(
+                    values=", ".join(
+                        ["(%s::integer, %s, %s::timestamptz)"] * len(batch)
+                    )
+                ),
+                params,
+            )
+
+
 def get_all_active_users() -> QuerySet[UserProfile]:
     past_seven_date = timezone.now() - timedelta(days=6)
     # Reset to begin of the day
@@ -97,33 +160,44 @@ class PayoutGenerator:
     """
 
     @staticmethod
-    def create_activities_payouts() -> None:
+    def create_activities_payouts() -> int:
         """
         Helper function used to create payouts for all active users today
+        Users who already got today's payout are skipped thanks to the
+        `unique_activities_payout` constraint.
+        Return the number of created payouts
         """
-        # Get all active users
-        users = get_all_active_users()
-
-        total_users = users.count()
-        if total_users == 0:
-            LOGGER.info("No active users.")
-
-        # Calculate amount
-        amount = calculate_amount(total_users)
-        note = f"Total users: {total_users}, Fixed amount: {FIXED_AMOUNT}"
-
-        # Create payouts for all active users
-        today = date.today()
-        for user in users:
-            Payout.objects.get_or_create(
-                user_profile=user,
-                date=today,
-                payout_type="activities",
-                defaults={
-                    "amount": amount,
-                    "note": note,
-                },
-            )
+        with transaction.atomic():
+            # Get all active users
+            users = get_all_active_users()
+
+            total_users = users.count()
+            if total_users == 0:
+                LOGGER.info("No active users.")
+                return 0
+
+            # Calculate amount
+            amount = calculate_amount(total_users)
+            note = f"Total users: {total_users}, Fixed amount: {FIXED_AMOUNT}"
+
+            # Create payouts for all active users in a single statement
+            now = timezone.now()
+            sql, params = users.values("pk").query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    ACTIVITIES_PAYOUTS_SQL.format(active_users=sql),
+                    [
+                        now,
+                        now,
+                        amount,
+                        Payout.UNPAID,
+                        "activities",
+                        note,
+                        date.today(),
+                        *params,
+                    ],
+                )
+                return cursor.rowcount
 
     @staticmethod
     def create_referral_payouts() -> None:
@@ -131,37 +205,58 @@ class PayoutGenerator:
         Helper function used to create payouts for all referral
         which referred activate user (earned 90 payouts)
         """
-        # Get all referral which do not requested or paid
-        user_referrals = UserProfileReferralHit.objects.filter(
-            payment_status=UserProfileReferralHit.NONE,
-        ).order_by("pk")
-        # Count the current valid referrals
-        number_of_referral = UserProfileReferralHit.objects.exclude(
-            payment_status=UserProfileReferralHit.NONE
-        ).count()
-        total = 100
-        today = date.today()
-        # Create referral payouts
-        for referral in user_referrals:
-            if referral.referral_hit.hit_user:
-                activate_days = referral.referral_hit.hit_user.payouts.count()
-                if activate_days == 90:
-                    number_of_referral += 1
-                    amount = calculate_referral_amount(
-                        number_of_referral, total
-                    )
-                    note = f"Total: {total}, Referral #{number_of_referral}"
-
-                    Payout.objects.get_or_create(
-                        user_profile=referral.user_profile,
-                        user_profile_referral_hit=referral,
+        with transaction.atomic():
+            # Get all referral which do not requested or paid
+            # and whose referred user earned 90 payouts
+            user_referrals = (
+                UserProfileReferralHit.objects.filter(
+                    payment_status=UserProfileReferralHit.NONE,
+                )
+                .annotate(
+                    activate_days=Count("referral_hit__hit_user__payouts"),
+                    has_payout=Exists(
+                        Payout.objects.filter(
+                            user_profile=OuterRef("user_profile"),
+                            user_profile_referral_hit=OuterRef("pk"),
+                            payout_type="referral",
+                        )
+                    ),
+                )
+                .filter(activate_days=90)
+                .order_by("pk")
+                .values_list("pk", "user_profile_id", "has_payout")
+            )
+            # Count the current valid referrals
+            number_of_referral = UserProfileReferralHit.objects.exclude(
+                payment_status=UserProfileReferralHit.NONE
+            ).count()
+            total = 100
+            today = date.today()
+            # Create referral payouts, numbered in the referrals order
+            payouts = []
+            referral_ids = []
+            for referral_id, user_profile_id, has_payout in user_referrals:
+                number_of_referral += 1
+                referral_ids.append(referral_id)
+                if has_payout:
+                    continue
+                payouts.append(
+                    Payout(
+                        user_profile_id=user_profile_id,
+                        user_profile_referral_hit_id=referral_id,
                         payout_type="referral",
-                        defaults={
-                            "date": today,
-                            "amount": amount,
-                            "note": note,
-                        },
+                        date=today,
+                        amount=calculate_referral_amount(
+                            number_of_referral, total
+                        ),
+                        note=f"Total: {total}, Referral #{number_of_referral}",
                     )
-                    # Update referral payment status
-                    referral.payment_status = UserProfileReferralHit.OPENED
-                    referral.save()
+                )
+            Payout.objects.bulk_create(payouts)
+            EarningsBalance.refresh(
+                payout.user_profile_id for payout in payouts
+            )
+            # Update referrals payment status
+            UserProfileReferralHit.objects.filter(pk__in=referral_ids).update(
+                payment_status=UserProfileReferralHit.OPENED
+            )
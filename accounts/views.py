@@ -22,6 +22,7 @@ from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.db import transaction
 from django.middleware.csrf import get_token
 from django.shortcuts import redirect, render
 from django.utils import timezone
@@ -33,7 +34,7 @@ from .forms import (
     CustomUserChangeForm,
     CustomUserCreationForm,
 )
-from .models import Payout, UserProfile, UserProfileReferralHit
+from .models import EarningsBalance, Payout, UserProfile, UserProfileReferralHit
 from .utils import cents_to_dollars
 
 LOGGER = logging.getLogger(__name__)
@@ -233,9 +234,10 @@ class UserProfileView(LoginRequiredMixin, DetailView):
         self.object = self.get_object()
         context = self.get_context_data(object=self.object)
 
-        paid_amount = self.object.get_earned_amount(Payout.PAID)
-        requesting_amount = self.object.get_earned_amount(Payout.REQUESTING)
-        unpaid_amount = self.object.get_earned_amount(Payout.UNPAID)
+        balance = self.object.get_earnings_balance()
+        paid_amount = balance.paid
+        requesting_amount = balance.requesting
+        unpaid_amount = balance.unpaid
         context["profile"] = {
             "paid_amount": paid_amount,
             "paid_amount_text": cents_to_dollars(paid_amount),
@@ -290,10 +292,13 @@ class UserProfileAPIView(APIView):
         """
         try:
             user = request.user
-            profile = UserProfile.objects.get(email=user)
-            paid_amount = profile.get_earned_amount(Payout.PAID)
-            requesting_amount = profile.get_earned_amount(Payout.REQUESTING)
-            unpaid_amount = profile.get_earned_amount(Payout.UNPAID)
+            profile = UserProfile.objects.select_related(
+                "earnings_balance"
+            ).get(email=user)
+            balance = profile.get_earnings_balance()
+            paid_amount = balance.paid
+            requesting_amount = balance.requesting
+            unpaid_amount = balance.unpaid
             content = {
                 "user": str(request.user),
                 "auth": str(request.auth),
@@ -339,31 +344,36 @@ class PayoutAPIView(ViewSet):
         user = request.user
         profile = UserProfile.objects.get(email=user)
 
-        requesting_amount = profile.get_earned_amount(Payout.REQUESTING)
-        if requesting_amount:
-            return Response(
-                {"message": "You cannot request more than one payout"},
-                status=status.HTTP_401_UNAUTHORIZED,
-            )
+        with transaction.atomic():
+            # Lock the balance so that the requests of a user are serialized
+            balance = (
+                EarningsBalance.objects.select_for_update()
+                .filter(user_profile=profile)
+                .first()
+            ) or EarningsBalance(user_profile=profile)
+            if balance.requesting:
+                return Response(
+                    {"message": "You cannot request more than one payout"},
+                    status=status.HTTP_401_UNAUTHORIZED,
+                )
 
-        unpaid_payouts = profile.get_earned_amount(
-            status=Payout.UNPAID,
-            return_objects=True,
-        )
+            if balance.unpaid < 1000:
+                return Response(
+                    {"message": "Minimum Guppy payout is $10"},
+                    status=status.HTTP_401_UNAUTHORIZED,
+                )
 
-        if unpaid_payouts["amount"] < 1000:
-            return Response(
-                {"message": "Minimum Guppy payout is $10"},
-                status=status.HTTP_401_UNAUTHORIZED,
+            # Create payout request, which also updates the requested payouts
+            unpaid_payouts = list(
+                profile.get_earned_payouts(Payout.UNPAID).values_list(
+                    "pk", "amount"
+                )
+            )
+            user.payout_requests.create(
+                amount=sum(amount or 0 for _, amount in unpaid_payouts),
+                payout_ids=json.dumps(
+                    [payout_id for payout_id, _ in unpaid_payouts]
+                ),
             )
-
-        # Create payout request
-        payout_ids = unpaid_payouts["objects"].values_list("pk", flat=True)
-        user.payout_requests.create(
-            amount=unpaid_payouts["amount"],
-            payout_ids=json.dumps(list(payout_ids)),
-        )
-        # Update requesting payouts
-        unpaid_payouts["objects"].update(payment_status=Payout.REQUESTING)
 
         return Response({}, status=status.HTTP_201_CREATED)
@@ -1,6 +1,13 @@
 from django.contrib import admin
 
-from .models import Ad, AdBrand, AdSize, Advertisement, Advertiser
+from .models import (
+    Ad,
+    AdBrand,
+    AdImpressionHour,
+    AdSize,
+    Advertisement,
+    Advertiser,
+)
 
 
 @admin.register(Advertiser)
@@ -23,11 +30,12 @@ class AdSizeAdmin(admin.ModelAdmin):
 
 @admin.register(Advertisement)
 class AdvertisementAdmin(admin.ModelAdmin):
-    list_display = ("url", "image", "monthly_budget")
+    list_display = ("url", "image", "monthly_budget", "cost_per_mille")
 
     def get_form(self, request, obj=None, change=False, **kwargs):
         form = super().get_form(request, obj, change, **kwargs)
         form.base_fields["monthly_budget"].label = "Monthly Budget (cent)"
+        form.base_fields["cost_per_mille"].label = "Cost Per Mille (cent)"
         return form
 
 
@@ -38,5 +46,13 @@ class AdBrandAdmin(admin.ModelAdmin):
 
 @admin.register(Ad)
 class AdAdmin(admin.ModelAdmin):
-    list_display = ("brand", "size", "view", "is_enabled")
+    list_display = ("brand", "size", "advertisement", "view", "is_enabled")
     list_filter = ["brand"]
+
+
+@admin.register(AdImpressionHour)
+class AdImpressionHourAdmin(admin.ModelAdmin):
+    list_display = ("ad", "hour", "views")
+    list_filter = ["ad__brand"]
+    list_select_related = ["ad__brand", "ad__size"]
+    date_hierarchy = "hour"
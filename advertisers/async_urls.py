@@ -0,0 +1,26 @@
+"""
+URLs of the ads served by `guppy.ads_asgi`, same as in `advertisers.urls`
+"""
+
+from django.urls import path
+
+from advertisers import async_views
+
+urlpatterns = [
+    path("advertisers/ads/<width>/<height>/", async_views.ads, name="ads_view"),
+    path(
+        "advertisers/ads/<width>/<height>/<brand>",
+        async_views.ads,
+        name="ads_brand_view",
+    ),
+    path(
+        "advertisers/ads-checker/<width>/<height>/",
+        async_views.ads_checker,
+        name="ads_checker",
+    ),
+    path(
+        "advertisers/ads/popup/",
+        async_views.popup_ads,
+        name="popup_ads_view",
+    ),
+]
@@ -0,0 +1,86 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+
+from django.db import close_old_connections
+from django.http import (
+    HttpResponseNotAllowed,
+    HttpResponseNotFound,
+    JsonResponse,
+)
+
+from advertisers.utils import check_ads, get_popup_ad, serve_ad
+
+from .views import get_ads_checker_response, get_ads_response
+
+
+def in_thread(func):
+    """
+    Run the function in a thread of the executor instead of the event loop,
+    closing the database connection of the thread when it is unusable or older
+    than `CONN_MAX_AGE`, like at the start and the end of a request
+    """
+
+    @wraps(func)
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            close_old_connections()
+
+    return sync_to_async(run, thread_sensitive=False)
+
+
+# The inventory is read from the cache, and rebuilt from the database once
+# in a while
+serve_ad_in_thread = in_thread(serve_ad)
+check_ads_in_thread = in_thread(check_ads)
+get_popup_ad_in_thread = in_thread(get_popup_ad)
+
+
+async def ads(request, width=0, height=0, brand="all"):
+    """
+    Show ads with size, see `views.ads`
+    """
+
+    width = round(float(width))
+    height = round(float(height))
+
+    if not width or not height:
+        return HttpResponseNotFound("Not found")
+
+    content, etag = await serve_ad_in_thread(width, height, brand)
+    response = get_ads_response(request, content, etag)
+    # `xframe_options_exempt` only decorates sync views
+    response.xframe_options_exempt = True
+    return response
+
+
+async def ads_checker(request, width=0, height=0):
+    """
+    Check if having an ad for size, see `views.ads_checker`
+    """
+
+    width = round(float(width))
+    height = round(float(height))
+    if not width or not height:
+        return HttpResponseNotFound("Not found")
+    has_ads, etag = await check_ads_in_thread(width, height)
+    return get_ads_checker_response(request, has_ads, etag)
+
+
+async def popup_ads(request):
+    """
+    Show popup ads code, see `views.popup_ads`
+    """
+
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+
+    popup_ad = await get_popup_ad_in_thread()
+
+    if popup_ad:
+        return JsonResponse({"has_ads": True, "code": popup_ad.code})
+
+    return JsonResponse({"has_ads": False})
@@ -0,0 +1,124 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Tuple
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from search.models import get_hash
+
+from .models import Ad
+from .selection import count_month_impression
+
+LOGGER = logging.getLogger(__name__)
+# Impressions are counted per ad and hour in the cache
+IMPRESSIONS_CACHE_KEY = "ad_impressions:{ad_id}:{hour:%Y%m%d%H}"
+IMPRESSIONS_CACHE_TIMEOUT = 2 * 24 * 60 * 60
+# Hours of counters read by the flush, older ones are lost
+IMPRESSIONS_FLUSH_HOURS = 24
+# Advisory lock of the flush job
+IMPRESSIONS_FLUSH_LOCK = get_hash("ad_impressions_flush")
+AD_IMPRESSION_HOURS_UPSERT_SQL = """
+INSERT INTO advertisers_adimpressionhour (ad_id, hour, views)
+VALUES {values}
+ON CONFLICT (ad_id, hour) DO UPDATE SET
+    views = advertisers_adimpressionhour.views + EXCLUDED.views
+"""
+
+
+def get_hour(time: datetime) -> datetime:
+    return time.replace(minute=0, second=0, microsecond=0)
+
+
+def record_impression(ad_id: int) -> None:
+    """
+    Count an impression of an ad without writing to the database
+    """
+    key = IMPRESSIONS_CACHE_KEY.format(
+        ad_id=ad_id, hour=get_hour(timezone.now())
+    )
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, IMPRESSIONS_CACHE_TIMEOUT):
+            # Added by another process in the meantime
+            cache.incr(key)
+    count_month_impression(ad_id)
+
+
+def flush_impressions() -> int:
+    """
+    Add the impressions counted in the cache to the ad views and to their
+    hourly buckets, and remove them from the cache once written
+    Return the number of flushed impressions
+    """
+    with connection.cursor() as cursor:
+        # Until the flushed counters are decremented
+        cursor.execute(
+            "SELECT pg_try_advisory_lock(%s)", [IMPRESSIONS_FLUSH_LOCK]
+        )
+        if not cursor.fetchone()[0]:
+            LOGGER.info("Ad impressions are being flushed by another job.")
+            return 0
+        try:
+            return write_impressions()
+        finally:
+            cursor.execute(
+                "SELECT pg_advisory_unlock(%s)", [IMPRESSIONS_FLUSH_LOCK]
+            )
+
+
+def write_impressions() -> int:
+    """
+    Write the cached impressions to the database, then decrement them in the
+    cache so that a failed write keeps them for the next flush
+    """
+    now = get_hour(timezone.now())
+    hours = [now - timedelta(hours=i) for i in range(IMPRESSIONS_FLUSH_HOURS)]
+    keys = {
+        IMPRESSIONS_CACHE_KEY.format(ad_id=ad_id, hour=hour): (ad_id, hour)
+        for ad_id in Ad.objects.values_list("pk", flat=True)
+        for hour in hours
+    }
+    counts = {
+        key: count for key, count in cache.get_many(keys).items() if count
+    }
+    if not counts:
+        return 0
+
+    impressions = {}  # type: Dict[Tuple[int, datetime], int]
+    views = {}  # type: Dict[int, int]
+    for key, count in counts.items():
+        impressions[keys[key]] = count
+        ad_id = keys[key][0]
+        views[ad_id] = views.get(ad_id, 0) + count
+    with transaction.atomic():
+        Ad.objects.filter(pk__in=views).update(
+            view=F("view")
+            + Case(
+                *[
+                    When(pk=ad_id, then=Value(count))
+                    for ad_id, count in views.items()
+                ],
+                output_field=IntegerField(),
+            )
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(
+                AD_IMPRESSION_HOURS_UPSERT_SQL.format(
+                    values=", ".join(["(%s, %s, %s)"] * len(impressions))
+                ),
+                [
+                    value
+                    for (ad_id, hour), count in impressions.items()
+                    for value in (ad_id, hour, count)
+                ],
+            )
+
+    # Only once written, a failed flush leaves them to the next one. The
+    # impressions counted since the read are kept.
+    for key, count in counts.items():
+        cache.decr(key, count)
+    return sum(views.values())
@@ -0,0 +1,348 @@
+import hashlib
+import time
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.http import quote_etag
+
+from .models import INVENTORY_VERSION_CACHE_KEY, Ad, AdSize
+from .selection import AliasTable, get_month_impressions, get_pacing_weight
+
+ALL_BRANDS = "all"
+# Deviation percents tried in order before falling back to the best score
+DEVIATION_PERCENTS = np.arange(5, 31, 5)
+
+
+def get_deviation_rate(value: int, size_value: int) -> float:
+    return abs(value - size_value) * 100 / max(value, size_value)
+
+
+def find_closest_ad_size(
+    width: int, height: int, ad_sizes: Sequence[AdSize]
+) -> Optional[AdSize]:
+    """
+    Find the size closest to the requested one, one size at a time.
+    Reference implementation of `AdSizeMatcher`.
+    """
+    for percent in range(5, 31, 5):
+        for ad_size in ad_sizes:
+            # Return size if width and height are matched
+            if width == ad_size.width and height == ad_size.height:
+                return ad_size
+
+            # Return size if the deviations are less than the percent
+            if (
+                get_deviation_rate(width, ad_size.width) <= percent
+                and get_deviation_rate(height, ad_size.height) <= percent
+            ):
+                return ad_size
+
+    # If can not find the size, return the size has the min deviation rate
+    min_deviation_rate = 0.0
+    matched_image = None
+    for ad_size in ad_sizes:
+        ratio_deviation_rate = abs(
+            (width / height) - (ad_size.width / ad_size.height)
+        )
+        # Calculate the total
+        # with the most important parameter being ratio_deviation_rate
+        total_rate = (
+            get_deviation_rate(width, ad_size.width)
+            + get_deviation_rate(height, ad_size.height)
+            + (ratio_deviation_rate * 150)
+        )
+
+        # Return size which have total deviation is minimum
+        if min_deviation_rate == 0 or min_deviation_rate > total_rate:
+            min_deviation_rate = total_rate
+            matched_image = ad_size
+
+    return matched_image
+
+
+class AdSizeMatcher:
+    """
+    Find the closest sizes like `find_closest_ad_size`, with all the
+    deviation rates of the sizes computed at once by NumPy.
+    """
+
+    CHUNK_SIZE = 4096
+
+    def __init__(self, ad_sizes: Sequence[AdSize]):
+        self.ad_sizes = list(ad_sizes)
+        self.widths = np.array(
+            [ad_size.width for ad_size in self.ad_sizes], dtype=np.int64
+        )
+        self.heights = np.array(
+            [ad_size.height for ad_size in self.ad_sizes], dtype=np.int64
+        )
+
+    def find(self, width: int, height: int) -> Optional[AdSize]:
+        """
+        Find the size closest to the requested one
+        """
+        if not self.ad_sizes:
+            return None
+
+        # Sizes are compared by chunks to stop at the first chunk having a
+        # size within the lowest percent, like the loop
+        best_index, best_percent_index = 0, len(DEVIATION_PERCENTS)
+        for start in range(0, len(self.ad_sizes), self.CHUNK_SIZE):
+            end = start + self.CHUNK_SIZE
+            width_deviation_rates, height_deviation_rates = self._deviations(
+                width, height, start, end
+            )
+            # Index of the first percent accepting each size (6 if none),
+            # the first size of the lowest accepting percent is returned
+            percent_indexes = np.searchsorted(
+                DEVIATION_PERCENTS,
+                np.maximum(width_deviation_rates, height_deviation_rates),
+            )
+            index = int(np.argmin(percent_indexes))
+            if percent_indexes[index] < best_percent_index:
+                best_index = start + index
+                best_percent_index = percent_indexes[index]
+            if best_percent_index == 0:
+                break
+        if best_percent_index < len(DEVIATION_PERCENTS):
+            return self.ad_sizes[best_index]
+
+        # If can not find the size, return the size has the min deviation rate
+        # with the most important parameter being the ratio deviation
+        width_deviation_rates, height_deviation_rates = self._deviations(
+            width, height
+        )
+        ratio_deviation_rates = np.abs(
+            (width / height) - (self.widths / self.heights)
+        )
+        total_rates = (
+            width_deviation_rates
+            + height_deviation_rates
+            + (ratio_deviation_rates * 150)
+        )
+        return self.ad_sizes[int(np.argmin(total_rates))]
+
+    def _deviations(
+        self,
+        width: int,
+        height: int,
+        start: int = 0,
+        end: Optional[int] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        widths = self.widths[start:end]
+        heights = self.heights[start:end]
+        return (
+            np.abs(width - widths) * 100 / np.maximum(width, widths),
+            np.abs(height - heights) * 100 / np.maximum(height, heights),
+        )
+
+
+class AdInventory:
+    """
+    Snapshot of the servable ads, grouped by (brand, size).
+
+    The snapshot is rebuilt when the inventory version saved in the cache
+    changes, i.e. when an ad, a size or a brand is saved or deleted, so
+    that serving an ad does not query the database.
+
+    Ads are chosen from the alias table of their group, weighted by the
+    pacing of their monthly budget. The weights are refreshed from the
+    shared impression counters by `refresh_weights`.
+    """
+
+    def __init__(self, version: Optional[int] = None):
+        self.version = version
+        self.built_at = time.monotonic()
+        # Enabled ads of enabled brands by (brand name or "all", size id)
+        self.ads = {}  # type: Dict[Tuple[str, Optional[int]], List[Ad]]
+        # Enabled sizes having ads by brand name (or "all")
+        self.ad_sizes = {}  # type: Dict[str, List[AdSize]]
+        self.ad_size_matchers = {}  # type: Dict[str, AdSizeMatcher]
+        # Same sizes by (brand name, width, height)
+        self.exact_ad_sizes = {}  # type: Dict[Tuple[str, int, int], AdSize]
+        self.popup_ads = []  # type: List[Ad]
+        # Impressions paid by the monthly budget of the budgeted ads
+        self.impressions_budgets = {}  # type: Dict[int, int]
+        # Pacing weights of the budgeted ads, the others weigh 1
+        self.weights = {}  # type: Dict[int, float]
+        self.weights_refreshed_at = 0.0
+        # Digest of the weights, the same in all the processes
+        self.weights_digest = ""
+        self.ad_tables = {}  # type: Dict[Tuple[str, Optional[int]], AliasTable]
+        self.popup_ad_table = AliasTable([], [])
+        # Rendered ads pages and their ETags by ad id (None if no ad)
+        self.rendered_ads = {}  # type: Dict[Optional[int], Tuple[str, str]]
+
+        ad_sizes = {
+            ad_size.pk: ad_size
+            for ad_size in AdSize.objects.filter(is_enabled=True).order_by("pk")
+        }
+        size_ids = {}  # type: Dict[str, Set[int]]
+        for ad_obj in (
+            Ad.objects.filter(is_enabled=True)
+            .select_related("brand", "advertisement")
+            .order_by("pk")
+        ):
+            impressions_budget = ad_obj.get_impressions_budget()
+            if impressions_budget is not None:
+                self.impressions_budgets[ad_obj.pk] = impressions_budget
+            size_id = ad_obj.size_id
+            if size_id is None:
+                self.popup_ads.append(ad_obj)
+            if not ad_obj.brand or not ad_obj.brand.is_enabled:
+                continue
+            for brand in (ALL_BRANDS, ad_obj.brand.name):
+                self.ads.setdefault((brand, size_id), []).append(ad_obj)
+                if size_id is not None and size_id in ad_sizes:
+                    size_ids.setdefault(brand, set()).add(size_id)
+
+        for brand, ids in size_ids.items():
+            self.ad_sizes[brand] = [
+                ad_sizes[size_id] for size_id in sorted(ids)
+            ]
+            self.ad_size_matchers[brand] = AdSizeMatcher(self.ad_sizes[brand])
+            for ad_size in self.ad_sizes[brand]:
+                self.exact_ad_sizes[
+                    (brand, ad_size.width, ad_size.height)
+                ] = ad_size
+        self.get_ad_size = lru_cache(maxsize=settings.AD_SIZES_CACHE_SIZE)(
+            self._get_ad_size
+        )
+        self.refresh_weights()
+
+    def _get_ad_table(self, ads: List[Ad]) -> AliasTable:
+        return AliasTable(ads, [self.weights.get(ad.pk, 1.0) for ad in ads])
+
+    def refresh_weights(self) -> None:
+        """
+        Update the pacing weights of the budgeted ads, and rebuild the alias
+        tables having ads whose weight changed
+        """
+        self.weights_refreshed_at = time.monotonic()
+        now = timezone.now()
+        impressions = get_month_impressions(self.impressions_budgets)
+        weights = {
+            # Rounded to skip the rebuilds for negligible changes
+            ad_id: round(get_pacing_weight(impressions[ad_id], budget, now), 2)
+            for ad_id, budget in self.impressions_budgets.items()
+        }
+        changed_ids = {
+            ad_id
+            for ad_id, weight in weights.items()
+            if self.weights.get(ad_id) != weight
+        }
+        self.weights = weights
+        self.weights_digest = hashlib.md5(
+            repr(sorted(weights.items())).encode()
+        ).hexdigest()[:8]
+
+        for key, ads in self.ads.items():
+            if key not in self.ad_tables or any(
+                ad_obj.pk in changed_ids for ad_obj in ads
+            ):
+                self.ad_tables[key] = self._get_ad_table(ads)
+        if not self.popup_ad_table or any(
+            ad_obj.pk in changed_ids for ad_obj in self.popup_ads
+        ):
+            self.popup_ad_table = self._get_ad_table(self.popup_ads)
+
+    def _get_ad_size(
+        self, width: int, height: int, brand: str = ALL_BRANDS
+    ) -> Optional[AdSize]:
+        ad_size = self.exact_ad_sizes.get((brand, width, height))
+        if ad_size:
+            return ad_size
+        return self.get_closest_ad_size(width, height, brand)
+
+    def get_closest_ad_size(
+        self, width: int, height: int, brand: str = ALL_BRANDS
+    ) -> Optional[AdSize]:
+        matcher = self.ad_size_matchers.get(brand)
+        return matcher.find(width, height) if matcher else None
+
+    def _get_key(
+        self, width: int, height: int, brand: str
+    ) -> Tuple[str, Optional[int]]:
+        ad_size = self.get_ad_size(width, height, brand)
+        return (brand, ad_size.pk if ad_size else None)
+
+    def get_ads(
+        self, width: int, height: int, brand: str = ALL_BRANDS
+    ) -> List[Ad]:
+        """
+        Ads to show for the requested size
+        """
+        return self.ads.get(self._get_key(width, height, brand), [])
+
+    def has_ads(self, width: int, height: int, brand: str = ALL_BRANDS) -> bool:
+        """
+        Whether `choose_ad` chooses an ad for the requested size, i.e. an
+        ad of the size is not paced out
+        """
+        return bool(self.ad_tables.get(self._get_key(width, height, brand)))
+
+    def choose_ad(
+        self, width: int, height: int, brand: str = ALL_BRANDS
+    ) -> Optional[Ad]:
+        """
+        Choose an ad to show for the requested size
+        """
+        table = self.ad_tables.get(self._get_key(width, height, brand))
+        return table.choice() if table else None
+
+    def choose_popup_ad(self) -> Optional[Ad]:
+        return self.popup_ad_table.choice()
+
+    def render_ad(self, ad_obj: Optional[Ad]) -> Tuple[str, str]:
+        """
+        Ads page showing an ad and its ETag
+        """
+        ad_id = ad_obj.pk if ad_obj else None
+        rendered = self.rendered_ads.get(ad_id)
+        if rendered is None:
+            content = render_to_string(
+                "advertisers/ads.html",
+                {"code": ad_obj.code if ad_obj else None},
+            )
+            etag = quote_etag(hashlib.md5(content.encode()).hexdigest())
+            rendered = self.rendered_ads[ad_id] = (content, etag)
+        return rendered
+
+
+_INVENTORY = None  # type: Optional[AdInventory]
+
+
+def get_inventory_version() -> int:
+    version = cache.get(INVENTORY_VERSION_CACHE_KEY)
+    if version is None:
+        cache.add(INVENTORY_VERSION_CACHE_KEY, time.time_ns(), None)
+        version = cache.get(INVENTORY_VERSION_CACHE_KEY)
+    return version
+
+
+def get_inventory() -> AdInventory:
+    """
+    Get the ad inventory of the process, rebuilt if it is outdated
+    """
+    global _INVENTORY  # pylint: disable=global-statement
+
+    version = get_inventory_version()
+    inventory = _INVENTORY
+    if (
+        inventory is None
+        or inventory.version != version
+        or time.monotonic() - inventory.built_at > settings.AD_INVENTORY_MAX_AGE
+    ):
+        inventory = _INVENTORY = AdInventory(version)
+    elif (
+        time.monotonic() - inventory.weights_refreshed_at
+        > settings.AD_PACING_INTERVAL
+    ):
+        inventory.refresh_weights()
+    return inventory
@@ -0,0 +1,18 @@
+import logging
+
+from django_extensions.management.jobs import MinutelyJob
+
+from advertisers.impressions import flush_impressions
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Job(MinutelyJob):
+    """
+    Write the ad impressions counted in the cache to the database
+    """
+
+    def execute(self):
+        impressions = flush_impressions()
+
+        LOGGER.info("Ad impressions flushed: %s.", impressions)
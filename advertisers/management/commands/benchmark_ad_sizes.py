@@ -0,0 +1,66 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from advertisers.inventory import AdSizeMatcher, find_closest_ad_size
+from advertisers.models import AdSize
+
+
+class Command(BaseCommand):
+    """
+    Time `find_closest_ad_size` and `AdSizeMatcher` for growing numbers of
+    ad sizes. The sizes are generated in memory.
+    """
+
+    help = "Benchmark the closest ad size matching"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sizes",
+            type=int,
+            nargs="+",
+            default=[10, 1000, 100000],
+            help="Numbers of ad sizes to benchmark",
+        )
+        parser.add_argument("--requests", type=int, default=100)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        generator = random.Random(options["seed"])
+        for number_of_sizes in options["sizes"]:
+            ad_sizes = [
+                AdSize(
+                    pk=index,
+                    width=generator.randint(1, 2000),
+                    height=generator.randint(1, 2000),
+                )
+                for index in range(number_of_sizes)
+            ]
+            requests = [
+                (generator.randint(1, 2000), generator.randint(1, 2000))
+                for _ in range(options["requests"])
+            ]
+
+            started = time.monotonic()
+            expected = [
+                find_closest_ad_size(width, height, ad_sizes)
+                for width, height in requests
+            ]
+            loop_duration = time.monotonic() - started
+
+            started = time.monotonic()
+            matcher = AdSizeMatcher(ad_sizes)
+            build_duration = time.monotonic() - started
+            started = time.monotonic()
+            found = [matcher.find(width, height) for width, height in requests]
+            matcher_duration = time.monotonic() - started
+
+            if found != expected:
+                self.stderr.write(f"{number_of_sizes} sizes: results differ")
+            self.stdout.write(
+                f"{number_of_sizes} sizes, {len(requests)} requests: "
+                f"loop {loop_duration * 1000:.1f}ms, "
+                f"matcher {matcher_duration * 1000:.1f}ms "
+                f"(+{build_duration * 1000:.1f}ms to build)"
+            )
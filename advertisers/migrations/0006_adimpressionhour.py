@@ -0,0 +1,27 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisers', '0005_adbrand_is_enabled'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AdImpressionHour',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('views', models.IntegerField(default=0)),
+                ('ad', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='impression_hours', to='advertisers.ad')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='adimpressionhour',
+            constraint=models.UniqueConstraint(fields=('ad', 'hour'), name='unique_ad_hour'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisers', '0006_adimpressionhour'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ad',
+            name='advertisement',
+            field=models.ForeignKey(blank=True, help_text='Paces the ad to spend the monthly budget', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ads', to='advertisers.advertisement'),
+        ),
+        migrations.AddField(
+            model_name='advertisement',
+            name='cost_per_mille',
+            field=models.IntegerField(default=0, help_text='Cost of a thousand impressions'),
+        ),
+    ]
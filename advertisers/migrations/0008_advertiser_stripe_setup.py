@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advertisers', '0007_ad_pacing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='advertiser',
+            name='setup_intent_client_secret',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AddField(
+            model_name='advertiser',
+            name='stripe_setup_status',
+            field=models.IntegerField(choices=[(0, 'none'), (1, 'pending'), (2, 'ready'), (3, 'failed')], default=0),
+        ),
+    ]
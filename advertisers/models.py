@@ -1,12 +1,19 @@
 import os
+import time
+from typing import Optional
 
 from django_extensions.db.models import TimeStampedModel
 
-from django.db import models
+from django.core.cache import cache
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.utils.translation import gettext as _
 
 from accounts.models import UserProfile
 
+INVENTORY_VERSION_CACHE_KEY = "ads_inventory_version"
+
 
 class Advertiser(TimeStampedModel):
     """
@@ -22,6 +29,23 @@ class Advertiser(TimeStampedModel):
         null=True,
     )
     stripe_id = models.CharField(max_length=75, null=True, blank=True)
+    # Stripe customer and SetupIntent creation status
+    NONE = 0
+    PENDING = 1
+    READY = 2
+    FAILED = 3
+    STRIPE_SETUP_STATUSES = (
+        (NONE, "none"),
+        (PENDING, "pending"),
+        (READY, "ready"),
+        (FAILED, "failed"),
+    )
+    stripe_setup_status = models.IntegerField(
+        choices=STRIPE_SETUP_STATUSES, blank=False, default=NONE
+    )
+    setup_intent_client_secret = models.CharField(
+        max_length=255, null=True, blank=True
+    )
     user_profile = models.ForeignKey(
         UserProfile,
         on_delete=models.CASCADE,
@@ -53,6 +77,9 @@ class Advertisement(models.Model):
     url = models.URLField(max_length=2000, blank=False, null=False)
     image = models.ImageField(upload_to=get_upload_path, null=True, blank=True)
     monthly_budget = models.IntegerField(blank=False, null=False, default=0)
+    cost_per_mille = models.IntegerField(
+        default=0, help_text=_("Cost of a thousand impressions")
+    )
 
     def __str__(self):
         return str(self.url)
@@ -119,6 +146,14 @@ class Ad(models.Model):
         null=True,
         help_text=_("Set null for popup ads"),
     )
+    advertisement = models.ForeignKey(
+        Advertisement,
+        on_delete=models.SET_NULL,
+        related_name="ads",
+        blank=True,
+        null=True,
+        help_text=_("Paces the ad to spend the monthly budget"),
+    )
     code = models.TextField()
     view = models.IntegerField(default=0)
     is_enabled = models.BooleanField(
@@ -126,3 +161,63 @@ class Ad(models.Model):
         default=True,
         help_text=_("Designates whether this ads is enabled."),
     )
+
+    def get_impressions_budget(self) -> Optional[int]:
+        """
+        Number of impressions paid by the monthly budget, None if unlimited
+        """
+        advertisement = self.advertisement
+        if (
+            not advertisement
+            or advertisement.monthly_budget <= 0
+            or advertisement.cost_per_mille <= 0
+        ):
+            return None
+        return (
+            advertisement.monthly_budget * 1000 // advertisement.cost_per_mille
+        )
+
+
+class AdImpressionHour(models.Model):
+    """
+    Number of impressions of an ad during an hour
+    """
+
+    ad = models.ForeignKey(
+        Ad, on_delete=models.CASCADE, related_name="impression_hours"
+    )
+    hour = models.DateTimeField()
+    views = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["ad", "hour"], name="unique_ad_hour"
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.ad_id} {self.hour}"
+
+
+def bump_inventory_version() -> None:
+    """
+    Make all processes rebuild their ad inventory
+    """
+    cache.set(INVENTORY_VERSION_CACHE_KEY, time.time_ns(), None)
+
+
+@receiver(post_save, sender=Ad)
+@receiver(post_save, sender=AdBrand)
+@receiver(post_save, sender=AdSize)
+@receiver(post_save, sender=Advertisement)
+@receiver(post_delete, sender=Ad)
+@receiver(post_delete, sender=AdBrand)
+@receiver(post_delete, sender=AdSize)
+@receiver(post_delete, sender=Advertisement)
+def invalidate_inventory(sender, **kwargs):
+    # pylint: disable=unused-argument
+    bump_inventory_version()
+    # Again once committed, in case a process rebuilt its inventory from
+    # the previous rows in the meantime
+    transaction.on_commit(bump_inventory_version)
@@ -0,0 +1,133 @@
+import random
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils import timezone
+
+from .models import AdImpressionHour
+
+# Impressions of the budgeted ads during the month, shared by all processes
+MONTH_IMPRESSIONS_CACHE_KEY = "ad_month_impressions:{ad_id}:{month:%Y%m}"
+MONTH_IMPRESSIONS_CACHE_TIMEOUT = 35 * 24 * 60 * 60
+
+
+class AliasTable:
+    """
+    Walker's alias table choosing an item with a probability proportional
+    to its weight in constant time. Items weighing 0 are never chosen.
+    """
+
+    def __init__(self, items: Sequence[Any], weights: Sequence[float]):
+        self.items = [
+            item for item, weight in zip(items, weights) if weight > 0
+        ]
+        positive_weights = [weight for weight in weights if weight > 0]
+        total = sum(positive_weights)
+        size = len(self.items)
+        self.probabilities = [1.0] * size
+        self.aliases = list(range(size))
+
+        # Vose's algorithm: pair each item under the average with an item
+        # over it, which fills the rest of its column
+        scaled = [weight * size / total for weight in positive_weights]
+        small = [index for index, weight in enumerate(scaled) if weight < 1]
+        large = [index for index, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probabilities[less] = scaled[less]
+            self.aliases[less] = more
+            scaled[more] -= 1 - scaled[less]
+            if scaled[more] < 1:
+                small.append(more)
+            else:
+                large.append(more)
+        # The items left keep a probability of 1, up to rounding errors
+
+    def __bool__(self) -> bool:
+        return bool(self.items)
+
+    def choice(self, generator: Optional[random.Random] = None) -> Any:
+        """
+        Choose an item, None if there is none
+        """
+        if not self.items:
+            return None
+        get_random = generator.random if generator else random.random
+        index = int(get_random() * len(self.items))
+        if get_random() < self.probabilities[index]:
+            return self.items[index]
+        return self.items[self.aliases[index]]
+
+
+def get_month_bounds(now: datetime) -> Tuple[datetime, datetime]:
+    start = now.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    if start.month == 12:
+        end = start.replace(year=start.year + 1, month=1)
+    else:
+        end = start.replace(month=start.month + 1)
+    return start, end
+
+
+def get_pacing_weight(
+    impressions: int, impressions_budget: int, now: datetime
+) -> float:
+    """
+    Weight of a budgeted ad: its remaining budget fraction divided by the
+    remaining month fraction, 1 when its spend is on pace
+    """
+    if impressions >= impressions_budget:
+        return 0.0
+    start, end = get_month_bounds(now)
+    remaining_time = (end - now) / (end - start)
+    remaining_budget = 1 - impressions / impressions_budget
+    if remaining_time <= 0:
+        return settings.AD_MAX_PACING_WEIGHT
+    return min(remaining_budget / remaining_time, settings.AD_MAX_PACING_WEIGHT)
+
+
+def count_month_impression(ad_id: int) -> None:
+    """
+    Add an impression to the month counter of an ad, if it is counted
+    """
+    key = MONTH_IMPRESSIONS_CACHE_KEY.format(ad_id=ad_id, month=timezone.now())
+    try:
+        cache.incr(key)
+    except ValueError:
+        # Set up from the database by `get_month_impressions`
+        pass
+
+
+def get_month_impressions(ad_ids: Iterable[int]) -> Dict[int, int]:
+    """
+    Impressions of the ads since the start of the month
+    """
+    now = timezone.now()
+    keys = {
+        MONTH_IMPRESSIONS_CACHE_KEY.format(ad_id=ad_id, month=now): ad_id
+        for ad_id in ad_ids
+    }
+    impressions = {
+        keys[key]: count for key, count in cache.get_many(keys).items()
+    }
+    missing_ids = set(keys.values()) - set(impressions)
+    if missing_ids:
+        # Start the missing counters from the flushed impressions
+        start, _ = get_month_bounds(now)
+        flushed = dict(
+            AdImpressionHour.objects.filter(
+                ad_id__in=missing_ids, hour__gte=start
+            )
+            .values("ad_id")
+            .annotate(views=Sum("views"))
+            .values_list("ad_id", "views")
+        )
+        for ad_id in missing_ids:
+            key = MONTH_IMPRESSIONS_CACHE_KEY.format(ad_id=ad_id, month=now)
+            cache.add(
+                key, flushed.get(ad_id, 0), MONTH_IMPRESSIONS_CACHE_TIMEOUT
+            )
+            impressions[ad_id] = cache.get(key, 0)
+    return impressions
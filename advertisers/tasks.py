@@ -0,0 +1,84 @@
+import logging
+from functools import lru_cache
+
+import requests
+import stripe
+from requests.adapters import HTTPAdapter
+
+from django.conf import settings
+
+from guppy.celery import APP
+
+from .models import Advertiser
+
+LOGGER = logging.getLogger(__name__)
+# Errors worth trying again, with the same idempotency keys
+RETRIED_STRIPE_ERRORS = (
+    stripe.error.APIConnectionError,
+    stripe.error.APIError,
+    stripe.error.RateLimitError,
+)
+
+
+@lru_cache(maxsize=None)
+def get_stripe_http_client() -> stripe.http_client.HTTPClient:
+    """
+    Stripe client keeping its connections open between the calls, created
+    by each worker process on its first call
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=settings.STRIPE_POOL_SIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return stripe.http_client.RequestsClient(
+        timeout=settings.STRIPE_TIMEOUT, session=session
+    )
+
+
+@APP.task(bind=True, max_retries=5)
+def create_stripe_setup(self, advertiser_id: int) -> None:
+    """
+    Create the Stripe customer of an advertiser and the SetupIntent used by
+    the signup page to save the card
+    """
+    advertiser = Advertiser.objects.get(pk=advertiser_id)
+    if advertiser.stripe_setup_status == Advertiser.READY:
+        return
+
+    stripe.default_http_client = get_stripe_http_client()
+    # The retries get the objects created by the previous tries
+    key = f"advertiser-{advertiser.pk}-{advertiser.advertisement_id}"
+    try:
+        customer = stripe.Customer.create(
+            api_key=settings.STRIPE_SECRET_KEY,
+            email=advertiser.email,
+            idempotency_key=f"{key}-customer",
+        )
+        setup_intent = stripe.SetupIntent.create(
+            api_key=settings.STRIPE_SECRET_KEY,
+            customer=customer.id,
+            payment_method_types=["card"],
+            idempotency_key=f"{key}-setup-intent",
+        )
+    except stripe.error.StripeError as error:
+        if (
+            isinstance(error, RETRIED_STRIPE_ERRORS)
+            and self.request.retries < self.max_retries
+        ):
+            raise self.retry(exc=error, countdown=2**self.request.retries)
+        LOGGER.exception("Could not set up the advertiser %s.", advertiser.pk)
+        advertiser.stripe_setup_status = Advertiser.FAILED
+        advertiser.save(update_fields=["stripe_setup_status", "modified"])
+        return
+
+    advertiser.stripe_id = customer.id
+    advertiser.setup_intent_client_secret = setup_intent.client_secret
+    advertiser.stripe_setup_status = Advertiser.READY
+    advertiser.save(
+        update_fields=[
+            "stripe_id",
+            "setup_intent_client_secret",
+            "stripe_setup_status",
+            "modified",
+        ]
+    )
@@ -1,19 +1,46 @@
 # pylint: disable=missing-docstring
 import base64
+import json
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
 
 import mock
 import stripe
+from asgiref.sync import async_to_sync
+from freezegun import freeze_time
 
 from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import ProgrammingError
 from django.test import TestCase
 from django.test.utils import override_settings
 from django.urls.base import reverse
 
 from accounts.utils import setup_tests
 from advertisers.factories import AdBrandFactory, AdFactory, AdSizeFactory
-from advertisers.models import Advertiser
+from advertisers.impressions import flush_impressions, record_impression
+from advertisers.inventory import (
+    AdSizeMatcher,
+    find_closest_ad_size,
+    get_inventory,
+)
+from advertisers.jobs.minutely import flush_ad_impressions
+from advertisers.models import (
+    AdImpressionHour,
+    AdSize,
+    Advertisement,
+    Advertiser,
+)
+from advertisers.selection import AliasTable, get_pacing_weight
+from advertisers.tasks import create_stripe_setup
 from advertisers.utils import get_ad_from_size, get_closest_ad_size
+from advertisers.views import SIGNUP_STATUS_SALT
+from guppy.celery import APP
 
 
 class StripeCustomer:
@@ -24,7 +51,89 @@ class StripeSetupIntent:
     client_secret = "client_secret_test"
 
 
-@override_settings(DEBUG=True)
+class FakeStripeHandler(BaseHTTPRequestHandler):
+    def post(self):
+        length = int(self.headers["Content-Length"])
+        data = parse_qs(self.rfile.read(length).decode())
+        key = self.headers["Idempotency-Key"]
+        self.server.calls.append((self.path, key))
+        if self.server.failures:
+            self.server.failures -= 1
+            self.respond(500, {"error": {"message": "Try again"}})
+            return
+
+        if key not in self.server.objects:
+            number = len(self.server.objects) + 1
+            if self.path == "/v1/customers":
+                self.server.objects[key] = {
+                    "id": f"cus_{number}",
+                    "object": "customer",
+                    "email": data["email"][0],
+                }
+            else:
+                self.server.objects[key] = {
+                    "id": f"seti_{number}",
+                    "object": "setup_intent",
+                    "client_secret": f"seti_{number}_secret",
+                    "customer": data["customer"][0],
+                }
+        self.respond(200, self.server.objects[key])
+
+    # Called for the POST requests
+    do_POST = post
+
+    def respond(self, status, data):
+        content = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+
+class FakeStripeServer(ThreadingHTTPServer):
+    """
+    Local Stripe API answering with the same objects for the same
+    idempotency keys, after failing the first `failures` calls
+    """
+
+    def __init__(self, failures=0):
+        super().__init__(("127.0.0.1", 0), FakeStripeHandler)
+        self.failures = failures
+        self.calls = []
+        self.objects = {}
+
+    def __enter__(self):
+        threading.Thread(
+            target=self.serve_forever, args=(0.05,), daemon=True
+        ).start()
+        self.api_base = mock.patch(
+            "stripe.api_base", f"http://127.0.0.1:{self.server_port}"
+        )
+        self.api_base.start()
+        return self
+
+    def __exit__(self, *args):
+        self.api_base.stop()
+        self.shutdown()
+        super().__exit__(*args)
+
+
+def create_advertiser():
+    advertisement = Advertisement.objects.create(url="https://guppy.co/")
+    return Advertiser.objects.create(
+        email="email@example.com",
+        advertisement=advertisement,
+        stripe_setup_status=Advertiser.PENDING,
+    )
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True, DEBUG=True, STRIPE_SECRET_KEY="sk_test"
+)
 class StripeTests(TestCase):
     def setUp(self):
         self.user_profile = setup_tests(self.client)
@@ -62,13 +171,7 @@ class StripeTests(TestCase):
         self.assertEqual(advertisers[0].email, "admin@example.com")
         self.assertFalse(advertisers[0].advertisement)
 
-    @mock.patch("stripe.Customer.create")
-    @mock.patch("stripe.SetupIntent.create")
-    def test_advertiser_signup_submit(
-        self, stripe_setup_intent_mock, stripe_customer_mock
-    ):
-        stripe_customer_mock.return_value = StripeCustomer()
-        stripe_setup_intent_mock.return_value = StripeSetupIntent()
+    def test_advertiser_signup_submit(self):
         url = reverse("advertiser_signup")
         self.client.post(url, {"email": "email@example.com"})
         image_content = base64.b64decode(
@@ -85,16 +188,31 @@ class StripeTests(TestCase):
             "monthly_budget": "10",
             "image": image,
         }
-        response = self.client.post(url, data)
+        with FakeStripeServer() as stripe_server:
+            response = self.client.post(url, data)
         self.assertEqual(response.status_code, 200)
         self.assertNotContains(response, "Checkout")
         self.assertContains(response, "Submit")
+        self.assertEqual(
+            [path for path, _ in stripe_server.calls],
+            ["/v1/customers", "/v1/setup_intents"],
+        )
 
         advertisers = Advertiser.objects.all()
         self.assertEqual(advertisers.count(), 1)
         self.assertEqual(advertisers[0].email, "email@example.com")
         self.assertEqual(advertisers[0].is_valid_payment, False)
         self.assertEqual(advertisers[0].approved, False)
+        self.assertEqual(advertisers[0].stripe_id, "cus_1")
+
+        # The page gets the client secret once the SetupIntent is created
+        status_url = response.context["status_url"]
+        response = self.client.get(status_url)
+        self.assertEqual(response.json()["status"], "ready")
+        self.assertEqual(response.json()["client_secret"], "seti_2_secret")
+        self.assertTrue(
+            response.json()["success_url"].endswith("?customer_id=cus_1")
+        )
 
         advertisement = advertisers[0].advertisement
         self.assertEqual(advertisement.monthly_budget, 1000)
@@ -116,8 +234,69 @@ class StripeTests(TestCase):
             ),
         )
 
+    def test_stripe_setup_queue(self):
+        route = APP.amqp.router.route({}, create_stripe_setup.name)
+        self.assertEqual(route["queue"].name, "notification")
+
+    def test_stripe_setup_retries(self):
+        advertiser = create_advertiser()
+        with FakeStripeServer(failures=2) as stripe_server:
+            create_stripe_setup.delay(advertiser.pk)
+        # Retried with the same idempotency keys
+        self.assertEqual(
+            stripe_server.calls,
+            [
+                (
+                    "/v1/customers",
+                    f"advertiser-{advertiser.pk}-"
+                    f"{advertiser.advertisement_id}-customer",
+                ),
+            ]
+            * 3
+            + [
+                (
+                    "/v1/setup_intents",
+                    f"advertiser-{advertiser.pk}-"
+                    f"{advertiser.advertisement_id}-setup-intent",
+                ),
+            ],
+        )
+        advertiser.refresh_from_db()
+        self.assertEqual(advertiser.stripe_setup_status, Advertiser.READY)
+        self.assertEqual(advertiser.setup_intent_client_secret, "seti_2_secret")
+
+        # Only once
+        with FakeStripeServer() as stripe_server:
+            create_stripe_setup.delay(advertiser.pk)
+        self.assertEqual(stripe_server.calls, [])
+
+    def test_stripe_setup_failure(self):
+        advertiser = create_advertiser()
+        with FakeStripeServer(failures=10) as stripe_server:
+            create_stripe_setup.delay(advertiser.pk)
+        self.assertEqual(
+            len(stripe_server.calls), create_stripe_setup.max_retries + 1
+        )
+        advertiser.refresh_from_db()
+        self.assertEqual(advertiser.stripe_setup_status, Advertiser.FAILED)
+
+        token = signing.dumps(advertiser.pk, salt=SIGNUP_STATUS_SALT)
+        url = reverse("advertiser_signup_status", kwargs={"token": token})
+        response = self.client.get(url)
+        self.assertEqual(response.json(), {"status": "failed"})
+
+        url = reverse(
+            "advertiser_signup_status", kwargs={"token": str(advertiser.pk)}
+        )
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
 
 class AdsTest(TestCase):
+    def setUp(self):
+        # Forget the inventory of the previous tests
+        cache.clear()
+
     def test_ad_not_found(self):
         url = reverse("ads_view", kwargs={"width": 0, "height": 10})
         response = self.client.get(url)
@@ -132,6 +311,7 @@ class AdsTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "123")
         self.assertNotContains(response, "456")
+        flush_ad_impressions.Job().execute()
         ad_obj.refresh_from_db()
         self.assertEqual(ad_obj.view, 1)
 
@@ -140,6 +320,7 @@ class AdsTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "123")
         self.assertNotContains(response, "456")
+        flush_ad_impressions.Job().execute()
         ad_obj.refresh_from_db()
         self.assertEqual(ad_obj.view, 2)
 
@@ -148,6 +329,7 @@ class AdsTest(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertContains(response, "123")
         self.assertNotContains(response, "456")
+        flush_ad_impressions.Job().execute()
         ad_obj.refresh_from_db()
         self.assertEqual(ad_obj.view, 3)
 
@@ -165,6 +347,107 @@ class AdsTest(TestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
 
+    def test_ad_impressions(self):
+        ad_size = AdSizeFactory(width=300, height=250)
+        ad_obj = AdFactory(size=ad_size, code="123", is_enabled=True)
+        ad_obj2 = AdFactory(size=None, code="456", is_enabled=True)
+        url = reverse("ads_view", kwargs={"width": 300, "height": 250})
+        with freeze_time(datetime(2022, 3, 1, 10, 30)):
+            self.client.get(url)
+            # The ad requests do not write to the database
+            with self.assertNumQueries(0):
+                self.client.get(url)
+            record_impression(ad_obj2.pk)
+        with freeze_time(datetime(2022, 3, 1, 11, 5)):
+            self.client.get(url)
+            self.assertEqual(flush_impressions(), 4)
+            self.assertEqual(flush_impressions(), 0)
+
+        ad_obj.refresh_from_db()
+        self.assertEqual(ad_obj.view, 3)
+        ad_obj2.refresh_from_db()
+        self.assertEqual(ad_obj2.view, 1)
+        hour = datetime(2022, 3, 1, 10, tzinfo=timezone.utc)
+        self.assertEqual(
+            list(
+                AdImpressionHour.objects.order_by("ad", "hour").values_list(
+                    "ad", "hour", "views"
+                )
+            ),
+            [
+                (ad_obj.pk, hour, 2),
+                (ad_obj.pk, hour + timedelta(hours=1), 1),
+                (ad_obj2.pk, hour, 1),
+            ],
+        )
+
+    def test_failed_impressions_flush(self):
+        ad_obj = AdFactory(size=None, code="123", is_enabled=True)
+        record_impression(ad_obj.pk)
+        with mock.patch(
+            "advertisers.impressions.AD_IMPRESSION_HOURS_UPSERT_SQL",
+            "INSERT INTO unknown_table VALUES {values}",
+        ), self.assertRaises(ProgrammingError):
+            flush_impressions()
+        # Kept for the next flush
+        self.assertEqual(flush_impressions(), 1)
+        ad_obj.refresh_from_db()
+        self.assertEqual(ad_obj.view, 1)
+        self.assertEqual(AdImpressionHour.objects.get().views, 1)
+
+    def test_ad_conditional_requests(self):
+        ad_size = AdSizeFactory(width=300, height=250)
+        ad_obj = AdFactory(size=ad_size, code="123", is_enabled=True)
+        url = reverse("ads_view", kwargs={"width": 300, "height": 250})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        etag = response["ETag"]
+
+        # The page is rendered once, and not sent again while unchanged
+        with mock.patch("advertisers.inventory.render_to_string") as render:
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertFalse(render.called)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(flush_impressions(), 2)
+
+        ad_obj.code = "456"
+        ad_obj.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "456")
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_ads_checker_conditional_requests(self):
+        ad_size = AdSizeFactory(width=300, height=250)
+        url = reverse("ads_checker", kwargs={"width": 300, "height": 250})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response["Cache-Control"], "public, max-age=60")
+
+        ad_obj = AdFactory(size=ad_size, is_enabled=True)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "public, max-age=60")
+        etag = response["ETag"]
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["Cache-Control"], "public, max-age=60")
+
+        # The answer changes with the inventory
+        ad_obj.code = "456"
+        ad_obj.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+        # Other sizes have their own ETag
+        other_url = reverse("ads_checker", kwargs={"width": 310, "height": 250})
+        other_response = self.client.get(other_url)
+        self.assertEqual(other_response.status_code, 200)
+        self.assertNotEqual(other_response["ETag"], response["ETag"])
+
     def test_ad_with_specific_brand(self):
         ads_size = AdSizeFactory(width=300, height=250)
         AdFactory(size=ads_size, code="123", is_enabled=True)
@@ -214,6 +497,111 @@ class AdsTest(TestCase):
         result = get_ad_from_size(width=300, height=250)
         self.assertEqual(result.pk, ad_obj.pk)
 
+    def test_ad_inventory(self):
+        ad_size = AdSizeFactory(width=300, height=250)
+        ad_obj = AdFactory(size=ad_size, code="123", is_enabled=True)
+        get_ad_from_size(width=300, height=250)
+        with self.assertNumQueries(0):
+            result = get_ad_from_size(width=300, height=250)
+            self.assertEqual(result.pk, ad_obj.pk)
+            result = get_ad_from_size(width=310, height=260)
+            self.assertEqual(result.pk, ad_obj.pk)
+            result = get_ad_from_size(width=310, height=260, brand="nike")
+            self.assertIsNone(result)
+
+        # Saving an ad, a brand or a size invalidates the inventory
+        ad_obj.brand.name = "nike"
+        ad_obj.brand.save()
+        result = get_ad_from_size(width=310, height=260, brand="nike")
+        self.assertEqual(result.pk, ad_obj.pk)
+        ad_obj.is_enabled = False
+        ad_obj.save()
+        self.assertIsNone(get_ad_from_size(width=300, height=250))
+        ad_obj2 = AdFactory(size=ad_size, code="456", is_enabled=True)
+        result = get_ad_from_size(width=300, height=250)
+        self.assertEqual(result.pk, ad_obj2.pk)
+        ad_size.is_enabled = False
+        ad_size.save()
+        self.assertIsNone(get_closest_ad_size(width=300, height=250))
+
+    def test_ad_pacing(self):
+        ad_size = AdSizeFactory(width=300, height=250)
+        # 3 impressions a month
+        advertisement = Advertisement.objects.create(
+            url="https://guppy.co/", monthly_budget=30, cost_per_mille=10000
+        )
+        budgeted_ad = AdFactory(
+            size=ad_size, advertisement=advertisement, is_enabled=True
+        )
+        house_ad = AdFactory(size=ad_size, is_enabled=True)
+        with freeze_time(datetime(2022, 3, 1, 10, 30)) as frozen_time:
+            # Impressions of the month flushed before the counter was set up
+            AdImpressionHour.objects.create(
+                ad=budgeted_ad,
+                hour=datetime(2022, 3, 1, 9, tzinfo=timezone.utc),
+                views=2,
+            )
+            AdImpressionHour.objects.create(
+                ad=budgeted_ad,
+                hour=datetime(2022, 2, 28, 9, tzinfo=timezone.utc),
+                views=10,
+            )
+            ads = {get_ad_from_size(300, 250).pk for _ in range(100)}
+            self.assertEqual(ads, {budgeted_ad.pk, house_ad.pk})
+
+            # The budget is spent, seen once the weights are refreshed
+            record_impression(budgeted_ad.pk)
+            frozen_time.tick(settings.AD_PACING_INTERVAL + 1)
+            with self.assertNumQueries(0):
+                ads = {get_ad_from_size(300, 250).pk for _ in range(100)}
+            self.assertEqual(ads, {house_ad.pk})
+
+        # New month
+        with freeze_time(datetime(2022, 4, 1, 0, 30)):
+            ads = {get_ad_from_size(300, 250).pk for _ in range(100)}
+            self.assertEqual(ads, {budgeted_ad.pk, house_ad.pk})
+
+    def test_ads_checker_paced_out_ads(self):
+        ad_size = AdSizeFactory(width=300, height=250)
+        # 3 impressions a month
+        advertisement = Advertisement.objects.create(
+            url="https://guppy.co/", monthly_budget=30, cost_per_mille=10000
+        )
+        budgeted_ad = AdFactory(
+            size=ad_size, advertisement=advertisement, is_enabled=True
+        )
+        url = reverse("ads_checker", kwargs={"width": 300, "height": 250})
+        with freeze_time(datetime(2022, 3, 1, 10, 30)) as frozen_time:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response["ETag"]
+
+            for _ in range(3):
+                record_impression(budgeted_ad.pk)
+            frozen_time.tick(settings.AD_PACING_INTERVAL + 1)
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 404)
+            self.assertNotEqual(response["ETag"], etag)
+
+    def test_pacing_weight(self):
+        now = datetime(2022, 4, 16, tzinfo=timezone.utc)
+        self.assertEqual(get_pacing_weight(50, 100, now), 1.0)
+        self.assertEqual(get_pacing_weight(75, 100, now), 0.5)
+        self.assertEqual(get_pacing_weight(100, 100, now), 0.0)
+        self.assertEqual(get_pacing_weight(0, 100, now), 2.0)
+        self.assertEqual(
+            get_pacing_weight(
+                0, 100, datetime(2022, 4, 28, tzinfo=timezone.utc)
+            ),
+            settings.AD_MAX_PACING_WEIGHT,
+        )
+        self.assertEqual(
+            get_pacing_weight(
+                0, 100, datetime(2022, 4, 1, tzinfo=timezone.utc)
+            ),
+            1.0,
+        )
+
     def test_ad_size(self):
         sizes = [
             [100, 50, True],
@@ -269,7 +657,165 @@ class AdsTest(TestCase):
         self.assertEqual(size.height, 1000)
 
 
+class AdSizeMatcherTest(TestCase):
+    def assert_same_ad_sizes(self, ad_sizes, requests):
+        matcher = AdSizeMatcher(ad_sizes)
+        for width, height in requests:
+            self.assertIs(
+                matcher.find(width, height),
+                find_closest_ad_size(width, height, ad_sizes),
+                (width, height),
+            )
+
+    def test_empty(self):
+        self.assertIsNone(AdSizeMatcher([]).find(300, 250))
+
+    def test_same_as_reference(self):
+        generator = random.Random(42)
+        for number_of_sizes in (1, 2, 10, 100, 1000):
+            ad_sizes = [
+                AdSize(
+                    width=generator.randint(1, 1500),
+                    height=generator.randint(1, 1500),
+                )
+                for _ in range(number_of_sizes)
+            ]
+            requests = [
+                (generator.randint(1, 2000), generator.randint(1, 2000))
+                for _ in range(200)
+            ]
+            # Exact and close sizes
+            for ad_size in generator.sample(ad_sizes, min(20, len(ad_sizes))):
+                requests.append((ad_size.width, ad_size.height))
+                requests.append(
+                    (
+                        ad_size.width + generator.randint(-60, 60) or 1,
+                        ad_size.height + generator.randint(-60, 60) or 1,
+                    )
+                )
+            self.assert_same_ad_sizes(ad_sizes, requests)
+            with mock.patch.object(AdSizeMatcher, "CHUNK_SIZE", 7):
+                self.assert_same_ad_sizes(ad_sizes, requests)
+
+    def test_same_as_reference_on_ties(self):
+        # Sizes at the same distance, and exactly at the percent limits
+        ad_sizes = [
+            AdSize(width=95, height=100),
+            AdSize(width=105, height=100),
+            AdSize(width=100, height=95),
+            AdSize(width=90, height=90),
+            AdSize(width=100, height=100),
+            AdSize(width=70, height=100),
+            AdSize(width=200, height=100),
+        ]
+        requests = [
+            (100, 100),
+            (100, 70),
+            (50, 50),
+            (200, 200),
+            (1, 1000),
+            (1000, 1),
+        ]
+        self.assert_same_ad_sizes(ad_sizes, requests)
+        self.assert_same_ad_sizes(ad_sizes[::-1], requests)
+
+
+@override_settings(
+    ROOT_URLCONF="advertisers.async_urls",
+    MIDDLEWARE=settings.ADS_ASGI_MIDDLEWARE,
+)
+class AsyncAdsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def get(self, url, **headers):
+        # The inventory is built in the test thread, where the test data is
+        get_inventory()
+        return async_to_sync(self.async_client.get)(
+            url,
+            **{
+                name.replace("_", "-"): value for name, value in headers.items()
+            },
+        )
+
+    def test_ad(self):
+        ad_size = AdSizeFactory(width=300, height=250)
+        ad_obj = AdFactory(size=ad_size, code="123", is_enabled=True)
+        url = reverse("ads_view", kwargs={"width": 100, "height": 150})
+        self.assertEqual(url, "/advertisers/ads/100/150/")
+        response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "123")
+        self.assertNotIn("X-Frame-Options", response)
+        response = self.get(url, if_none_match=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(flush_impressions(), 2)
+        ad_obj.refresh_from_db()
+        self.assertEqual(ad_obj.view, 2)
+
+        url = reverse("ads_view", kwargs={"width": 0, "height": 150})
+        self.assertEqual(self.get(url).status_code, 404)
+
+        url = reverse(
+            "ads_brand_view",
+            kwargs={"width": 300, "height": 250, "brand": "nike"},
+        )
+        response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "123")
+
+    def test_ads_checker(self):
+        url = reverse("ads_checker", kwargs={"width": 300, "height": 250})
+        self.assertEqual(self.get(url).status_code, 404)
+        AdFactory(size=AdSizeFactory(width=300, height=250), is_enabled=True)
+        response = self.get(url, origin="https://example.com")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Cache-Control"], "public, max-age=60")
+        self.assertEqual(response["Access-Control-Allow-Origin"], "*")
+
+    def test_popup_ads(self):
+        url = reverse("popup_ads_view")
+        self.assertEqual(self.get(url).json(), {"has_ads": False})
+        AdFactory(size=None, code="123", is_enabled=True)
+        self.assertEqual(self.get(url).json(), {"has_ads": True, "code": "123"})
+
+    def test_close_thread_connections(self):
+        threads = []
+
+        def close_old_connections():
+            threads.append(threading.get_ident())
+
+        url = reverse("popup_ads_view")
+        with mock.patch(
+            "advertisers.async_views.close_old_connections",
+            close_old_connections,
+        ):
+            self.assertEqual(self.get(url).json(), {"has_ads": False})
+        self.assertEqual(len(threads), 2)
+        self.assertEqual(threads[0], threads[1])
+        self.assertNotEqual(threads[0], threading.get_ident())
+
+
+class AliasTableTest(TestCase):
+    def test_choice(self):
+        self.assertIsNone(AliasTable([], []).choice())
+        self.assertIsNone(AliasTable(["a"], [0]).choice())
+
+        generator = random.Random(42)
+        table = AliasTable(["a", "b", "c", "d"], [1, 2, 0, 5])
+        samples = 80000
+        counts = {"a": 0, "b": 0, "c": 0, "d": 0}
+        for _ in range(samples):
+            counts[table.choice(generator)] += 1
+        self.assertEqual(counts["c"], 0)
+        for item, weight in (("a", 1), ("b", 2), ("d", 5)):
+            self.assertAlmostEqual(counts[item] / samples, weight / 8, 2)
+
+
 class PopupAdsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
     def test_ad_not_found(self):
         url = reverse("popup_ads_view")
         response = self.client.get(url)
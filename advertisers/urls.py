@@ -5,6 +5,11 @@ from advertisers import views
 urlpatterns = [
     path("", views.index, name="advertisers"),
     path("signup/", views.signup, name="advertiser_signup"),
+    path(
+        "signup/status/<token>/",
+        views.signup_status,
+        name="advertiser_signup_status",
+    ),
     path(
         "signup/success/",
         views.signup_success,
@@ -1,6 +1,9 @@
-import random
-from typing import Dict, Optional, Union
+from typing import Optional, Tuple, Union
 
+from django.utils.http import quote_etag
+
+from advertisers.impressions import record_impression
+from advertisers.inventory import get_inventory
 from advertisers.models import Ad, AdSize
 
 
@@ -11,34 +14,42 @@ def get_ad_from_size(
     Get ad from the size
     """
 
-    ad_size = None
-    filters = {
-        "width": width,
-        "height": height,
-        "is_enabled": True,
-        "ads__is_enabled": True,
-        "ads__brand__is_enabled": True,
-    }  # type: Dict[str, Union[str, int, bool]]
-    if brand != "all":
-        filters["ads__brand__name"] = brand
-    ad_sizes = AdSize.objects.filter(**filters)
-    if ad_sizes.count():
-        ad_size = ad_sizes.first()
-    else:
-        ad_size = get_closest_ad_size(width=width, height=height, brand=brand)
-    ads_filters = {
-        "size": ad_size,
-        "is_enabled": True,
-        "brand__is_enabled": True,
-    }  # type: Dict[str, Union[str, Optional[AdSize], bool]]
-    if brand != "all":
-        ads_filters["brand__name"] = brand
-    ads = Ad.objects.filter(**ads_filters)
-    if ads.count():
-        # Get random item with correct size
-        return random.choice(list(ads))
-
-    return None
+    return get_inventory().choose_ad(width, height, brand)
+
+
+def render_ad(ad_obj: Optional[Ad]) -> Tuple[str, str]:
+    """
+    Get the rendered ads page of an ad and its ETag, cached until the ads
+    change
+    """
+
+    return get_inventory().render_ad(ad_obj)
+
+
+def serve_ad(width: int, height: int, brand: str = "all") -> Tuple[str, str]:
+    """
+    Choose an ad for the size, count its impression and get its rendered
+    page and ETag
+    """
+
+    ad_obj = get_ad_from_size(width, height, brand)
+    if ad_obj:
+        # Update the view of this ad
+        record_impression(ad_obj.pk)
+    return render_ad(ad_obj)
+
+
+def check_ads(width: int, height: int) -> Tuple[bool, str]:
+    """
+    Check if having an ad for size, and get the ETag of the answer
+    """
+
+    inventory = get_inventory()
+    # The answer only changes with the ads and their pacing
+    etag = quote_etag(
+        f"{inventory.version}-{inventory.weights_digest}-{width}x{height}"
+    )
+    return inventory.has_ads(width, height), etag
 
 
 def get_closest_ad_size(
@@ -48,71 +59,12 @@ def get_closest_ad_size(
     Get closest ad size
     """
 
-    filters = {
-        "is_enabled": True,
-        "ads__is_enabled": True,
-        "ads__brand__is_enabled": True,
-    }  # type: Dict[str, Union[str, bool]]
-    if brand != "all":
-        filters["ads__brand__name"] = brand
-    ad_sizes = AdSize.objects.filter(**filters)
-
-    for percent in range(5, 31, 5):
-        for ad_size in ad_sizes:
-            # Return size if width and height are matched
-            if width == ad_size.width and height == ad_size.height:
-                return ad_size
-
-            width_deviation_rate = (
-                abs(width - ad_size.width) * 100 / max(width, ad_size.width)
-            )
-            height_deviation_rate = (
-                abs(height - ad_size.height) * 100 / max(height, ad_size.height)
-            )
-            # Return size if the deviations are less than 30 percent
-            if (
-                width_deviation_rate <= percent
-                and height_deviation_rate <= percent
-            ):
-                return ad_size
-
-    # If can not find the size, return the size has the min deviation rate
-    min_deviation_rate = 0.0
-    matched_image = None
-    for ad_size in ad_sizes:
-        width_deviation_rate = (
-            abs(width - ad_size.width) * 100 / max(width, ad_size.width)
-        )
-        height_deviation_rate = (
-            abs(height - ad_size.height) * 100 / max(height, ad_size.height)
-        )
-        ratio_deviation_rate = abs(
-            (width / height) - (ad_size.width / ad_size.height)
-        )
-        # Calculate the total
-        # with the most important parameter being ratio_deviation_rate
-        total_rate = (
-            width_deviation_rate
-            + height_deviation_rate
-            + (ratio_deviation_rate * 150)
-        )
-
-        # Return size which have total deviation is minimum
-        if min_deviation_rate == 0 or min_deviation_rate > total_rate:
-            min_deviation_rate = total_rate
-            matched_image = ad_size
-
-    return matched_image
+    return get_inventory().get_closest_ad_size(width, height, brand)
 
 
 def get_popup_ad() -> Union[Ad, None]:
     """
-    Get random popup ad
+    Get popup ad
     """
 
-    ads = Ad.objects.filter(size__isnull=True, is_enabled=True)
-    if ads.count():
-        # Get random item with correct size
-        return random.choice(list(ads))
-
-    return None
+    return get_inventory().choose_popup_ad()
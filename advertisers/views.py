@@ -1,6 +1,5 @@
 import logging
 
-import stripe
 from rest_framework.authentication import BasicAuthentication
 from rest_framework.decorators import (
     api_view,
@@ -12,17 +11,22 @@ from rest_framework.response import Response
 
 from django.conf import settings
 from django.contrib import messages
-from django.http import HttpResponse, HttpResponseNotFound
-from django.shortcuts import redirect, render
+from django.core import signing
+from django.http import HttpResponse, HttpResponseNotFound, JsonResponse
+from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
 from django.views.decorators.clickjacking import xframe_options_exempt
 
 from advertisers.models import Advertiser
-from advertisers.utils import get_ad_from_size, get_popup_ad
+from advertisers.utils import check_ads, get_popup_ad, serve_ad
 
 from .forms import AdvertisementCreationForm
+from .tasks import create_stripe_setup
 
 LOGGER = logging.getLogger(__name__)
+SIGNUP_STATUS_SALT = "advertisers.signup_status"
+SIGNUP_STATUS_MAX_AGE = 24 * 60 * 60
 
 
 def index(request):
@@ -66,33 +70,23 @@ def signup(request):
 
         if advertisement_form.is_valid():
             advertisement = advertisement_form.save()
-            stripe.api_key = settings.STRIPE_SECRET_KEY
-
-            customer_data = {"email": request.POST.get("email")}
             if request.user.is_authenticated:
                 advertisement_form.user_profile = request.user
-            customer = stripe.Customer.create(**customer_data)
-            setup_intent = stripe.SetupIntent.create(
-                customer=customer.id,
-                payment_method_types=["card"],
-            )
 
             advertiser_model.advertisement = advertisement
-            advertiser_model.stripe_id = customer.id
+            advertiser_model.stripe_setup_status = Advertiser.PENDING
             if request.user.is_authenticated:
                 advertiser_model.user_profile = request.user
             advertiser_model.save()
+            # The page polls the status until the SetupIntent is created
+            create_stripe_setup.delay(advertiser_model.pk)
 
-            success_url = (
-                request.build_absolute_uri(reverse("advertiser_signup_success"))
-                + "?customer_id="
-                + customer.id
-            )
+            token = signing.dumps(advertiser_model.pk, salt=SIGNUP_STATUS_SALT)
             context = {
                 "is_payment": True,
-                "client_secret": setup_intent.client_secret,
-                "customer_id": customer.id,
-                "success_url": success_url,
+                "status_url": reverse(
+                    "advertiser_signup_status", kwargs={"token": token}
+                ),
             }
         else:
             advertisement_form = AdvertisementCreationForm(
@@ -109,6 +103,37 @@ def signup(request):
     return render(request, template, context)
 
 
+def signup_status(request, token):
+    """
+    Stripe setup status of a signup, polled by the signup page
+    """
+
+    try:
+        advertiser_id = signing.loads(
+            token, salt=SIGNUP_STATUS_SALT, max_age=SIGNUP_STATUS_MAX_AGE
+        )
+    except signing.BadSignature:
+        return HttpResponseNotFound("Not found")
+    advertiser = get_object_or_404(Advertiser, pk=advertiser_id)
+
+    if advertiser.stripe_setup_status != Advertiser.READY:
+        return JsonResponse(
+            {"status": advertiser.get_stripe_setup_status_display()}
+        )
+    success_url = (
+        request.build_absolute_uri(reverse("advertiser_signup_success"))
+        + "?customer_id="
+        + advertiser.stripe_id
+    )
+    return JsonResponse(
+        {
+            "status": advertiser.get_stripe_setup_status_display(),
+            "client_secret": advertiser.setup_intent_client_secret,
+            "success_url": success_url,
+        }
+    )
+
+
 def signup_success(request):
     """
     Signup advertiser success page
@@ -137,6 +162,27 @@ def signup_success(request):
     return render(request, template, {"error_text": error_text})
 
 
+def get_ads_response(request, content: str, etag: str):
+    response = HttpResponse(content)
+    response["ETag"] = etag
+    # Caches must ask again before each display, to rotate the ads and count
+    # the impressions, but do not download the same ad twice
+    patch_cache_control(response, no_cache=True)
+    return get_conditional_response(request, etag=etag, response=response)
+
+
+def get_ads_checker_response(request, has_ads: bool, etag: str):
+    if has_ads:
+        response = HttpResponse("")
+    else:
+        response = HttpResponseNotFound("Not found")
+    response["ETag"] = etag
+    patch_cache_control(
+        response, public=True, max_age=settings.ADS_CHECKER_MAX_AGE
+    )
+    return get_conditional_response(request, etag=etag, response=response)
+
+
 @xframe_options_exempt
 def ads(request, width=0, height=0, brand="all"):
     """
@@ -150,21 +196,8 @@ def ads(request, width=0, height=0, brand="all"):
     if not width or not height:
         return HttpResponseNotFound("Not found")
 
-    ad_obj = get_ad_from_size(width, height, brand)
-    if ad_obj:
-        code = ad_obj.code
-        # Update the view of this ad
-        ad_obj.view = ad_obj.view + 1
-        ad_obj.save()
-    else:
-        code = None
-    template = "advertisers/ads.html"
-    context = {
-        "code": code,
-        "width": width,
-        "height": height,
-    }
-    return render(request, template, context)
+    content, etag = serve_ad(width, height, brand)
+    return get_ads_response(request, content, etag)
 
 
 def ads_checker(request, width=0, height=0):
@@ -177,10 +210,8 @@ def ads_checker(request, width=0, height=0):
     height = round(float(height))
     if not width or not height:
         return HttpResponseNotFound("Not found")
-    ad_obj = get_ad_from_size(width, height)
-    if ad_obj:
-        return HttpResponse("")
-    return HttpResponseNotFound("Not found")
+    has_ads, etag = check_ads(width, height)
+    return get_ads_checker_response(request, has_ads, etag)
 
 
 @api_view(("GET",))
@@ -3,7 +3,10 @@ import logging
 
 from django_extensions.management.jobs import DailyJob
 
-from emails.mailer import send_welcome_signup_email
+from django.utils import timezone
+
+from emails.mailer import get_follow_up_email
+from emails.tasks import send_campaign
 from emails.utils import AccountEmail
 
 LOGGER = logging.getLogger(__name__)
@@ -11,13 +14,9 @@ LOGGER = logging.getLogger(__name__)
 
 class Job(DailyJob):
     def execute(self):
-        # Get user signed up 6 hours before
-        emails = []
+        # Get users inactive for 2 weeks
         users = AccountEmail.get_deactivated_users()
-        if users.count() > 0:
-            for user in users:
-                emails.append(user.email)
-
-            # send welcome mail
-            send_welcome_signup_email(emails)
-            LOGGER.info("Welcome emails all sent successfully.")
+        # Users inactive again later get another follow up
+        campaign = f"follow_up:{timezone.localdate():%Y-%m-%d}"
+        if send_campaign(campaign, get_follow_up_email(), users):
+            LOGGER.info("Follow up emails all queued.")
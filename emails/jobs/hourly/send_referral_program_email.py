@@ -3,7 +3,10 @@ import logging
 
 from django_extensions.management.jobs import HourlyJob
 
-from emails.mailer import send_referral_program_email
+from django.conf import settings
+
+from emails.mailer import get_referral_program_email
+from emails.tasks import send_campaign
 from emails.utils import AccountEmail
 
 LOGGER = logging.getLogger(__name__)
@@ -12,12 +15,11 @@ LOGGER = logging.getLogger(__name__)
 class Job(HourlyJob):
     def execute(self):
         # Get user signed up 3 hours ago
-        emails = []
-        users = AccountEmail.get_signed_up_users(3)
-        if users.count() > 0:
-            for user in users:
-                emails.append(user.email)
-
-            # send referral program mail
-            send_referral_program_email(emails)
-            LOGGER.info("Referral program emails all sent successfully.")
+        # and the ones missed by the previous runs
+        users = AccountEmail.get_signed_up_users(
+            3, settings.EMAIL_CATCH_UP_HOURS
+        )
+        if send_campaign(
+            "referral_program", get_referral_program_email(), users
+        ):
+            LOGGER.info("Referral program emails all queued.")
@@ -3,7 +3,10 @@ import logging
 
 from django_extensions.management.jobs import HourlyJob
 
-from emails.mailer import send_welcome_signup_email
+from django.conf import settings
+
+from emails.mailer import get_welcome_signup_email
+from emails.tasks import send_campaign
 from emails.utils import AccountEmail
 
 LOGGER = logging.getLogger(__name__)
@@ -12,12 +15,9 @@ LOGGER = logging.getLogger(__name__)
 class Job(HourlyJob):
     def execute(self):
         # Get user signed up 6 hours before
-        emails = []
-        users = AccountEmail.get_signed_up_users()
-        if users.count() > 0:
-            for user in users:
-                emails.append(user.email)
-
-            # send welcome mail
-            send_welcome_signup_email(emails)
-            LOGGER.info("Welcome emails all sent successfully.")
+        # and the ones missed by the previous runs
+        users = AccountEmail.get_signed_up_users(
+            6, settings.EMAIL_CATCH_UP_HOURS
+        )
+        if send_campaign("welcome", get_welcome_signup_email(), users):
+            LOGGER.info("Welcome emails all queued.")
@@ -1,75 +1,102 @@
+import logging
 import os
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
 
 import html2text
 
 from django.conf import settings
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
 
 from accounts.utils import cents_to_dollars, get_current_payout_per_referral
 
+LOGGER = logging.getLogger(__name__)
+# Receive a copy of each campaign
+BCC_EMAILS = ["ian@guppy.co"]
 
-def send_email(
-    recipients,
-    message,
-    subject,
-    from_email="no-reply@m.guppy.co",
-    reply_to_email=None,
-    from_name="Guppy",
-    bcc=None,
-):
+
+def render_email(
+    message: str,
+    subject: str,
+    from_email: str = "no-reply@m.guppy.co",
+    reply_to_email: Optional[str] = None,
+    from_name: str = "Guppy",
+) -> Dict[str, Any]:
+    """
+    Render an email once, to be sent to each recipient by `send_messages`
+    """
+    scoped = ""
+    if settings.DEBUG:
+        scoped = "scoped"
+    header = (
+        """
+        <style %s type='text/css'>
+            .emailImage{
+                height:auto !important;
+                max-width:200px !important;
+                width: 100%% !important;
+            }
+        </style>
+        """
+        % scoped
+    )
+
+    html_content = header + message
+    return {
+        "subject": subject,
+        "html": html_content,
+        "text": html2text.html2text(html_content),
+        "from_email": "%s <%s>" % (from_name, from_email),
+        "reply_to": [reply_to_email] if reply_to_email else [],
+    }
+
+
+def get_recipient_address(recipient: str) -> str:
+    if os.environ.get("DJANGO_SETTINGS_MODULE") != "settings.production":
+        return recipient + ".sink.sparkpostmail.com"
+    return recipient
+
+
+def build_message(
+    email: Dict[str, Any], recipient: str, connection=None
+) -> EmailMultiAlternatives:
     """
-    The sender method
+    The message of a rendered email for one recipient
     """
-    try:
-        if from_email is None:
-            from_email = "no-reply@m.guppy.co"
-        scoped = ""
-        if settings.DEBUG:
-            scoped = "scoped"
-        header = (
-            """
-            <style %s type='text/css'>
-                .emailImage{
-                    height:auto !important;
-                    max-width:200px !important;
-                    width: 100%% !important;
-                }
-            </style>
-            """
-            % scoped
-        )
-
-        message = header + message
-
-        to_email = recipients
-        if os.environ.get("DJANGO_SETTINGS_MODULE") != "settings.production":
-            to_email += ".sink.sparkpostmail.com"
-        html_content = message
-        text_content = html2text.html2text(message)
-        if bcc is None:
-            bcc = ["ian@guppy.co"]
-        elif isinstance(bcc, list):
-            bcc.append("ian@guppy.co")
-        msg = EmailMultiAlternatives(
-            subject=subject,
-            body=text_content,
-            from_email="%s <%s>" % (from_name, from_email),
-            to=to_email,
-            bcc=bcc,
-        )
-        if reply_to_email is not None:
-            msg.reply_to = reply_to_email
-        msg.attach_alternative(html_content, "text/html")
-
-        fail_silently = not settings.DEBUG
-        result = msg.send(fail_silently=fail_silently)
-        return result, html_content
-    except Exception as err:  # pylint: disable=broad-except
-        print(("An email error occurred: %s - %s" % (err.__class__, err)))
-        return False, html_content
-
-
-def send_welcome_signup_email(recipients):
+    message = EmailMultiAlternatives(
+        subject=email["subject"],
+        body=email["text"],
+        from_email=email["from_email"],
+        to=[get_recipient_address(recipient)],
+        reply_to=email["reply_to"],
+        connection=connection,
+    )
+    message.attach_alternative(email["html"], "text/html")
+    return message
+
+
+def send_messages(
+    email: Dict[str, Any], recipients: Iterable[str]
+) -> Iterator[Tuple[str, str]]:
+    """
+    Send a rendered email to each recipient over a single connection
+    Yield each recipient once its email is sent, with the error (empty if
+    the email was sent)
+    """
+    connection = get_connection(fail_silently=False)
+    with connection:
+        for recipient in recipients:
+            try:
+                connection.send_messages(
+                    [build_message(email, recipient, connection)]
+                )
+                error = ""
+            except Exception as err:  # pylint: disable=broad-except
+                LOGGER.warning("Could not send an email to %s.", recipient)
+                error = "%s: %s" % (err.__class__.__name__, err)
+            yield recipient, error
+
+
+def get_welcome_signup_email() -> Dict[str, Any]:
     subject = "Welcome to Guppy!"
     message = """
         <p>Welcome to the Guppy community!</p>
@@ -87,14 +114,10 @@ def send_welcome_signup_email(recipients):
     from_email = "ian@m.guppy.co"
     reply_to_email = "ian@guppy.co"
     from_name = "Ian Campbell"
-    result, message = send_email(
-        recipients, message, subject, from_email, reply_to_email, from_name
-    )
+    return render_email(message, subject, from_email, reply_to_email, from_name)
 
-    return result, message
 
-
-def send_referral_program_email(recipients):
+def get_referral_program_email() -> Dict[str, Any]:
     payout_amount = cents_to_dollars(get_current_payout_per_referral())
     subject = "Earn more with Guppy's referral program"
     message = f"""
@@ -119,14 +142,10 @@ def send_referral_program_email(recipients):
     from_email = "ian@m.guppy.co"
     reply_to_email = "ian@guppy.co"
     from_name = "The Guppy Team"
-    result, message = send_email(
-        recipients, message, subject, from_email, reply_to_email, from_name
-    )
-
-    return result, message
+    return render_email(message, subject, from_email, reply_to_email, from_name)
 
 
-def send_follow_up_email(recipients):
+def get_follow_up_email() -> Dict[str, Any]:
     subject = "Your Guppy account is inactive"
     message = """
         <p>I noticed your Guppy account is inactive -
@@ -147,8 +166,4 @@ def send_follow_up_email(recipients):
     from_email = "ian@m.guppy.co"
     reply_to_email = "ian@guppy.co"
     from_name = "Ian Campbell"
-    result, message = send_email(
-        recipients, message, subject, from_email, reply_to_email, from_name
-    )
-
-    return result, message
+    return render_email(message, subject, from_email, reply_to_email, from_name)
@@ -0,0 +1,31 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:08
+
+from django.db import migrations, models
+import django_extensions.db.fields
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailSend',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', django_extensions.db.fields.CreationDateTimeField(auto_now_add=True, verbose_name='created')),
+                ('modified', django_extensions.db.fields.ModificationDateTimeField(auto_now=True, verbose_name='modified')),
+                ('campaign', models.CharField(db_index=True, max_length=50)),
+                ('email', models.EmailField(max_length=254)),
+                ('status', models.IntegerField(choices=[(0, 'Sent'), (1, 'Failed')], default=0)),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'get_latest_by': 'modified',
+                'abstract': False,
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# The users signed up before the last windows of the hourly jobs got their
+# emails, the catch-up of the jobs must not send them again
+BACKFILL_EMAIL_SENDS = """
+INSERT INTO emails_emailsend
+    (created, modified, campaign, user_id, email, status, error)
+SELECT now(), now(), campaigns.campaign, users.id, users.email, 0, ''
+FROM accounts_userprofile users
+CROSS JOIN (VALUES ('welcome', 6), ('referral_program', 3))
+    AS campaigns (campaign, hours)
+WHERE users.created >= now() - interval '2 days'
+AND users.created < now() - make_interval(hours => campaigns.hours + 1)
+ON CONFLICT (user_id, campaign) DO NOTHING;
+"""
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('emails', '0001_email_send'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='emailsend',
+            options={},
+        ),
+        migrations.AddField(
+            model_name='emailsend',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='emailsend',
+            name='user',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='email_sends', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='emailsend',
+            name='status',
+            field=models.IntegerField(choices=[(0, 'Sent'), (1, 'Failed'), (2, 'Pending'), (3, 'Claimed')], default=2),
+        ),
+        migrations.AddIndex(
+            model_name='emailsend',
+            index=models.Index(fields=['campaign', 'status'], name='emails_emai_campaig_b33406_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='emailsend',
+            constraint=models.UniqueConstraint(fields=('user', 'campaign'), name='unique_email_send'),
+        ),
+        migrations.RunSQL(BACKFILL_EMAIL_SENDS, migrations.RunSQL.noop),
+    ]
@@ -0,0 +1,50 @@
+from django_extensions.db.models import TimeStampedModel
+
+from django.conf import settings
+from django.db import models
+
+
+class EmailSend(TimeStampedModel):
+    """
+    Ledger of the campaign emails, one row per user and campaign.
+
+    Rows are added as pending by `send_campaign`, claimed by chunks by the
+    email tasks and updated with the outcome of each send, so that a rerun
+    only sends the emails which were not sent.
+    """
+
+    SENT = 0
+    FAILED = 1
+    PENDING = 2
+    CLAIMED = 3
+    STATUSES = (
+        (SENT, "Sent"),
+        (FAILED, "Failed"),
+        (PENDING, "Pending"),
+        (CLAIMED, "Claimed"),
+    )
+
+    campaign = models.CharField(max_length=50, db_index=True)
+    # Empty for the copies sent to the team
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="email_sends",
+        null=True,
+        blank=True,
+    )
+    email = models.EmailField()
+    status = models.IntegerField(choices=STATUSES, default=PENDING)
+    error = models.TextField(blank=True, default="")
+    claimed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "campaign"], name="unique_email_send"
+            )
+        ]
+        indexes = [models.Index(fields=["campaign", "status"])]
+
+    def __str__(self):
+        return f"{self.campaign} to {self.email}"
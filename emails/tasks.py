@@ -0,0 +1,126 @@
+import logging
+import math
+from datetime import timedelta
+from typing import Any, Dict, List
+
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db import connection, transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from accounts.models import UserProfile
+from guppy.celery import APP
+
+from .mailer import BCC_EMAILS, send_messages
+from .models import EmailSend
+
+LOGGER = logging.getLogger(__name__)
+EMAIL_SENDS_INSERT_SQL = """
+INSERT INTO emails_emailsend
+    (created, modified, campaign, user_id, email, status, error, claimed_at)
+SELECT %s, %s, %s, users.id, users.email, %s, '', NULL
+FROM accounts_userprofile users
+WHERE users.id IN ({user_ids})
+ON CONFLICT (user_id, campaign) DO NOTHING
+"""
+
+
+def add_email_sends(campaign: str, users: QuerySet[UserProfile]) -> int:
+    """
+    Add the users who are not in the ledger of the campaign as pending
+    Return the number of added users
+    """
+    try:
+        user_ids, params = users.values("pk").query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            EMAIL_SENDS_INSERT_SQL.format(user_ids=user_ids),
+            [now, now, campaign, EmailSend.PENDING, *params],
+        )
+        added = cursor.rowcount
+    if added:
+        # A copy of the campaign is sent once
+        EmailSend.objects.bulk_create(
+            [EmailSend(campaign=campaign, email=email) for email in BCC_EMAILS]
+        )
+    return added
+
+
+def get_claimable_email_sends(campaign: str) -> QuerySet[EmailSend]:
+    """
+    Pending sends, and the sends claimed by tasks which did not finish
+    """
+    claim_expiry = timezone.now() - timedelta(
+        seconds=settings.EMAIL_CLAIM_TIMEOUT
+    )
+    return EmailSend.objects.filter(
+        Q(status=EmailSend.PENDING)
+        | Q(status=EmailSend.CLAIMED, claimed_at__lt=claim_expiry),
+        campaign=campaign,
+    )
+
+
+def claim_email_sends(campaign: str) -> List[EmailSend]:
+    """
+    Claim a chunk of sends, skipping the ones claimed by other tasks
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        email_sends = list(
+            get_claimable_email_sends(campaign)
+            .select_for_update(skip_locked=True)
+            .order_by("pk")[: settings.EMAIL_CHUNK_SIZE]
+        )
+        EmailSend.objects.filter(
+            pk__in=[email_send.pk for email_send in email_sends]
+        ).update(status=EmailSend.CLAIMED, claimed_at=now, modified=now)
+    return email_sends
+
+
+@APP.task
+def send_email_chunk(campaign: str, email: Dict[str, Any]) -> int:
+    """
+    Send a rendered email to a chunk of the pending recipients of a campaign
+    and record the outcome of each email
+    Return the number of sent emails
+    """
+    email_sends = claim_email_sends(campaign)
+    if not email_sends:
+        return 0
+
+    sent = 0
+    messages = send_messages(
+        email, [email_send.email for email_send in email_sends]
+    )
+    for email_send, (_, error) in zip(email_sends, messages):
+        # Recorded as soon as it is sent, so that a task stopped in the
+        # middle of the chunk does not leave it to be sent again
+        EmailSend.objects.filter(pk=email_send.pk).update(
+            status=EmailSend.FAILED if error else EmailSend.SENT,
+            error=error,
+            modified=timezone.now(),
+        )
+        sent += 0 if error else 1
+    LOGGER.info("Sent %s of %s %s emails.", sent, len(email_sends), campaign)
+    return sent
+
+
+def send_campaign(
+    campaign: str, email: Dict[str, Any], users: QuerySet[UserProfile]
+) -> int:
+    """
+    Send a rendered email to the users who did not get the campaign yet,
+    by chunks claimed by tasks running in parallel
+    Return the number of tasks
+    """
+    add_email_sends(campaign, users)
+    tasks = math.ceil(
+        get_claimable_email_sends(campaign).count() / settings.EMAIL_CHUNK_SIZE
+    )
+    for _ in range(tasks):
+        send_email_chunk.delay(campaign, email)
+    return tasks
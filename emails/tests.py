@@ -1,131 +1,243 @@
 # pylint: disable=missing-docstring
 import datetime
+import socketserver
+import threading
 
 import mock
 from freezegun import freeze_time
 
-from django.test import TestCase
+from django.conf import settings
+from django.core import mail
+from django.db import connection, transaction
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.utils import timezone
 
 from accounts.factories import UserProfileFactory
+from accounts.models import UserProfile
 from emails.jobs.daily.send_follow_up_email import Job as FollowUpJob
 from emails.jobs.hourly.send_referral_program_email import Job as ReferralJob
 from emails.jobs.hourly.send_welcome_email import Job
 
+from . import mailer
+from .mailer import BCC_EMAILS, render_email
+from .models import EmailSend
+from .tasks import claim_email_sends, send_campaign, send_email_chunk
 from .utils import AccountEmail
 
 
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """
+    SMTP session keeping the messages, and refusing the "reject" addresses
+    """
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode())
+
+    def handle(self):
+        self.server.connections += 1
+        self.reply("220 localhost")
+        recipients = []
+        for line in self.rfile:
+            command = line.decode().strip()
+            verb = command[:4].upper()
+            if verb == "RCPT":
+                address = command.split(":", 1)[1].strip(" <>")
+                if address.startswith("reject"):
+                    self.reply("550 No such user")
+                    continue
+                recipients.append(address)
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = b"".join(iter(self.rfile.readline, b".\r\n"))
+                self.server.messages.append((recipients, data.decode()))
+                recipients = []
+            elif verb in ("MAIL", "RSET"):
+                recipients = []
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            self.reply("250 OK")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPSinkHandler)
+        self.connections = 0
+        self.messages = []
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
 class EmailUtilsTests(TestCase):
     def setUp(self):
         UserProfileFactory.create_batch(10)
         self.hourly_job = Job()
 
-    @mock.patch("emails.mailer.EmailMultiAlternatives.send")
     @freeze_time("2021-02-01")
-    def test_get_user_signed_up_from_the_past(self, send_email):
+    def test_get_user_signed_up_from_the_past(self):
         users = AccountEmail.get_signed_up_users()
         self.assertEqual(users.count(), 0)
         self.hourly_job.execute()
-        self.assertEqual(send_email.call_count, 0)
+        self.assertEqual(len(mail.outbox), 0)
 
-    @mock.patch("emails.mailer.EmailMultiAlternatives.send")
-    def test_get_user_just_signed_up_now(self, send_email):
+    def test_get_user_just_signed_up_now(self):
         users = AccountEmail.get_signed_up_users()
         self.assertEqual(users.count(), 0)
         self.hourly_job.execute()
-        self.assertEqual(send_email.call_count, 0)
+        self.assertEqual(len(mail.outbox), 0)
 
-    @mock.patch("emails.mailer.EmailMultiAlternatives.send")
-    def test_get_user_signed_up_greater_than_6_hours(self, send_email):
+    def test_get_user_signed_up_greater_than_6_hours(self):
         seven_hours_after = timezone.now() + datetime.timedelta(hours=7)
         with freeze_time(seven_hours_after):
             users = AccountEmail.get_signed_up_users()
             self.assertEqual(users.count(), 0)
+            # Missed by the previous runs
             self.hourly_job.execute()
-            self.assertEqual(send_email.call_count, 0)
+            self.assertEqual(len(mail.outbox), 11)
 
-    @mock.patch("emails.mailer.EmailMultiAlternatives.send")
-    def test_get_user_signed_up_less_than_6_hours(self, send_email):
+    def test_get_user_signed_up_less_than_6_hours(self):
         five_hours_after = timezone.now() + datetime.timedelta(hours=5)
         with freeze_time(five_hours_after):
             users = AccountEmail.get_signed_up_users()
             self.assertEqual(users.count(), 0)
             self.hourly_job.execute()
-            self.assertEqual(send_email.call_count, 0)
+            self.assertEqual(len(mail.outbox), 0)
 
-    @mock.patch("emails.mailer.EmailMultiAlternatives.send")
-    def test_get_user_signed_up_6_hours_before(self, send_email):
+    def test_get_user_signed_up_6_hours_before(self):
         six_hours_after = timezone.now() + datetime.timedelta(hours=6)
         with freeze_time(six_hours_after):
             users = AccountEmail.get_signed_up_users()
             self.assertEqual(users.count(), 10)
             self.hourly_job.execute()
-            self.assertEqual(send_email.call_count, 1)
+            # One message per recipient, and the copy
+            self.assertEqual(len(mail.outbox), 11)
+            self.assertEqual(
+                [len(message.to) for message in mail.outbox], [1] * 11
+            )
+
+    @override_settings(EMAIL_CHUNK_SIZE=3)
+    def test_send_emails_by_chunks(self):
+        six_hours_after = timezone.now() + datetime.timedelta(hours=6)
+        with freeze_time(six_hours_after), mock.patch(
+            "emails.tasks.send_email_chunk.delay",
+            wraps=send_email_chunk.delay,
+        ) as send_email_chunk_delay:
+            self.hourly_job.execute()
+            self.assertEqual(send_email_chunk_delay.call_count, 4)
+            self.assertEqual(len(mail.outbox), 11)
+            self.assertEqual(
+                sorted(
+                    email_send.email for email_send in EmailSend.objects.all()
+                ),
+                sorted(
+                    list(UserProfile.objects.values_list("email", flat=True))
+                    + BCC_EMAILS
+                ),
+            )
+            self.assertFalse(
+                EmailSend.objects.exclude(status=EmailSend.SENT).exists()
+            )
+
+            # The next runs do not send the emails again
+            send_email_chunk_delay.reset_mock()
+            self.hourly_job.execute()
+            self.assertEqual(send_email_chunk_delay.call_count, 0)
+            self.assertEqual(len(mail.outbox), 11)
+
+    @override_settings(EMAIL_CHUNK_SIZE=3)
+    def test_resume_claimed_emails(self):
+        six_hours_after = timezone.now() + datetime.timedelta(hours=6)
+        with freeze_time(six_hours_after) as frozen_time:
+            # A task stopped after claiming a chunk
+            with mock.patch("emails.tasks.send_email_chunk.delay"):
+                self.hourly_job.execute()
+            claimed = claim_email_sends("welcome")
+            self.assertEqual(len(claimed), 3)
+
+            self.hourly_job.execute()
+            self.assertEqual(len(mail.outbox), 8)
+            self.assertEqual(
+                EmailSend.objects.filter(status=EmailSend.CLAIMED).count(), 3
+            )
+
+            frozen_time.tick(
+                datetime.timedelta(seconds=settings.EMAIL_CLAIM_TIMEOUT + 1)
+            )
+            self.hourly_job.execute()
+            self.assertEqual(len(mail.outbox), 11)
+            self.assertEqual(
+                sorted(message.to[0] for message in mail.outbox[8:]),
+                sorted(
+                    email_send.email + ".sink.sparkpostmail.com"
+                    for email_send in claimed
+                ),
+            )
 
 
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
 class ReferralProgramEmailTests(TestCase):
     def setUp(self):
         UserProfileFactory.create_batch(10)
         self.hourly_job = ReferralJob()
 
-    @mock.patch("emails.mailer.EmailMultiAlternatives.send")
     @freeze_time("2021-02-01")
-    def test_get_user_signed_up_from_the_past(self, send_email):
+    def test_get_user_signed_up_from_the_past(self):
         users = AccountEmail.get_signed_up_users(3)
         self.assertEqual(users.count(), 0)
         self.hourly_job.execute()
-        self.assertEqual(send_email.call_count, 0)
+        self.assertEqual(len(mail.outbox), 0)
 
-    @mock.patch("emails.mailer.EmailMultiAlternatives.send")
-    def test_get_user_just_signed_up_now(self, send_email):
+    def test_get_user_just_signed_up_now(self):
         users = AccountEmail.get_signed_up_users(3)
         self.assertEqual(users.count(), 0)
         self.hourly_job.execute()
-        self.assertEqual(send_email.call_count, 0)
+        self.assertEqual(len(mail.outbox), 0)
 
-    @mock.patch("emails.mailer.EmailMultiAlternatives.send")
-    def test_get_user_signed_up_greater_than_3_hours(self, send_email):
+    def test_get_user_signed_up_greater_than_3_hours(self):
         four_hours_after = timezone.now() + datetime.timedelta(hours=4)
         with freeze_time(four_hours_after):
             users = AccountEmail.get_signed_up_users(3)
             self.assertEqual(users.count(), 0)
+            # Missed by the previous runs
             self.hourly_job.execute()
-            self.assertEqual(send_email.call_count, 0)
+            self.assertEqual(len(mail.outbox), 11)
 
-    @mock.patch("emails.mailer.EmailMultiAlternatives.send")
-    def test_get_user_signed_up_less_than_3_hours(self, send_email):
+    def test_get_user_signed_up_less_than_3_hours(self):
         two_hours_after = timezone.now() + datetime.timedelta(hours=2)
         with freeze_time(two_hours_after):
             users = AccountEmail.get_signed_up_users(3)
             self.assertEqual(users.count(), 0)
             self.hourly_job.execute()
-            self.assertEqual(send_email.call_count, 0)
+            self.assertEqual(len(mail.outbox), 0)
 
-    @mock.patch("emails.mailer.EmailMultiAlternatives.send")
-    def test_get_user_signed_up_3_hours_before(self, send_email):
+    def test_get_user_signed_up_3_hours_before(self):
         three_hours_after = timezone.now() + datetime.timedelta(hours=3)
         with freeze_time(three_hours_after):
             users = AccountEmail.get_signed_up_users(3)
             self.assertEqual(users.count(), 10)
             self.hourly_job.execute()
-            self.assertEqual(send_email.call_count, 1)
+            # One message per recipient, and the copy
+            self.assertEqual(len(mail.outbox), 11)
+            self.assertEqual(
+                [len(message.to) for message in mail.outbox], [1] * 11
+            )
 
 
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
 class FollowUpEmailTests(TestCase):
     def setUp(self):
         self.users = UserProfileFactory.create_batch(10, is_waitlisted=False)
         self.daily_job = FollowUpJob()
 
-    @mock.patch("emails.mailer.EmailMultiAlternatives.send")
     @freeze_time("2021-01-10")
-    def test_get_users_deactivated_empty(self, send_email):
+    def test_get_users_deactivated_empty(self):
         users = AccountEmail.get_deactivated_users()
         self.assertEqual(users.count(), 0)
         self.daily_job.execute()
-        self.assertEqual(send_email.call_count, 0)
+        self.assertEqual(len(mail.outbox), 0)
 
-    @mock.patch("emails.mailer.EmailMultiAlternatives.send")
-    def test_get_users_deactivated_now(self, send_email):
+    def test_get_users_deactivated_now(self):
         date = timezone.now()
         self.users[1].last_posting_time = date
         self.users[1].save()
@@ -134,10 +246,9 @@ class FollowUpEmailTests(TestCase):
         users = AccountEmail.get_deactivated_users()
         self.assertEqual(users.count(), 0)
         self.daily_job.execute()
-        self.assertEqual(send_email.call_count, 0)
+        self.assertEqual(len(mail.outbox), 0)
 
-    @mock.patch("emails.mailer.EmailMultiAlternatives.send")
-    def test_get_users_deactivated_less_than_2_weeks(self, send_email):
+    def test_get_users_deactivated_less_than_2_weeks(self):
         date = timezone.now() - datetime.timedelta(days=20)
         self.users[1].last_posting_time = date
         self.users[1].save()
@@ -146,10 +257,9 @@ class FollowUpEmailTests(TestCase):
         users = AccountEmail.get_deactivated_users()
         self.assertEqual(users.count(), 0)
         self.daily_job.execute()
-        self.assertEqual(send_email.call_count, 0)
+        self.assertEqual(len(mail.outbox), 0)
 
-    @mock.patch("emails.mailer.EmailMultiAlternatives.send")
-    def test_get_users_deactivated_greater_than_2_weeks(self, send_email):
+    def test_get_users_deactivated_greater_than_2_weeks(self):
         date = timezone.now() - datetime.timedelta(days=22)
         self.users[1].last_posting_time = date
         self.users[1].save()
@@ -158,10 +268,9 @@ class FollowUpEmailTests(TestCase):
         users = AccountEmail.get_deactivated_users()
         self.assertEqual(users.count(), 0)
         self.daily_job.execute()
-        self.assertEqual(send_email.call_count, 0)
+        self.assertEqual(len(mail.outbox), 0)
 
-    @mock.patch("emails.mailer.EmailMultiAlternatives.send")
-    def test_get_users_deactivated_2_weeks_before(self, send_email):
+    def test_get_users_deactivated_2_weeks_before(self):
         two_weeks_before = timezone.now() - datetime.timedelta(days=21)
         self.users[1].last_posting_time = two_weeks_before
         self.users[1].save()
@@ -170,4 +279,173 @@ class FollowUpEmailTests(TestCase):
         users = AccountEmail.get_deactivated_users()
         self.assertEqual(users.count(), 2)
         self.daily_job.execute()
-        self.assertEqual(send_email.call_count, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(
+            mail.outbox[0].subject, "Your Guppy account is inactive"
+        )
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox[:2]),
+            sorted(
+                user.email + ".sink.sparkpostmail.com"
+                for user in self.users[1:3]
+            ),
+        )
+
+    @freeze_time("2021-02-01 10:00")
+    def test_get_users_deactivated_day_bounds(self):
+        day_begin = timezone.now().replace(hour=0) - datetime.timedelta(days=21)
+        for user, last_posting_time in zip(
+            self.users,
+            [
+                day_begin - datetime.timedelta(microseconds=1),
+                day_begin,
+                day_begin + datetime.timedelta(hours=23, minutes=59),
+                day_begin + datetime.timedelta(days=1),
+            ],
+        ):
+            user.last_posting_time = last_posting_time
+            user.save()
+        self.assertEqual(
+            set(AccountEmail.get_deactivated_users()), set(self.users[1:3])
+        )
+
+
+@override_settings(
+    CELERY_TASK_ALWAYS_EAGER=True,
+    EMAIL_BACKEND="django.core.mail.backends.smtp.EmailBackend",
+    EMAIL_HOST="127.0.0.1",
+    EMAIL_CHUNK_SIZE=2,
+)
+class EmailDeliveryTests(TestCase):
+    def setUp(self):
+        self.sink = SMTPSink()
+        threading.Thread(target=self.sink.serve_forever, daemon=True).start()
+        self.addCleanup(self.sink.server_close)
+        self.addCleanup(self.sink.shutdown)
+        port_settings = override_settings(
+            EMAIL_PORT=self.sink.server_address[1]
+        )
+        port_settings.enable()
+        self.addCleanup(port_settings.disable)
+
+    def test_send_campaign(self):
+        email = render_email("<p>Hello</p>", "Hello")
+        for recipient in ["one@guppy.co", "reject@guppy.co", "two@guppy.co"]:
+            UserProfileFactory(email=recipient)
+        users = UserProfile.objects.all()
+        self.assertEqual(send_campaign("hello", email, users), 2)
+
+        # One connection per chunk, one message per accepted recipient
+        self.assertEqual(self.sink.connections, 2)
+        self.assertEqual(
+            [to for to, _ in self.sink.messages],
+            [
+                [recipient + ".sink.sparkpostmail.com"]
+                for recipient in ["one@guppy.co", "two@guppy.co"] + BCC_EMAILS
+            ],
+        )
+        self.assertTrue(
+            all("Subject: Hello" in data for _, data in self.sink.messages)
+        )
+        sends = {
+            email_send.email: email_send
+            for email_send in EmailSend.objects.filter(campaign="hello")
+        }
+        self.assertEqual(len(sends), 4)
+        self.assertEqual(sends["reject@guppy.co"].status, EmailSend.FAILED)
+        self.assertIn("SMTPRecipientsRefused", sends["reject@guppy.co"].error)
+        for recipient in ["one@guppy.co", "two@guppy.co"] + BCC_EMAILS:
+            self.assertEqual(sends[recipient].status, EmailSend.SENT)
+            self.assertEqual(sends[recipient].error, "")
+
+    def test_stopped_chunk_keeps_sent_emails(self):
+        email = render_email("<p>Hello</p>", "Hello")
+        for recipient in ["one@guppy.co", "two@guppy.co"]:
+            UserProfileFactory(email=recipient)
+        with mock.patch("emails.tasks.send_email_chunk.delay"):
+            send_campaign("hello", email, UserProfile.objects.all())
+
+        # The worker stops after the first email
+        messages = []
+        build_message = mailer.build_message
+
+        def build_first_message(email, recipient, smtp_connection):
+            if messages:
+                raise SystemExit()
+            messages.append(build_message(email, recipient, smtp_connection))
+            return messages[-1]
+
+        with mock.patch(
+            "emails.mailer.build_message", side_effect=build_first_message
+        ), self.assertRaises(SystemExit):
+            send_email_chunk("hello", email)
+        self.assertEqual(len(self.sink.messages), 1)
+        self.assertEqual(
+            dict(EmailSend.objects.values_list("email", "status")),
+            {
+                "one@guppy.co": EmailSend.SENT,
+                "two@guppy.co": EmailSend.CLAIMED,
+                **{recipient: EmailSend.PENDING for recipient in BCC_EMAILS},
+            },
+        )
+
+        # Resumed after the claim timeout, without the sent email
+        with freeze_time(
+            timezone.now()
+            + datetime.timedelta(seconds=settings.EMAIL_CLAIM_TIMEOUT + 1)
+        ):
+            send_email_chunk("hello", email)
+        self.assertEqual(
+            [to for to, _ in self.sink.messages],
+            [
+                [recipient + ".sink.sparkpostmail.com"]
+                for recipient in ["one@guppy.co", "two@guppy.co"] + BCC_EMAILS
+            ],
+        )
+
+    def test_send_campaign_without_recipients(self):
+        users = UserProfile.objects.none()
+        self.assertEqual(send_campaign("hello", render_email("", ""), users), 0)
+        self.assertEqual(self.sink.connections, 0)
+        self.assertFalse(EmailSend.objects.exists())
+
+
+class EmailSendClaimTests(TransactionTestCase):
+    def test_claim_skips_locked_sends(self):
+        users = UserProfileFactory.create_batch(4)
+        with mock.patch("emails.tasks.send_email_chunk.delay"):
+            send_campaign(
+                "hello", render_email("", ""), UserProfile.objects.all()
+            )
+        self.assertEqual(
+            EmailSend.objects.filter(status=EmailSend.PENDING).count(),
+            len(users) + len(BCC_EMAILS),
+        )
+
+        claims = []
+
+        def claim():
+            claims.append(claim_email_sends("hello"))
+            connection.close()
+
+        with override_settings(EMAIL_CHUNK_SIZE=2), transaction.atomic():
+            # Locked by another task
+            locked = list(
+                EmailSend.objects.select_for_update().order_by("pk")[:2]
+            )
+            thread = threading.Thread(target=claim)
+            thread.start()
+            thread.join()
+        self.assertEqual(
+            [email_send.pk for email_send in claims[0]],
+            list(
+                EmailSend.objects.exclude(
+                    pk__in=[email_send.pk for email_send in locked]
+                )
+                .order_by("pk")
+                .values_list("pk", flat=True)[:2]
+            ),
+        )
+        self.assertEqual(
+            EmailSend.objects.filter(status=EmailSend.CLAIMED).count(), 2
+        )
@@ -10,9 +10,17 @@ LOGGER = logging.getLogger(__name__)
 
 
 class AccountEmail:
+    """
+    Users receiving the emails of the scheduled jobs
+    """
+
     @staticmethod
-    def get_signed_up_users(hours: int = 6) -> QuerySet[UserProfile]:
-        signed_up_time_begin = timezone.now() - timedelta(hours=hours + 1)
+    def get_signed_up_users(
+        hours: int = 6, window_hours: int = 1
+    ) -> QuerySet[UserProfile]:
+        signed_up_time_begin = timezone.now() - timedelta(
+            hours=hours + window_hours
+        )
         signed_up_time_end = timezone.now() - timedelta(hours=hours)
 
         users = UserProfile.objects.filter(
@@ -26,13 +34,14 @@ class AccountEmail:
         # Get users who do not post data last N days + 7 days
         # (An user is active if posted data for last 7 days)
         date = timezone.now() - timedelta(days=days + 7)
+        day_begin = timezone.localtime(date).replace(
+            hour=0, minute=0, second=0, microsecond=0
+        )
         users = UserProfile.objects.filter(
             is_active=True,
             is_waitlisted=False,
-            last_posting_time__isnull=False,
-            last_posting_time__year=date.year,
-            last_posting_time__month=date.month,
-            last_posting_time__day=date.day,
+            last_posting_time__gte=day_begin,
+            last_posting_time__lt=day_begin + timedelta(days=1),
         )
 
         return users
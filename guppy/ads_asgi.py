@@ -0,0 +1,16 @@
+"""
+ASGI config of the ads server.
+
+It serves only the ads, ads checker and popup ads URLs with async views,
+so that one process can answer many ad requests at once, apart from the
+WSGI workers. See the README for the deployment.
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+# Not the settings of the WSGI workers, which serve all the URLs
+os.environ["DJANGO_SETTINGS_MODULE"] = "settings.ads"
+
+application = get_asgi_application()
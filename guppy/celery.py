@@ -1,6 +1,7 @@
 from __future__ import absolute_import, unicode_literals
 
 import os
+import threading
 
 from celery import Celery
 from kombu import Queue
@@ -30,6 +31,8 @@ TASK_ROUTES = (
     [
         ("emails.tasks.*", {"queue": "email"}),
         ("accounts.tasks.*", {"queue": "notification"}),
+        ("advertisers.tasks.*", {"queue": "notification"}),
+        ("search.tasks.*", {"queue": "notification"}),
     ],
 )
 APP.conf.task_routes = TASK_ROUTES
@@ -38,6 +41,34 @@ APP.conf.task_routes = TASK_ROUTES
 APP.autodiscover_tasks()
 
 
+# Broker connections of the threads publishing with `publish_once`
+PUBLISHERS = threading.local()
+
+
+def publish_once(task, args, timeout):
+    """
+    Send a task from a request without retrying, waiting at most the
+    timeout to connect to the broker and to publish.
+    Raise OperationalError or OSError when it could not be sent.
+    """
+    connection = getattr(PUBLISHERS, "connection", None)
+    if connection is None:
+        # Connected once, the default retries wait seconds between tries
+        connection = APP.connection_for_write(
+            connect_timeout=timeout, transport_options={"max_retries": 0}
+        )
+        PUBLISHERS.connection = connection
+    try:
+        task.apply_async(
+            args, connection=connection, retry=False, timeout=timeout
+        )
+    except Exception:
+        # Connected again by the next task
+        PUBLISHERS.connection = None
+        connection.release()
+        raise
+
+
 @APP.task(bind=True)
 def debug_task(self):
     print("Request: {0!r}".format(self.request))
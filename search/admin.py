@@ -1,7 +1,17 @@
 from django.contrib import admin
 from django.utils.html import format_html
 
-from .models import History, Search, SearchResult
+from .analytics import get_ctr
+from .models import (
+    ClickRollup,
+    History,
+    ResultClickDay,
+    ResultClickHour,
+    Search,
+    SearchResult,
+    SearchTermFrequency,
+    UserDailyActivity,
+)
 
 
 @admin.register(Search)
@@ -67,3 +77,81 @@ class HistoryAdmin(admin.ModelAdmin):
         return "anonymous user"
 
     view_user.short_description = "User"  # type: ignore
+
+
+@admin.register(UserDailyActivity)
+class UserDailyActivityAdmin(admin.ModelAdmin):
+    list_display = (
+        "user_id",
+        "day",
+        "history_count",
+        "search_count",
+        "clicks",
+        "last_activity",
+    )
+    list_filter = ("user_id",)
+    ordering = ("-day",)
+
+
+@admin.register(SearchTermFrequency)
+class SearchTermFrequencyAdmin(admin.ModelAdmin):
+    list_display = ("terms", "count")
+    search_fields = ("terms",)
+    ordering = ("-count",)
+
+
+@admin.register(ClickRollup)
+class ClickRollupAdmin(admin.ModelAdmin):
+    list_display = ("until", "since", "impressions", "clicks")
+    readonly_fields = ("since", "until", "impressions", "clicks")
+
+
+class ResultClickAdmin(admin.ModelAdmin):
+    """
+    Rollups of the clicks by search terms and result
+    """
+
+    search_fields = ("terms", "domain")
+    list_select_related = ("result",)
+    raw_id_fields = ("result",)
+
+    def _url(self, obj) -> str:  # pylint: disable=no-self-use
+        if len(obj.result.url) > 60:
+            return obj.result.url[:60] + "..."
+        return obj.result.url
+
+    def ctr(self, obj) -> str:  # pylint: disable=no-self-use
+        ctr = get_ctr(obj.impressions, obj.clicks)
+        return "-" if ctr is None else f"{ctr:.2%}"
+
+    ctr.short_description = "CTR"  # type: ignore
+
+
+@admin.register(ResultClickHour)
+class ResultClickHourAdmin(ResultClickAdmin):
+    list_display = (
+        "terms",
+        "_url",
+        "domain",
+        "hour",
+        "impressions",
+        "clicks",
+        "ctr",
+    )
+    date_hierarchy = "hour"
+    ordering = ("-hour", "-clicks")
+
+
+@admin.register(ResultClickDay)
+class ResultClickDayAdmin(ResultClickAdmin):
+    list_display = (
+        "terms",
+        "_url",
+        "domain",
+        "day",
+        "impressions",
+        "clicks",
+        "ctr",
+    )
+    date_hierarchy = "day"
+    ordering = ("-day", "-clicks")
@@ -0,0 +1,226 @@
+import logging
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import ExpressionWrapper, F, FloatField, Q, Sum
+from django.db.models.functions import Cast, Coalesce
+from django.utils import timezone
+
+from .autocomplete import NORMALIZED_TERMS_SQL, normalize_terms
+from .models import ClickRollup, ResultClickDay, ResultClickHour, get_hash
+
+LOGGER = logging.getLogger(__name__)
+# Advisory lock of the rollup job
+CLICK_ROLLUP_LOCK = get_hash("search_click_rollup")
+# Host of a result url, without its user, port and "www."
+DOMAIN_SQL = """COALESCE(left(regexp_replace(regexp_replace(
+    lower(substring(url from '^[a-zA-Z][a-zA-Z0-9+.-]*://([^/?#]*)')),
+    '^.*@|:[0-9]*$', '', 'g'
+), '^www\\.', ''), 255), '')"""
+# Add the impressions and clicks of the search results not rolled up yet
+# to the hourly and daily rollups in a single statement, counted in the hour
+# of the last impression or click of each search result.
+# A click is counted for each impression at most, like a result clicked again
+# from the same page.
+CLICK_ROLLUP_SQL = """
+WITH events AS (
+    UPDATE search_searchresult AS shown
+    SET
+        rolled_up_impressions = shown.impressions,
+        rolled_up_clicks = shown.count
+    FROM search_searchresult AS previous
+    WHERE previous.id = shown.id
+        AND (
+            shown.impressions > shown.rolled_up_impressions
+            OR shown.count > shown.rolled_up_clicks
+        )
+        AND {where}
+    RETURNING
+        shown.search_id,
+        shown.result_id,
+        shown.modified AS time,
+        shown.impressions - previous.rolled_up_impressions AS impressions,
+        LEAST(shown.count, shown.impressions) - LEAST(
+            previous.rolled_up_clicks, previous.rolled_up_impressions
+        ) AS clicks
+), totals AS (
+    SELECT
+        {terms} AS terms,
+        events.result_id,
+        date_trunc('hour', events.time) AS hour,
+        SUM(events.impressions) AS impressions,
+        SUM(events.clicks) AS clicks
+    FROM events
+    JOIN search_search ON search_search.id = events.search_id
+    GROUP BY 1, 2, 3
+), rollups AS (
+    SELECT totals.*, {domain} AS domain
+    FROM totals
+    JOIN search_result ON search_result.id = totals.result_id
+    WHERE terms <> '' AND length(terms) <= 100
+), hours AS (
+    INSERT INTO search_resultclickhour
+        (terms, result_id, domain, hour, impressions, clicks)
+    SELECT terms, result_id, domain, hour, impressions, clicks
+    FROM rollups
+    ON CONFLICT (terms, result_id, hour) DO UPDATE SET
+        impressions = (
+            search_resultclickhour.impressions + EXCLUDED.impressions
+        ),
+        clicks = search_resultclickhour.clicks + EXCLUDED.clicks
+), days AS (
+    INSERT INTO search_resultclickday
+        (terms, result_id, domain, day, impressions, clicks)
+    SELECT terms, result_id, domain, hour::date, SUM(impressions), SUM(clicks)
+    FROM rollups
+    GROUP BY terms, result_id, domain, hour::date
+    ON CONFLICT (terms, result_id, day) DO UPDATE SET
+        impressions = search_resultclickday.impressions + EXCLUDED.impressions,
+        clicks = search_resultclickday.clicks + EXCLUDED.clicks
+)
+SELECT COALESCE(SUM(impressions), 0), COALESCE(SUM(clicks), 0) FROM rollups
+"""
+
+
+def rollup_clicks() -> Dict[str, int]:
+    """
+    Add the impressions and clicks made since the previous rollup to the
+    click rollups, and delete the old hourly rollups
+    Return the number of impressions and clicks added
+    """
+    # Searches still being saved are counted by the next rollup
+    until = timezone.now() - timedelta(seconds=settings.SEARCH_ANALYTICS_DELAY)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_try_advisory_xact_lock(%s)", [CLICK_ROLLUP_LOCK]
+        )
+        if not cursor.fetchone()[0]:
+            LOGGER.info("Clicks are being rolled up by another job.")
+            return {"impressions": 0, "clicks": 0}
+
+        previous = ClickRollup.objects.first()
+        since = previous.until if previous else None
+        if since is None:
+            where = "shown.modified < %(until)s"
+        elif since < until:
+            # The impressions and clicks are counted once, whenever they
+            # were made
+            where = "shown.modified >= %(since)s AND shown.modified < %(until)s"
+        else:
+            return {"impressions": 0, "clicks": 0}
+        cursor.execute(
+            CLICK_ROLLUP_SQL.format(
+                terms=NORMALIZED_TERMS_SQL, domain=DOMAIN_SQL, where=where
+            ),
+            {"since": since, "until": until},
+        )
+        impressions, clicks = cursor.fetchone()
+        ClickRollup.objects.create(
+            since=since, until=until, impressions=impressions, clicks=clicks
+        )
+        ResultClickHour.objects.filter(
+            hour__lt=until
+            - timedelta(days=settings.SEARCH_ANALYTICS_HOURLY_DAYS)
+        ).delete()
+    return {"impressions": impressions, "clicks": clicks}
+
+
+def get_ctr(impressions: int, clicks: int) -> Optional[float]:
+    return round(clicks / impressions, 4) if impressions else None
+
+
+def get_top_results(
+    terms: str, days: int = 7, limit: int = 10
+) -> List[Dict[str, Any]]:
+    """
+    Results clicked the most for the search terms during the last N days
+    """
+    since = timezone.now().date() - timedelta(days=days)
+    rows = (
+        ResultClickDay.objects.filter(
+            terms=normalize_terms(terms), day__gt=since
+        )
+        .values("result_id", "result__url")
+        .annotate(impressions=Sum("impressions"), clicks=Sum("clicks"))
+        .order_by("-clicks", "-impressions", "result_id")
+    )
+    return [
+        {
+            "url": row["result__url"],
+            "impressions": row["impressions"],
+            "clicks": row["clicks"],
+            "ctr": get_ctr(row["impressions"], row["clicks"]),
+        }
+        for row in rows[:limit]
+    ]
+
+
+def get_domain_ctrs(days: int = 7, limit: int = 10) -> List[Dict[str, Any]]:
+    """
+    Click-through rates of the most clicked domains during the last N days
+    """
+    since = timezone.now().date() - timedelta(days=days)
+    rows = (
+        ResultClickDay.objects.filter(day__gt=since)
+        .values("domain")
+        .annotate(impressions=Sum("impressions"), clicks=Sum("clicks"))
+        .order_by("-clicks", "-impressions", "domain")
+    )
+    return [
+        {
+            "domain": row["domain"],
+            "impressions": row["impressions"],
+            "clicks": row["clicks"],
+            "ctr": get_ctr(row["impressions"], row["clicks"]),
+        }
+        for row in rows[:limit]
+    ]
+
+
+def get_trending_queries(
+    hours: int = 24, baseline_hours: int = 7 * 24, limit: int = 10
+) -> List[Dict[str, Any]]:
+    """
+    Search terms clicked during the last N hours the most above their
+    clicks of the previous hours, scaled to the same duration
+    """
+    start = timezone.now().replace(
+        minute=0, second=0, microsecond=0
+    ) - timedelta(hours=hours - 1)
+    baseline_start = start - timedelta(hours=baseline_hours)
+    rows = (
+        ResultClickHour.objects.filter(hour__gte=baseline_start)
+        .values("terms")
+        .annotate(
+            recent_clicks=Coalesce(Sum("clicks", filter=Q(hour__gte=start)), 0),
+            baseline_clicks=Coalesce(
+                Sum("clicks", filter=Q(hour__lt=start)), 0
+            ),
+        )
+        .filter(recent_clicks__gt=0)
+        .annotate(
+            # Smoothed so that the new terms need a few clicks to trend
+            score=ExpressionWrapper(
+                Cast(F("recent_clicks"), FloatField())
+                / (
+                    Cast(F("baseline_clicks"), FloatField())
+                    * hours
+                    / baseline_hours
+                    + 1
+                ),
+                output_field=FloatField(),
+            )
+        )
+        .order_by("-score", "terms")
+    )
+    return [
+        {
+            "terms": row["terms"],
+            "clicks": row["recent_clicks"],
+            "baseline_clicks": row["baseline_clicks"],
+            "score": round(row["score"], 4),
+        }
+        for row in rows[:limit]
+    ]
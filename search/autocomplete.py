@@ -0,0 +1,298 @@
+import fcntl
+import heapq
+import json
+import logging
+import mmap
+import os
+import shutil
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import Search, SearchTermFrequency
+
+LOGGER = logging.getLogger(__name__)
+MANIFEST_NAME = "manifest.json"
+LOCK_NAME = "autocomplete.lock"
+# Search terms lowercased with their whitespace collapsed, like
+# `normalize_terms`
+NORMALIZED_TERMS_SQL = (
+    "lower(regexp_replace(btrim(search_terms), '\\s+', ' ', 'g'))"
+)
+# Add the searches made since they were last counted to the frequencies,
+# by normalized terms
+SEARCH_TERM_FREQUENCIES_UPSERT_SQL = """
+WITH searches AS (
+    UPDATE search_search AS counted
+    SET counted = counted.count
+    FROM search_search AS previous
+    WHERE previous.id = counted.id
+        AND counted.count > counted.counted
+        AND {where}
+    RETURNING counted.search_terms, counted.count - previous.counted AS count
+)
+INSERT INTO search_searchtermfrequency (terms, count)
+SELECT terms, SUM(count)
+FROM (SELECT {terms} AS terms, count FROM searches) AS searches
+WHERE terms <> '' AND length(terms) <= 100
+GROUP BY terms
+ON CONFLICT (terms) DO UPDATE SET
+    count = search_searchtermfrequency.count + EXCLUDED.count
+"""
+
+
+def normalize_terms(terms: str) -> str:
+    return " ".join(terms.lower().split())
+
+
+def update_search_term_frequencies(since: Optional[datetime]) -> None:
+    """
+    Add the searches made since the last update to the frequencies, or
+    count them all again
+    """
+    with connection.cursor() as cursor:
+        if since is None:
+            SearchTermFrequency.objects.all().delete()
+            Search.objects.filter(counted__gt=0).update(counted=0)
+            cursor.execute(
+                SEARCH_TERM_FREQUENCIES_UPSERT_SQL.format(
+                    terms=NORMALIZED_TERMS_SQL, where="TRUE"
+                )
+            )
+        else:
+            cursor.execute(
+                SEARCH_TERM_FREQUENCIES_UPSERT_SQL.format(
+                    terms=NORMALIZED_TERMS_SQL,
+                    where="counted.modified >= %s",
+                ),
+                [since - timedelta(seconds=settings.AUTOCOMPLETE_OVERLAP)],
+            )
+
+
+def write_suggestions(
+    directory: str, frequencies: Iterable[Tuple[str, Any]]
+) -> int:
+    """
+    Write the terms sorted by their UTF-8 bytes, so that the completions of
+    a prefix are a range of them, with a sparse table of the most searched
+    term of each power of two range
+    Return the number of terms
+    """
+    os.makedirs(directory)
+    terms = sorted((terms.encode(), count) for terms, count in frequencies)
+    offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    with open(os.path.join(directory, "terms.bin"), "wb") as terms_file:
+        for index, (encoded, _) in enumerate(terms):
+            terms_file.write(encoded)
+            offsets[index + 1] = offsets[index] + len(encoded)
+    counts = np.array([count for _, count in terms], dtype=np.int64)
+
+    # best[level][i]: index of the most searched term of [i, i + 2**level)
+    size = len(terms)
+    levels = [np.arange(size, dtype=np.int32)]
+    width = 1
+    while width * 2 <= size:
+        previous = levels[-1]
+        end = size - width + 1
+        left = previous[: end - width]
+        right = previous[width:end]
+        # Ties go to the first term
+        levels.append(np.where(counts[right] > counts[left], right, left))
+        width *= 2
+    best = np.full((len(levels), len(terms)), -1, dtype=np.int32)
+    for level, indexes in enumerate(levels):
+        best[level, : len(indexes)] = indexes
+
+    np.save(os.path.join(directory, "offsets.npy"), offsets)
+    np.save(os.path.join(directory, "counts.npy"), counts)
+    np.save(os.path.join(directory, "best.npy"), best)
+    return size
+
+
+class Suggestions:
+    """
+    Memory-mapped suggestions written by `write_suggestions`, shared by the
+    processes of the server
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or settings.AUTOCOMPLETE_DIR
+        manifest = read_manifest(self.directory)
+        self.version = manifest["version"]
+        self.terms = b""  # type: Union[mmap.mmap, bytes]
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.best = np.zeros((0, 0), dtype=np.int32)
+        if self.version is None:
+            return
+
+        path = os.path.join(self.directory, self.version)
+        with open(os.path.join(path, "terms.bin"), "rb") as terms_file:
+            if os.fstat(terms_file.fileno()).st_size:
+                self.terms = mmap.mmap(
+                    terms_file.fileno(), 0, access=mmap.ACCESS_READ
+                )
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.counts = np.load(os.path.join(path, "counts.npy"), mmap_mode="r")
+        self.best = np.load(os.path.join(path, "best.npy"), mmap_mode="r")
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def get_terms(self, index: int) -> bytes:
+        start, end = self.offsets[index], self.offsets[index + 1]
+        return self.terms[start:end]
+
+    def bisect(self, value: bytes) -> int:
+        """
+        Index of the first terms not lower than the value
+        """
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.get_terms(middle) < value:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def get_best(self, start: int, end: int) -> int:
+        """
+        Index of the most searched terms of [start, end)
+        """
+        level = (end - start).bit_length() - 1
+        left = int(self.best[level, start])
+        right = int(self.best[level, end - (1 << level)])
+        if self.counts[right] > self.counts[left]:
+            return right
+        return left
+
+    def complete(self, prefix: str, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        Most searched terms starting with the prefix
+        """
+        terms = normalize_terms(prefix)
+        if not terms or len(self) == 0:
+            return []
+        if prefix[-1].isspace():
+            # Completions of the last word only
+            terms += " "
+        encoded = terms.encode()
+        # No UTF-8 byte is 0xff
+        start, end = self.bisect(encoded), self.bisect(encoded + b"\xff")
+
+        suggestions = []  # type: List[Dict[str, Any]]
+        ranges = []  # type: List[Tuple[int, int, int, int]]
+        if start < end:
+            best = self.get_best(start, end)
+            ranges.append((-int(self.counts[best]), best, start, end))
+        while ranges and len(suggestions) < limit:
+            count, best, start, end = heapq.heappop(ranges)
+            suggestions.append(
+                {"terms": self.get_terms(best).decode(), "count": -count}
+            )
+            for range_start, range_end in ((start, best), (best + 1, end)):
+                if range_start < range_end:
+                    index = self.get_best(range_start, range_end)
+                    heapq.heappush(
+                        ranges,
+                        (
+                            -int(self.counts[index]),
+                            index,
+                            range_start,
+                            range_end,
+                        ),
+                    )
+        return suggestions
+
+
+def read_manifest(directory: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {"version": None, "updated_at": None}
+
+
+def update_suggestions(
+    directory: Optional[str] = None, full: bool = False
+) -> Dict[str, Any]:
+    """
+    Add the searches made since the last update to the frequencies, and
+    write the suggestions of the most searched terms
+    """
+    directory = directory or settings.AUTOCOMPLETE_DIR
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_NAME), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            LOGGER.info("Suggestions are being updated by another job.")
+            return {"terms": 0}
+
+        started = timezone.now()
+        max_terms = settings.AUTOCOMPLETE_MAX_TERMS
+        manifest = read_manifest(directory)
+        since = None
+        if not full and manifest["updated_at"] is not None:
+            since = datetime.fromisoformat(manifest["updated_at"])
+        # The counts are rolled back if the manifest is not written, so
+        # that the searches are not counted twice
+        with transaction.atomic():
+            update_search_term_frequencies(since)
+            version = str(time.time_ns())
+            most_searched = SearchTermFrequency.objects.filter(
+                count__gte=settings.AUTOCOMPLETE_MIN_COUNT
+            ).order_by("-count", "terms")
+            frequencies = most_searched.values_list("terms", "count")
+            size = write_suggestions(
+                os.path.join(directory, version), frequencies[:max_terms]
+            )
+            path = os.path.join(directory, MANIFEST_NAME)
+            with open(f"{path}.tmp", "w") as file:
+                json.dump(
+                    {"version": version, "updated_at": started.isoformat()},
+                    file,
+                )
+            os.replace(f"{path}.tmp", path)
+
+        # The processes reading the old versions keep their mappings, and
+        # the previous version is kept until the next update for the
+        # processes which read its manifest but did not open it yet
+        kept = {version, manifest["version"]}
+        for entry in os.listdir(directory):
+            if entry not in kept and os.path.isdir(
+                os.path.join(directory, entry)
+            ):
+                shutil.rmtree(os.path.join(directory, entry))
+    return {"terms": size}
+
+
+_SUGGESTIONS = None  # type: Optional[Suggestions]
+_SUGGESTIONS_VERSION = None  # type: Optional[Tuple[str, int]]
+
+
+def get_suggestions() -> Suggestions:
+    """
+    Get the suggestions of the process, reopened when they are updated
+    """
+    # pylint: disable=global-statement
+    global _SUGGESTIONS, _SUGGESTIONS_VERSION
+
+    directory = settings.AUTOCOMPLETE_DIR
+    try:
+        version = (
+            directory,
+            os.stat(os.path.join(directory, MANIFEST_NAME)).st_mtime_ns,
+        )
+    except FileNotFoundError:
+        version = (directory, 0)
+    if _SUGGESTIONS is None or version != _SUGGESTIONS_VERSION:
+        _SUGGESTIONS, _SUGGESTIONS_VERSION = Suggestions(directory), version
+    return _SUGGESTIONS
@@ -0,0 +1,118 @@
+import logging
+import queue
+import threading
+from typing import Any, Dict, Optional
+
+from kombu.exceptions import OperationalError
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from guppy.celery import publish_once
+
+from .tasks import save_click
+from .utils import click_url
+
+LOGGER = logging.getLogger(__name__)
+CELERY = "celery"
+THREAD = "thread"
+
+
+class ClickRecorder:
+    """
+    Count the clicks tracked by `search_tracking` without making the
+    redirect wait for the database, depending on SEARCH_CLICKS_ASYNC:
+    in the request (None), by a task of the notification queue ("celery")
+    or by a worker thread of the process ("thread").
+
+    The tasks are published once, waiting at most
+    SEARCH_CLICKS_PUBLISH_TIMEOUT to connect to the broker and to publish,
+    the clicks that could not be published are dropped.
+
+    The thread reads a bounded queue, the clicks coming while it is full
+    are dropped. The counters are kept by each process.
+    """
+
+    def __init__(self, queue_size: Optional[int] = None):
+        self.queue = queue.Queue(
+            queue_size or settings.SEARCH_CLICKS_QUEUE_SIZE
+        )  # type: queue.Queue[Dict[str, Any]]
+        self.lock = threading.Lock()
+        self.worker = None  # type: Optional[threading.Thread]
+        self.counters = {"queued": 0, "saved": 0, "dropped": 0, "failed": 0}
+
+    def count(self, counter: str) -> None:
+        with self.lock:
+            self.counters[counter] += 1
+
+    def record(self, data: Dict[str, Any]) -> bool:
+        """
+        Count a click, or hand it to the background
+        Return whether the click was not dropped
+        """
+        mode = settings.SEARCH_CLICKS_ASYNC
+        if mode == CELERY:
+            try:
+                # The redirect does not wait for a slow or down broker
+                publish_once(
+                    save_click, (data,), settings.SEARCH_CLICKS_PUBLISH_TIMEOUT
+                )
+            except (OperationalError, OSError):
+                LOGGER.exception("Could not send a click to save.")
+                self.count("dropped")
+                return False
+            self.count("queued")
+            return True
+
+        if mode == THREAD:
+            self.start()
+            try:
+                self.queue.put_nowait(data)
+            except queue.Full:
+                self.count("dropped")
+                return False
+            self.count("queued")
+            return True
+
+        self.save(data)
+        return True
+
+    def save(self, data: Dict[str, Any]) -> None:
+        try:
+            click_url(data)
+        except Exception:  # pylint: disable=broad-except
+            LOGGER.exception("Could not save a click.")
+            self.count("failed")
+        else:
+            self.count("saved")
+
+    def start(self) -> None:
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(
+                    target=self.work, name="click-recorder", daemon=True
+                )
+                self.worker.start()
+
+    def work(self) -> None:
+        while True:
+            data = self.queue.get()
+            try:
+                self.save(data)
+            finally:
+                # Like at the end of a request
+                close_old_connections()
+                self.queue.task_done()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Counters of the process and the clicks waiting for the thread
+        """
+        with self.lock:
+            stats = dict(self.counters)  # type: Dict[str, Any]
+        stats["mode"] = settings.SEARCH_CLICKS_ASYNC
+        stats["depth"] = self.queue.qsize()
+        return stats
+
+
+CLICK_RECORDER = ClickRecorder()
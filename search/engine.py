@@ -0,0 +1,461 @@
+import fcntl
+import json
+import logging
+import math
+import mmap
+import os
+import re
+import shutil
+import time
+from datetime import datetime
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from urllib.parse import urlsplit
+
+import numpy as np
+
+from django.conf import settings
+from django.db.models import Max, Q, Sum
+from django.utils import timezone
+
+from .models import History, Result, SearchResult, get_hash
+
+LOGGER = logging.getLogger(__name__)
+TOKEN_RE = re.compile(r"[^\W_]+")
+# Tokens of most urls, which do not tell them apart
+URL_STOP_WORDS = {"http", "https", "www", "com", "html", "htm", "php"}
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+# Results read from the database at once when building a segment
+DOCUMENTS_BATCH_SIZE = 1000
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(text.lower())
+
+
+def tokenize_url(url: str) -> List[str]:
+    parts = urlsplit(url)
+    return [
+        token
+        for token in tokenize(f"{parts.netloc} {parts.path}")
+        if token not in URL_STOP_WORDS
+    ]
+
+
+class Document:
+    """
+    Searchable text of a Result: the words of its url and of its title,
+    and the search terms it was shown for, weighted by its clicks for them
+    """
+
+    def __init__(self, result_id: int, url: str, title: str = ""):
+        self.result_id = result_id
+        self.url = url
+        self.title = title
+        self.clicks = 0
+        self.weights = {}  # type: Dict[str, float]
+        for token in tokenize_url(url) + tokenize(title):
+            self.add(token, 1.0)
+
+    def add(self, token: str, weight: float) -> None:
+        self.weights[token] = self.weights.get(token, 0.0) + weight
+
+    def add_search(self, search_terms: str, clicks: int) -> None:
+        self.clicks += clicks
+        for token in set(tokenize(search_terms)):
+            self.add(token, 1.0 + clicks)
+
+    @property
+    def length(self) -> float:
+        return sum(self.weights.values())
+
+
+def get_documents(result_ids: Iterable[int]) -> Iterator[Document]:
+    """
+    Read the documents of the results, by batches
+    """
+    result_ids = sorted(set(result_ids))
+    for start in range(0, len(result_ids), DOCUMENTS_BATCH_SIZE):
+        end = start + DOCUMENTS_BATCH_SIZE
+        documents = {
+            result.pk: Document(result.pk, result.url)
+            for result in Result.objects.filter(pk__in=result_ids[start:end])
+        }
+        urls = {document.url: document for document in documents.values()}
+        titles = (
+            History.objects.filter(
+                url_hash__in={get_hash(url) for url in urls}, url__in=urls
+            )
+            .exclude(title="")
+            # The title of the most recently modified history of each url
+            .order_by("url", "-modified")
+            .distinct("url")
+            .values_list("url", "title")
+        )
+        for url, title in titles:
+            document = urls[url]
+            document.title = title
+            for token in tokenize(title):
+                document.add(token, 1.0)
+        searches = (
+            SearchResult.objects.filter(result_id__in=documents)
+            .values("result_id", "search__search_terms")
+            .annotate(clicks=Sum("count"))
+            .values_list("result_id", "search__search_terms", "clicks")
+        )
+        for result_id, search_terms, clicks in searches:
+            documents[result_id].add_search(search_terms, clicks)
+        yield from documents.values()
+
+
+def write_segment(directory: str, documents: Iterable[Document]) -> int:
+    """
+    Write the inverted index of the documents to a segment directory:
+    NumPy arrays of the documents and of the posting lists, sorted by term
+    hash, and the urls and titles as JSON lines.
+    Return the number of documents
+    """
+    os.makedirs(directory)
+    doc_ids = []  # type: List[int]
+    doc_lengths = []  # type: List[float]
+    doc_clicks = []  # type: List[int]
+    doc_offsets = [0]
+    postings = {}  # type: Dict[int, List[Tuple[int, float]]]
+    with open(os.path.join(directory, "documents.jsonl"), "wb") as docs_file:
+        for index, document in enumerate(documents):
+            line = (json.dumps([document.url, document.title]) + "\n").encode()
+            docs_file.write(line)
+            doc_offsets.append(doc_offsets[-1] + len(line))
+            doc_ids.append(document.result_id)
+            doc_lengths.append(document.length)
+            doc_clicks.append(document.clicks)
+            for token, weight in document.weights.items():
+                postings.setdefault(get_hash(token), []).append((index, weight))
+
+    term_hashes = sorted(postings)
+    term_offsets = [0]
+    for term_hash in term_hashes:
+        term_offsets.append(term_offsets[-1] + len(postings[term_hash]))
+    arrays = {
+        "doc_ids": np.array(doc_ids, dtype=np.int64),
+        "doc_lengths": np.array(doc_lengths, dtype=np.float32),
+        "doc_clicks": np.array(doc_clicks, dtype=np.int64),
+        "doc_offsets": np.array(doc_offsets, dtype=np.int64),
+        "term_hashes": np.array(term_hashes, dtype=np.int64),
+        "term_offsets": np.array(term_offsets, dtype=np.int64),
+        "posting_docs": np.array(
+            [index for term in term_hashes for index, _ in postings[term]],
+            dtype=np.int32,
+        ),
+        "posting_weights": np.array(
+            [weight for term in term_hashes for _, weight in postings[term]],
+            dtype=np.float32,
+        ),
+    }  # type: Dict[str, np.ndarray]
+    for name, array in arrays.items():
+        np.save(os.path.join(directory, f"{name}.npy"), array)
+    return len(doc_ids)
+
+
+class Segment:
+    """
+    Memory-mapped segment written by `write_segment`
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.doc_ids = self.load("doc_ids")
+        self.doc_lengths = self.load("doc_lengths")
+        self.doc_clicks = self.load("doc_clicks")
+        self.doc_offsets = self.load("doc_offsets")
+        self.term_hashes = self.load("term_hashes")
+        self.term_offsets = self.load("term_offsets")
+        self.posting_docs = self.load("posting_docs")
+        self.posting_weights = self.load("posting_weights")
+        with open(os.path.join(directory, "documents.jsonl"), "rb") as docs:
+            self.documents = (
+                mmap.mmap(docs.fileno(), 0, access=mmap.ACCESS_READ)
+                if os.fstat(docs.fileno()).st_size
+                else b""
+            )  # type: Union[mmap.mmap, bytes]
+        # Documents which are not replaced by a newer segment
+        self.live = np.ones(len(self.doc_ids), dtype=bool)
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def load(self, name: str) -> np.ndarray:
+        return np.load(
+            os.path.join(self.directory, f"{name}.npy"), mmap_mode="r"
+        )
+
+    def get_postings(self, term_hash: int) -> Tuple[np.ndarray, np.ndarray]:
+        index = int(np.searchsorted(self.term_hashes, term_hash))
+        if (
+            index == len(self.term_hashes)
+            or self.term_hashes[index] != term_hash
+        ):
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+        start, end = self.term_offsets[index], self.term_offsets[index + 1]
+        docs = self.posting_docs[start:end]
+        live = self.live[docs]
+        return docs[live], self.posting_weights[start:end][live]
+
+    def get_document(self, index: int) -> Tuple[str, str]:
+        start, end = self.doc_offsets[index], self.doc_offsets[index + 1]
+        url, title = json.loads(self.documents[start:end])
+        return url, title
+
+
+class SearchIndex:
+    """
+    Inverted index of the Results, made of the segments listed by its
+    manifest. Documents of the newer segments replace the older ones.
+
+    Results are ranked by BM25, boosted by their clicks.
+    """
+
+    MANIFEST_NAME = "manifest.json"
+    LOCK_NAME = "index.lock"
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or settings.SEARCH_INDEX_DIR
+        self.manifest = read_manifest(self.directory)
+        self.segments = [
+            Segment(os.path.join(self.directory, name))
+            for name in self.manifest["segments"]
+        ]
+        result_ids = set()  # type: Set[int]
+        for segment in reversed(self.segments):
+            segment.live = ~np.isin(segment.doc_ids, list(result_ids))
+            result_ids.update(segment.doc_ids.tolist())
+        self.document_count = sum(
+            int(segment.live.sum()) for segment in self.segments
+        )
+        length = sum(
+            float(segment.doc_lengths[segment.live].sum())
+            for segment in self.segments
+        )
+        self.average_length = (
+            length / self.document_count if self.document_count else 0.0
+        )
+
+    def search(
+        self, query: str, limit: int = 10, offset: int = 0
+    ) -> Tuple[int, List[Dict[str, Any]]]:
+        """
+        Best results for the words of the query
+        Return the number of matching results and the requested page
+        """
+        keys, scores = [], []  # type: List[np.ndarray], List[np.ndarray]
+        # Documents of all segments are numbered after the previous segments
+        starts = np.cumsum([0] + [len(segment) for segment in self.segments])
+        for token in set(tokenize(query)):
+            postings = [
+                segment.get_postings(get_hash(token))
+                for segment in self.segments
+            ]
+            frequency = sum(len(docs) for docs, _ in postings)
+            if not frequency:
+                continue
+            idf = math.log(
+                1 + (self.document_count - frequency + 0.5) / (frequency + 0.5)
+            )
+            for segment, start, (docs, weights) in zip(
+                self.segments, starts, postings
+            ):
+                lengths = segment.doc_lengths[docs]
+                keys.append(start + docs.astype(np.int64))
+                scores.append(
+                    idf
+                    * weights
+                    * (K1 + 1)
+                    / (
+                        weights
+                        + K1 * (1 - B + B * lengths / self.average_length)
+                    )
+                )
+        if not keys:
+            return 0, []
+
+        documents, inverse = np.unique(
+            np.concatenate(keys), return_inverse=True
+        )
+        segment_indexes = (
+            np.asarray(np.searchsorted(starts, documents, side="right")) - 1
+        )
+        clicks = np.zeros(len(documents))
+        for segment_index, segment in enumerate(self.segments):
+            in_segment = segment_indexes == segment_index
+            clicks[in_segment] = segment.doc_clicks[
+                documents[in_segment] - starts[segment_index]
+            ]
+        totals = np.bincount(inverse, weights=np.concatenate(scores)) * (
+            1 + settings.SEARCH_CLICK_WEIGHT * np.log1p(clicks)
+        )
+
+        end = offset + limit
+        order = np.argsort(-totals, kind="stable")[offset:end]
+        results = []
+        for position in order:
+            segment_index = int(segment_indexes[position])
+            segment = self.segments[segment_index]
+            index = documents[position] - starts[segment_index]
+            url, title = segment.get_document(index)
+            results.append(
+                {
+                    "id": int(segment.doc_ids[index]),
+                    "url": url,
+                    "title": title,
+                    "score": float(totals[position]),
+                }
+            )
+        return len(documents), results
+
+
+def read_manifest(directory: str) -> Dict[str, Any]:
+    try:
+        with open(os.path.join(directory, SearchIndex.MANIFEST_NAME)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {"segments": [], "updated_at": None, "last_result_id": 0}
+
+
+def write_manifest(directory: str, manifest: Dict[str, Any]) -> None:
+    path = os.path.join(directory, SearchIndex.MANIFEST_NAME)
+    with open(f"{path}.tmp", "w") as file:
+        json.dump(manifest, file)
+    # Readers see the old or the new manifest
+    os.replace(f"{path}.tmp", path)
+
+
+def get_changed_result_ids(since: datetime, last_result_id: int) -> Set[int]:
+    """
+    Results added, shown, clicked or visited since the last update.
+    Titles of the histories updated later are indexed by the next merge.
+    """
+    result_ids = set(
+        Result.objects.filter(pk__gt=last_result_id).values_list(
+            "pk", flat=True
+        )
+    )
+    result_ids.update(
+        SearchResult.objects.filter(modified__gte=since).values_list(
+            "result_id", flat=True
+        )
+    )
+    result_ids.update(
+        Result.objects.filter(
+            url_hash__in=History.objects.filter(
+                ~Q(title=""), created__gte=since
+            ).values("url_hash")
+        ).values_list("pk", flat=True)
+    )
+    return result_ids
+
+
+def update_search_index(
+    directory: Optional[str] = None, full: bool = False
+) -> Dict[str, Any]:
+    """
+    Add a segment with the results changed since the last update, or
+    rebuild the index in one segment when it has too many segments
+    """
+    directory = directory or settings.SEARCH_INDEX_DIR
+    os.makedirs(directory, exist_ok=True)
+    stats = {"documents": 0, "segments": 0, "merged": False}
+    with open(os.path.join(directory, SearchIndex.LOCK_NAME), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            LOGGER.info("Search index is being updated by another job.")
+            return stats
+
+        started = timezone.now()
+        manifest = read_manifest(directory)
+        last_result_id = (
+            Result.objects.aggregate(last_id=Max("pk"))["last_id"] or 0
+        )
+        if (
+            full
+            or manifest["updated_at"] is None
+            or len(manifest["segments"]) >= settings.SEARCH_INDEX_MAX_SEGMENTS
+        ):
+            result_ids = (
+                Result.objects.filter(pk__lte=last_result_id)
+                .values_list("pk", flat=True)
+                .iterator()
+            )  # type: Iterable[int]
+            segments = []  # type: List[str]
+            stats["merged"] = True
+        else:
+            result_ids = get_changed_result_ids(
+                datetime.fromisoformat(manifest["updated_at"]),
+                manifest["last_result_id"],
+            )
+            segments = manifest["segments"]
+        name = str(time.time_ns())
+        stats["documents"] = write_segment(
+            os.path.join(directory, name),
+            get_documents(result_ids),
+        )
+        if stats["documents"] or not segments:
+            segments = segments + [name]
+        else:
+            shutil.rmtree(os.path.join(directory, name))
+        write_manifest(
+            directory,
+            {
+                "segments": segments,
+                # Changes made during the update are added by the next one
+                "updated_at": started.isoformat(),
+                "last_result_id": last_result_id,
+            },
+        )
+        stats["segments"] = len(segments)
+
+        # The processes reading the removed segments keep their mappings,
+        # and the segments of the previous manifest are kept until the next
+        # update for the processes which read it but did not open them yet
+        kept = set(segments) | set(manifest["segments"])
+        for entry in os.listdir(directory):
+            path = os.path.join(directory, entry)
+            if os.path.isdir(path) and entry not in kept:
+                shutil.rmtree(path)
+    return stats
+
+
+_INDEX = None  # type: Optional[SearchIndex]
+_INDEX_VERSION = None  # type: Optional[Tuple[str, int]]
+
+
+def get_search_index() -> SearchIndex:
+    """
+    Get the search index of the process, reopened when it is updated
+    """
+    global _INDEX, _INDEX_VERSION  # pylint: disable=global-statement
+
+    directory = settings.SEARCH_INDEX_DIR
+    try:
+        version = (
+            directory,
+            os.stat(
+                os.path.join(directory, SearchIndex.MANIFEST_NAME)
+            ).st_mtime_ns,
+        )
+    except FileNotFoundError:
+        version = (directory, 0)
+    if _INDEX is None or version != _INDEX_VERSION:
+        _INDEX, _INDEX_VERSION = SearchIndex(directory), version
+    return _INDEX
@@ -0,0 +1,22 @@
+import logging
+
+from django_extensions.management.jobs import DailyJob
+
+from django.conf import settings
+
+from search.utils import purge_search_data
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Job(DailyJob):
+    """
+    Apply the retention policy of the histories and searches
+    """
+
+    def execute(self):
+        if settings.SEARCH_DATA_RETENTION_DAYS is None:
+            return
+
+        deleted = purge_search_data(settings.SEARCH_DATA_RETENTION_DAYS)
+        LOGGER.info("Old search data deleted: %s", deleted)
@@ -0,0 +1,22 @@
+import logging
+
+from django_extensions.management.jobs import HourlyJob
+
+from search.analytics import rollup_clicks
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Job(HourlyJob):
+    """
+    Add the search results shown and clicked to the click rollups
+    """
+
+    def execute(self):
+        stats = rollup_clicks()
+
+        LOGGER.info(
+            "Clicks rolled up: %s impressions, %s clicks.",
+            stats["impressions"],
+            stats["clicks"],
+        )
@@ -0,0 +1,23 @@
+import logging
+
+from django_extensions.management.jobs import HourlyJob
+
+from search.engine import update_search_index
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Job(HourlyJob):
+    """
+    Index the results changed during the last hour
+    """
+
+    def execute(self):
+        stats = update_search_index()
+
+        LOGGER.info(
+            "Search index updated: %s documents, %s segments%s.",
+            stats["documents"],
+            stats["segments"],
+            " (merged)" if stats["merged"] else "",
+        )
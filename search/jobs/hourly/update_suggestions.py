@@ -0,0 +1,18 @@
+import logging
+
+from django_extensions.management.jobs import HourlyJob
+
+from search.autocomplete import update_suggestions
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Job(HourlyJob):
+    """
+    Count the searches of the last hour and update the suggestions
+    """
+
+    def execute(self):
+        stats = update_suggestions()
+
+        LOGGER.info("Suggestions updated: %s search terms.", stats["terms"])
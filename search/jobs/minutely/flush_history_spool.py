@@ -0,0 +1,25 @@
+import logging
+
+from django_extensions.management.jobs import MinutelyJob
+
+from search.spool import HistorySpool
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Job(MinutelyJob):
+    """
+    Write the spooled page visits to the database
+    """
+
+    def execute(self):
+        stats = HistorySpool().flush()
+
+        LOGGER.info(
+            "History spool flushed: %s visits in %.3fs, latency %.3fs, "
+            "depth %s.",
+            stats["last_flush_visits"],
+            stats["last_flush_duration"],
+            stats["last_flush_latency"],
+            stats["depth"],
+        )
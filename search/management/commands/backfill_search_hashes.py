@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+
+from search.models import History, Result, Search
+from search.utils import backfill_hashes
+
+
+class Command(BaseCommand):
+    """
+    Fill the url and search terms hashes of the rows saved without them.
+    Run it after `search.0006` and before `search.0007` on big tables so
+    that the latter migration does not have to backfill them.
+    """
+
+    help = "Fill the missing url and search terms hashes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        for model, field, hash_field in (
+            (Result, "url", "url_hash"),
+            (History, "url", "url_hash"),
+            (Search, "search_terms", "search_terms_hash"),
+        ):
+            updated = backfill_hashes(
+                model, field, hash_field, options["batch_size"]
+            )
+            self.stdout.write(
+                f"{model.__name__}: {updated} {hash_field} filled."
+            )
@@ -0,0 +1,95 @@
+import time
+from unittest import mock
+
+from kombu.exceptions import OperationalError
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from django.urls import reverse
+
+from search import clicks
+from search.views import search_tracking
+
+
+class Command(BaseCommand):
+    """
+    Time the redirects of `search_tracking` with the clicks counted in the
+    request, by a task and by the worker thread, for growing database and
+    broker latencies.
+    The latency is simulated by a sleep instead of counting the clicks, or
+    of publishing the task, which fails after the publish timeout.
+    """
+
+    help = "Benchmark the search tracking redirects"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--latencies",
+            type=float,
+            nargs="+",
+            default=[0, 5, 50],
+            help="Simulated database and broker latencies, in milliseconds",
+        )
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--queue-size", type=int, default=1000)
+
+    @staticmethod
+    def publish(latency):
+        """
+        Publishing of a task to a broker answering after the latency
+        """
+
+        def publish_once(task, args, timeout):
+            if latency / 1000 > timeout:
+                time.sleep(timeout)
+                raise OperationalError("Publish timed out")
+            time.sleep(latency / 1000)
+
+        return publish_once
+
+    def handle(self, *args, **options):
+        url = reverse("search:search_tracking")
+        request_factory = RequestFactory()
+        for latency in options["latencies"]:
+            for mode in (None, clicks.CELERY, clicks.THREAD):
+                recorder = clicks.ClickRecorder(options["queue_size"])
+                with override_settings(SEARCH_CLICKS_ASYNC=mode), mock.patch(
+                    "search.clicks.click_url",
+                    lambda data, latency=latency: time.sleep(latency / 1000),
+                ), mock.patch(
+                    "search.clicks.publish_once",
+                    self.publish(latency),
+                ), mock.patch(
+                    "search.views.CLICK_RECORDER", recorder
+                ):
+                    durations = []
+                    for index in range(options["requests"]):
+                        request = request_factory.get(
+                            url,
+                            {
+                                "url": f"'https://example.com/{index}'",
+                                "search_term": "'benchmark'",
+                            },
+                        )
+                        request.user = AnonymousUser()
+                        started = time.monotonic()
+                        search_tracking(request)
+                        durations.append(time.monotonic() - started)
+                    recorder.queue.join()
+
+                durations.sort()
+                median = durations[len(durations) // 2]
+                p99 = durations[int(len(durations) * 0.99)]
+                stats = recorder.stats()
+                self.stdout.write(
+                    f"{latency:g}ms latency, {mode or 'sync'}: "
+                    f"p50 {median * 1000:.2f}ms, p99 {p99 * 1000:.2f}ms, "
+                    f"{stats['saved']} saved, {stats['queued']} queued, "
+                    f"{stats['dropped']} dropped"
+                )
+        self.stdout.write(
+            "The tasks time out after "
+            f"{settings.SEARCH_CLICKS_PUBLISH_TIMEOUT * 1000:g}ms."
+        )
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from search.engine import update_search_index
+
+
+class Command(BaseCommand):
+    """
+    Update the search index like the hourly job, or rebuild it with
+    `--full`, e.g. to index it for the first time
+    """
+
+    help = "Update the search index"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--full", action="store_true")
+
+    def handle(self, *args, **options):
+        stats = update_search_index(full=options["full"])
+        self.stdout.write(
+            f"{stats['documents']} documents indexed, "
+            f"{stats['segments']} segments."
+        )
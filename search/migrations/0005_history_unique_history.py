@@ -0,0 +1,35 @@
+from django.db import migrations, models
+
+
+MERGE_DUPLICATED_HISTORIES = """
+UPDATE search_history
+SET count = duplicates.count, modified = duplicates.modified
+FROM (
+    SELECT MIN(id) AS id, SUM(count) AS count, MAX(modified) AS modified
+    FROM search_history
+    GROUP BY user_id, url
+    HAVING COUNT(*) > 1
+) AS duplicates
+WHERE search_history.id = duplicates.id;
+
+DELETE FROM search_history
+USING search_history AS kept
+WHERE search_history.user_id = kept.user_id
+    AND search_history.url = kept.url
+    AND search_history.id > kept.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0004_auto_20210827_0827'),
+    ]
+
+    operations = [
+        migrations.RunSQL(MERGE_DUPLICATED_HISTORIES, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='history',
+            constraint=models.UniqueConstraint(fields=('user_id', 'url'), name='unique_history'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0005_history_unique_history'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='history',
+            name='url_hash',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='result',
+            name='url_hash',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='search',
+            name='search_terms_hash',
+            field=models.BigIntegerField(editable=False, null=True),
+        ),
+    ]
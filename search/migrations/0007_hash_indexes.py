@@ -0,0 +1,75 @@
+import hashlib
+
+from django.db import migrations, models
+
+
+def get_hash(value):
+    # Same as search.models.get_hash when the migration was written
+    digest = hashlib.blake2b(value.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
+def fill_hashes(apps, schema_editor):
+    for model_name, field, hash_field in (
+        ("Result", "url", "url_hash"),
+        ("History", "url", "url_hash"),
+        ("Search", "search_terms", "search_terms_hash"),
+    ):
+        model = apps.get_model("search", model_name)
+        while True:
+            rows = list(
+                model.objects.filter(**{f"{hash_field}__isnull": True})
+                .order_by("pk")
+                .values_list("pk", field)[:1000]
+            )
+            if not rows:
+                break
+            objects = []
+            for row_id, value in rows:
+                obj = model(pk=row_id)
+                setattr(obj, hash_field, get_hash(value))
+                objects.append(obj)
+            model.objects.bulk_update(objects, [hash_field])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0006_hash_fields'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_hashes, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='history',
+            name='url_hash',
+            field=models.BigIntegerField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='result',
+            name='url_hash',
+            field=models.BigIntegerField(editable=False, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='search',
+            name='search_terms_hash',
+            field=models.BigIntegerField(editable=False),
+        ),
+        migrations.AlterField(
+            model_name='result',
+            name='url',
+            field=models.URLField(max_length=2048),
+        ),
+        migrations.RemoveConstraint(
+            model_name='history',
+            name='unique_history',
+        ),
+        migrations.AddConstraint(
+            model_name='history',
+            constraint=models.UniqueConstraint(fields=('user_id', 'url_hash'), name='unique_history_url'),
+        ),
+        migrations.AddIndex(
+            model_name='search',
+            index=models.Index(fields=['user_id', 'search_terms_hash'], name='search_user_terms_idx'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:02
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0007_hash_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='history',
+            index=models.Index(fields=['user_id', 'created'], name='history_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='history',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['created'], name='history_created_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='search',
+            index=models.Index(fields=['user_id', 'created'], name='search_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='search',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['created'], name='search_created_brin'),
+        ),
+    ]
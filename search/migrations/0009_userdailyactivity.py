@@ -0,0 +1,69 @@
+# Generated by Django 3.1.14 on 2026-10-18 17:07
+
+from django.db import migrations, models
+
+
+# The past visits are only known by their first and last times
+BACKFILL_USER_DAILY_ACTIVITIES = """
+INSERT INTO search_userdailyactivity
+    (user_id, day, history_count, search_count, clicks, last_activity)
+SELECT user_id, day, SUM(histories), SUM(searches), SUM(clicks), MAX(time)
+FROM (
+    SELECT user_id, created AS time, 1 AS histories, 0 AS searches,
+        0 AS clicks, (created AT TIME ZONE 'UTC')::date AS day
+    FROM search_history
+    UNION ALL
+    SELECT user_id, modified, 1, 0, 0, (modified AT TIME ZONE 'UTC')::date
+    FROM search_history
+    WHERE (modified AT TIME ZONE 'UTC')::date
+        <> (created AT TIME ZONE 'UTC')::date
+    UNION ALL
+    SELECT user_id, created, 0, 1, 0, (created AT TIME ZONE 'UTC')::date
+    FROM search_search
+    UNION ALL
+    SELECT user_id, modified, 0, 1, 0, (modified AT TIME ZONE 'UTC')::date
+    FROM search_search
+    WHERE (modified AT TIME ZONE 'UTC')::date
+        <> (created AT TIME ZONE 'UTC')::date
+    UNION ALL
+    SELECT search.user_id, search_result.modified, 0, 0, search_result.count,
+        (search_result.modified AT TIME ZONE 'UTC')::date
+    FROM search_searchresult AS search_result
+    JOIN search_search AS search ON search.id = search_result.search_id
+    WHERE search_result.count > 0
+) AS activities
+WHERE user_id <> 0
+GROUP BY user_id, day;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0008_time_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserDailyActivity',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.IntegerField()),
+                ('day', models.DateField()),
+                ('history_count', models.IntegerField(default=0)),
+                ('search_count', models.IntegerField(default=0)),
+                ('clicks', models.IntegerField(default=0)),
+                ('last_activity', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name_plural': 'user daily activities',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='userdailyactivity',
+            constraint=models.UniqueConstraint(fields=('user_id', 'day'), name='unique_user_day'),
+        ),
+        migrations.RunSQL(
+            BACKFILL_USER_DAILY_ACTIVITIES, migrations.RunSQL.noop
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:19
+
+from django.db import migrations, models
+
+
+MERGE_DUPLICATED_SEARCH_RESULTS = """
+UPDATE search_searchresult
+SET count = duplicates.count, modified = duplicates.modified
+FROM (
+    SELECT MIN(id) AS id, SUM(count) AS count, MAX(modified) AS modified
+    FROM search_searchresult
+    GROUP BY search_id, result_id
+    HAVING COUNT(*) > 1
+) AS duplicates
+WHERE search_searchresult.id = duplicates.id;
+
+DELETE FROM search_searchresult
+USING search_searchresult AS kept
+WHERE search_searchresult.search_id = kept.search_id
+    AND search_searchresult.result_id = kept.result_id
+    AND search_searchresult.id > kept.id;
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0009_userdailyactivity'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            MERGE_DUPLICATED_SEARCH_RESULTS, migrations.RunSQL.noop
+        ),
+        migrations.AddConstraint(
+            model_name='searchresult',
+            constraint=models.UniqueConstraint(fields=('search', 'result'), name='unique_search_result'),
+        ),
+    ]
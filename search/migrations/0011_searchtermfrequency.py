@@ -0,0 +1,24 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0010_unique_search_result'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchTermFrequency',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('terms', models.CharField(max_length=100, unique=True)),
+                ('count', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'search term frequencies',
+            },
+        ),
+    ]
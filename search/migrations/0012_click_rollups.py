@@ -0,0 +1,89 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:42
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0011_searchtermfrequency'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClickRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('since', models.DateTimeField(blank=True, null=True)),
+                ('until', models.DateTimeField(unique=True)),
+                ('impressions', models.IntegerField(default=0)),
+                ('clicks', models.IntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-until'],
+            },
+        ),
+        migrations.CreateModel(
+            name='ResultClickDay',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('terms', models.CharField(max_length=100)),
+                ('domain', models.CharField(blank=True, max_length=255)),
+                ('day', models.DateField()),
+                ('impressions', models.IntegerField(default=0)),
+                ('clicks', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ResultClickHour',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('terms', models.CharField(max_length=100)),
+                ('domain', models.CharField(blank=True, max_length=255)),
+                ('hour', models.DateTimeField()),
+                ('impressions', models.IntegerField(default=0)),
+                ('clicks', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='searchresult',
+            name='rolled_up_clicks',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='searchresult',
+            index=django.contrib.postgres.indexes.BrinIndex(fields=['created'], name='searchresult_created_brin'),
+        ),
+        migrations.AddIndex(
+            model_name='searchresult',
+            index=models.Index(condition=models.Q(count__gt=0), fields=['modified'], name='searchresult_clicked_idx'),
+        ),
+        migrations.AddField(
+            model_name='resultclickhour',
+            name='result',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='search.result'),
+        ),
+        migrations.AddField(
+            model_name='resultclickday',
+            name='result',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='search.result'),
+        ),
+        migrations.AddIndex(
+            model_name='resultclickhour',
+            index=models.Index(fields=['hour'], name='resultclickhour_hour_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='resultclickhour',
+            constraint=models.UniqueConstraint(fields=('terms', 'result', 'hour'), name='unique_result_hour'),
+        ),
+        migrations.AddIndex(
+            model_name='resultclickday',
+            index=models.Index(fields=['day', 'domain'], name='resultclickday_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='resultclickday',
+            constraint=models.UniqueConstraint(fields=('terms', 'result', 'day'), name='unique_result_day'),
+        ),
+    ]
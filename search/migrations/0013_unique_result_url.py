@@ -0,0 +1,22 @@
+# Generated by Django 3.1.14 on 2026-10-18 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0012_click_rollups'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='result',
+            constraint=models.UniqueConstraint(fields=('url_hash', 'url'), name='unique_result_url'),
+        ),
+        migrations.AlterField(
+            model_name='result',
+            name='url_hash',
+            field=models.BigIntegerField(editable=False),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0013_unique_result_url'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='search',
+            name='count',
+            field=models.IntegerField(default=1, editable=False),
+        ),
+        # The existing searches were counted once by the term frequencies
+        migrations.AddField(
+            model_name='search',
+            name='counted',
+            field=models.IntegerField(default=1, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='search',
+            name='counted',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='search',
+            index=models.Index(fields=['modified'], name='search_modified_idx'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0014_search_count'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='searchresult',
+            name='searchresult_created_brin',
+        ),
+        migrations.RemoveIndex(
+            model_name='searchresult',
+            name='searchresult_clicked_idx',
+        ),
+        migrations.AddField(
+            model_name='searchresult',
+            name='impressions',
+            field=models.IntegerField(default=1, editable=False),
+        ),
+        migrations.AddField(
+            model_name='searchresult',
+            name='rolled_up_impressions',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='searchresult',
+            index=models.Index(fields=['modified'], name='searchresult_modified_idx'),
+        ),
+        # The existing results were counted once by the rollups which
+        # ended after they were shown
+        migrations.RunSQL(
+            """
+            UPDATE search_searchresult SET rolled_up_impressions = 1
+            WHERE created < (SELECT MAX(until) FROM search_clickrollup)
+            """,
+            migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 3.1.14 on 2026-10-18 19:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0015_searchresult_impressions'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='history',
+            constraint=models.UniqueConstraint(fields=('user_id', 'url_hash', 'url'), name='unique_user_history_url'),
+        ),
+        migrations.RemoveConstraint(
+            model_name='history',
+            name='unique_history_url',
+        ),
+    ]
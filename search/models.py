@@ -1,19 +1,45 @@
+import hashlib
+
 from django_extensions.db.models import TimeStampedModel
 
+from django.contrib.postgres.indexes import BrinIndex
 from django.db import models
 
 
+def get_hash(value: str) -> int:
+    """
+    Fixed-width (64-bit) hash used to index long urls and search terms
+    """
+    digest = hashlib.blake2b(value.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big", signed=True)
+
+
 class Result(models.Model):
-    url = models.URLField(max_length=2048, unique=True)
+    url = models.URLField(max_length=2048)
+    url_hash = models.BigIntegerField(editable=False)
 
     class Meta:
         ordering = ["pk"]
+        # Urls whose hashes collide are different results
+        constraints = [
+            models.UniqueConstraint(
+                fields=["url_hash", "url"], name="unique_result_url"
+            )
+        ]
 
     def __str__(self) -> str:
         return self.url
 
+    def save(self, *args, **kwargs):
+        self.url_hash = get_hash(self.url)
+        super().save(*args, **kwargs)
+
 
 class Search(TimeStampedModel):
+    """
+    Search terms entered by a user, with the results shown to them
+    """
+
     GOOGLE = 0
     GUPPY = 1
     SEARCH_TYPES = ((GOOGLE, "Google"), (GUPPY, "Guppy"))
@@ -27,12 +53,49 @@ class Search(TimeStampedModel):
         related_name="search",
     )
     user_id = models.IntegerField(blank=True, default=0)
+    search_terms_hash = models.BigIntegerField(editable=False)
+    # Times the user made the search
+    count = models.IntegerField(default=1, editable=False)
+    # Searches added to the search term frequencies
+    counted = models.IntegerField(default=0, editable=False)
+
+    class Meta(TimeStampedModel.Meta):
+        indexes = [
+            models.Index(
+                fields=["user_id", "search_terms_hash"],
+                name="search_user_terms_idx",
+            ),
+            models.Index(
+                fields=["user_id", "created"], name="search_user_created_idx"
+            ),
+            BrinIndex(fields=["created"], name="search_created_brin"),
+            models.Index(fields=["modified"], name="search_modified_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.search_terms_hash = get_hash(self.search_terms)
+        super().save(*args, **kwargs)
 
 
 class SearchResult(TimeStampedModel):
     search = models.ForeignKey(Search, on_delete=models.CASCADE)
     result = models.ForeignKey(Result, on_delete=models.CASCADE)
     count = models.IntegerField(default=0)
+    # Times the result was shown by the search
+    impressions = models.IntegerField(default=1, editable=False)
+    # Impressions and clicks added to the click rollups
+    rolled_up_impressions = models.IntegerField(default=0, editable=False)
+    rolled_up_clicks = models.IntegerField(default=0, editable=False)
+
+    class Meta(TimeStampedModel.Meta):
+        constraints = [
+            models.UniqueConstraint(
+                fields=["search", "result"], name="unique_search_result"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["modified"], name="searchresult_modified_idx"),
+        ]
 
     def __str__(self) -> str:
         return str(self.count)
@@ -44,3 +107,136 @@ class History(TimeStampedModel):
     last_origin = models.URLField(max_length=2048, blank=True)
     user_id = models.IntegerField(blank=True, default=0)
     count = models.IntegerField(default=1)
+    url_hash = models.BigIntegerField(editable=False)
+
+    class Meta(TimeStampedModel.Meta):
+        # Urls whose hashes collide are different histories
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user_id", "url_hash", "url"],
+                name="unique_user_history_url",
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["user_id", "created"], name="history_user_created_idx"
+            ),
+            BrinIndex(fields=["created"], name="history_created_brin"),
+        ]
+
+    def save(self, *args, **kwargs):
+        self.url_hash = get_hash(self.url)
+        super().save(*args, **kwargs)
+
+
+class SearchTermFrequency(models.Model):
+    """
+    Number of searches of normalized search terms, by all users
+    """
+
+    terms = models.CharField(max_length=100, unique=True)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "search term frequencies"
+
+    def __str__(self) -> str:
+        return self.terms
+
+
+class ClickRollup(models.Model):
+    """
+    Run of the click rollups, which counted the results shown before
+    `until` and the clicks made since the previous run
+    """
+
+    since = models.DateTimeField(null=True, blank=True)
+    until = models.DateTimeField(unique=True)
+    impressions = models.IntegerField(default=0)
+    clicks = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ["-until"]
+
+    def __str__(self) -> str:
+        return str(self.until)
+
+
+class ResultClickHour(models.Model):
+    """
+    Number of times a result was shown, and clicked, for normalized search
+    terms per (UTC) hour
+    """
+
+    terms = models.CharField(max_length=100)
+    result = models.ForeignKey(Result, on_delete=models.CASCADE)
+    domain = models.CharField(max_length=255, blank=True)
+    hour = models.DateTimeField()
+    impressions = models.IntegerField(default=0)
+    clicks = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["terms", "result", "hour"], name="unique_result_hour"
+            )
+        ]
+        indexes = [
+            models.Index(fields=["hour"], name="resultclickhour_hour_idx")
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.terms} {self.hour}"
+
+
+class ResultClickDay(models.Model):
+    """
+    Number of times a result was shown, and clicked, for normalized search
+    terms per (UTC) day
+    """
+
+    terms = models.CharField(max_length=100)
+    result = models.ForeignKey(Result, on_delete=models.CASCADE)
+    domain = models.CharField(max_length=255, blank=True)
+    day = models.DateField()
+    impressions = models.IntegerField(default=0)
+    clicks = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["terms", "result", "day"], name="unique_result_day"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["day", "domain"], name="resultclickday_day_idx"
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.terms} {self.day}"
+
+
+class UserDailyActivity(models.Model):
+    """
+    Number of visits, searches and clicks of a user per (UTC) day
+    """
+
+    user_id = models.IntegerField()
+    day = models.DateField()
+    history_count = models.IntegerField(default=0)
+    search_count = models.IntegerField(default=0)
+    clicks = models.IntegerField(default=0)
+    last_activity = models.DateTimeField()
+
+    class Meta:
+        verbose_name_plural = "user daily activities"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user_id", "day"], name="unique_user_day"
+            )
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.user_id} {self.day}"
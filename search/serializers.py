@@ -1,5 +1,7 @@
 from rest_framework import serializers
 
+from django.conf import settings
+
 from .models import History, Search
 
 
@@ -23,3 +25,39 @@ class HistorySerialzer(serializers.ModelSerializer):
         model = History
         depth = 1
         fields = "__all__"
+
+
+class SearchBatchItemSerializer(
+    serializers.Serializer
+):  # pylint: disable=abstract-method
+    """
+    A single search (and its results) posted to the batch endpoint
+    """
+
+    search_type = serializers.ChoiceField(
+        choices=Search.SEARCH_TYPES, required=True
+    )
+    search_terms = serializers.CharField(required=True)
+    search_results = serializers.ListField(
+        child=serializers.URLField(max_length=2048),
+        required=False,
+        default=list,
+    )
+
+
+class SearchBatchSerializer(
+    serializers.Serializer
+):  # pylint: disable=abstract-method
+    """
+    The payload of the batch endpoint
+    """
+
+    searches = SearchBatchItemSerializer(many=True, allow_empty=False)
+
+    def validate_searches(self, value):  # pylint: disable=no-self-use
+        if len(value) > settings.SEARCH_BATCH_MAX_SIZE:
+            raise serializers.ValidationError(
+                "Ensure this field has no more than "
+                f"{settings.SEARCH_BATCH_MAX_SIZE} elements."
+            )
+        return value
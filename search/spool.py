@@ -0,0 +1,199 @@
+import fcntl
+import glob
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .utils import (
+    record_activities,
+    update_last_posting_times,
+    upsert_histories,
+)
+
+LOGGER = logging.getLogger(__name__)
+STATS_CACHE_KEY = "history_spool_stats"
+
+
+class HistorySpool:
+    """
+    Append-only spool of page visits waiting to be written to the database.
+
+    Web workers append one JSON line per visit to the spool file, and the
+    flusher periodically rotates the file and applies all visits of a
+    (user_id, url) pair with a single `count + n` update.
+    """
+
+    FILE_NAME = "history.spool"
+    LOCK_NAME = "history.lock"
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory or settings.HISTORY_SPOOL_DIR
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, self.FILE_NAME)
+
+    def append(self, visit: Dict[str, Any]) -> None:
+        """
+        Add a visit to the spool
+        """
+        visit.setdefault("visited", timezone.now())
+        line = (json.dumps(visit, cls=DjangoJSONEncoder) + "\n").encode()
+        os.makedirs(self.directory, exist_ok=True)
+        while True:
+            file_descriptor = os.open(
+                self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+            )
+            try:
+                fcntl.flock(file_descriptor, fcntl.LOCK_SH)
+                # Retry if the flusher rotated the file before we got the lock
+                if self._is_current(file_descriptor):
+                    os.write(file_descriptor, line)
+                    return
+            finally:
+                os.close(file_descriptor)
+
+    def _is_current(self, file_descriptor: int) -> bool:
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return False
+        return inode == os.fstat(file_descriptor).st_ino
+
+    def _rotated_paths(self) -> List[str]:
+        return sorted(glob.glob(os.path.join(self.directory, "*.flushing")))
+
+    def depth(self) -> int:
+        """
+        Number of visits waiting to be flushed
+        """
+        depth = 0
+        for path in [self.path] + self._rotated_paths():
+            try:
+                with open(path, "rb") as spool_file:
+                    depth += sum(1 for _ in spool_file)
+            except FileNotFoundError:
+                continue
+        return depth
+
+    def flush(self) -> Dict[str, Any]:
+        """
+        Write all spooled visits to the database
+        """
+        started = time.monotonic()
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, self.LOCK_NAME), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                LOGGER.info("History spool is being flushed by another job.")
+                return self.stats()
+
+            try:
+                os.rename(
+                    self.path,
+                    os.path.join(self.directory, f"{time.time_ns()}.flushing"),
+                )
+            except FileNotFoundError:
+                pass
+
+            visits = 0
+            oldest = None  # type: Optional[datetime]
+            # Older files are left over by interrupted flushes
+            for path in self._rotated_paths():
+                with open(path, "rb") as spool_file:
+                    # Wait for the writers which opened the file before the
+                    # rotation
+                    fcntl.flock(spool_file, fcntl.LOCK_EX)
+                    lines = spool_file.readlines()
+                coalesced = coalesce_visits(
+                    json.loads(line) for line in lines if line.strip()
+                )
+                apply_visits(coalesced)
+                os.remove(path)
+                visits += len(lines)
+                for visit in coalesced.values():
+                    if oldest is None or visit["first_visited"] < oldest:
+                        oldest = visit["first_visited"]
+
+        stats = {
+            "last_flush_at": timezone.now(),
+            "last_flush_visits": visits,
+            "last_flush_duration": time.monotonic() - started,
+            # Time between the oldest flushed visit and its write
+            "last_flush_latency": (
+                (timezone.now() - oldest).total_seconds() if oldest else 0.0
+            ),
+        }
+        cache.set(STATS_CACHE_KEY, stats, None)
+        return self.stats()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Spool depth and the metrics of the last flush
+        """
+        stats = {
+            "last_flush_at": None,
+            "last_flush_visits": 0,
+            "last_flush_duration": 0.0,
+            "last_flush_latency": 0.0,
+        }
+        stats.update(cache.get(STATS_CACHE_KEY) or {})
+        stats["depth"] = self.depth()
+        return stats
+
+
+def coalesce_visits(visits) -> Dict[Tuple[int, str], Dict[str, Any]]:
+    """
+    Merge the visits of the same (user_id, url) pair
+    """
+    coalesced = {}  # type: Dict[Tuple[int, str], Dict[str, Any]]
+    for visit in visits:
+        visited = parse_datetime(visit["visited"])
+        item = coalesced.setdefault(
+            (visit["user_id"], visit["url"]),
+            {
+                "count": 0,
+                "title": "",
+                "last_origin": "",
+                "first_visited": visited,
+                "visited": visited,
+            },
+        )
+        item["count"] += 1
+        item["visited"] = max(item["visited"], visited)
+        item["first_visited"] = min(item["first_visited"], visited)
+        for field in ("title", "last_origin"):
+            if visit.get(field):
+                item[field] = visit[field]
+    return coalesced
+
+
+def apply_visits(coalesced: Dict[Tuple[int, str], Dict[str, Any]]) -> None:
+    """
+    Add the coalesced visits to the History counts
+    """
+    with transaction.atomic():
+        histories = upsert_histories(
+            {"user_id": user_id, "url": url, **visit}
+            for (user_id, url), visit in coalesced.items()
+        )
+        update_last_posting_times(histories)
+        record_activities(
+            {
+                "user_id": user_id,
+                "time": visit["visited"],
+                "histories": visit["count"],
+            }
+            for (user_id, _), visit in coalesced.items()
+        )
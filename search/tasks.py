@@ -0,0 +1,13 @@
+from typing import Any, Dict
+
+from guppy.celery import APP
+
+from .utils import click_url
+
+
+@APP.task
+def save_click(data: Dict[str, Any]) -> None:
+    """
+    Count a click tracked by `search_tracking` after its redirect
+    """
+    click_url(data)
@@ -1,12 +1,66 @@
 # pylint: disable=missing-docstring
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+from datetime import date, datetime, timedelta
+
+import mock
+from freezegun import freeze_time
+from kombu.exceptions import OperationalError
 from rest_framework.test import APITestCase
 
-from django.test import TestCase
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.urls import reverse
+from django.utils import timezone
 
 from accounts.factories import UserProfileFactory
+from accounts.utils import setup_tests_admin
 
-from .models import History, Result, Search, SearchResult
+from .analytics import (
+    get_domain_ctrs,
+    get_top_results,
+    get_trending_queries,
+    rollup_clicks,
+)
+from .autocomplete import (
+    Suggestions,
+    get_suggestions,
+    update_suggestions,
+    write_suggestions,
+)
+from .clicks import ClickRecorder
+from .engine import (
+    Segment,
+    get_search_index,
+    read_manifest,
+    update_search_index,
+)
+from .jobs.daily.purge_search_data import Job as PurgeSearchDataJob
+from .jobs.minutely.flush_history_spool import Job as FlushHistorySpoolJob
+from .models import (
+    ClickRollup,
+    History,
+    Result,
+    ResultClickDay,
+    ResultClickHour,
+    Search,
+    SearchResult,
+    SearchTermFrequency,
+    UserDailyActivity,
+    get_hash,
+)
+from .spool import HistorySpool
+from .utils import (
+    click_url,
+    record_activities,
+    save_searches,
+    upsert_histories,
+    upsert_history,
+)
 
 
 class SearchTests(TestCase):
@@ -176,6 +230,142 @@ class APISearchTests(APITestCase):
         self.assertEqual(Result.objects.count(), 0)
 
 
+class APISearchBatchTests(APITestCase):
+    url = reverse("search:api_search_batch")
+
+    def test_search_batch_invalid(self):
+        response = self.client.post(self.url, {"searches": []}, format="json")
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            self.url, {"searches": [{"search_type": 0}]}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            self.url,
+            {
+                "searches": [
+                    {
+                        "search_type": 0,
+                        "search_terms": "Test text",
+                        "search_results": ["not an url"],
+                    }
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Search.objects.count(), 0)
+
+    def test_search_batch_create(self):
+        response = self.client.post(
+            self.url,
+            {
+                "searches": [
+                    {
+                        "search_type": 0,
+                        "search_terms": "Test text",
+                        "search_results": [
+                            "https://example.com/1",
+                            "https://example.com/2",
+                        ],
+                    },
+                    {
+                        "search_type": 1,
+                        "search_terms": "Test text",
+                        "search_results": ["https://example.com/2"],
+                    },
+                    {"search_type": 0, "search_terms": "Test text 2"},
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data["searches"]), 3)
+        self.assertEqual(Search.objects.count(), 3)
+        self.assertEqual(Result.objects.count(), 2)
+        self.assertEqual(SearchResult.objects.count(), 3)
+        search = Search.objects.get(search_type=0, search_terms="Test text")
+        self.assertEqual(search.user_id, 0)
+        self.assertEqual(search.results.count(), 2)
+
+        # Posting the same searches again only adds the new results
+        response = self.client.post(
+            self.url,
+            {
+                "searches": [
+                    {
+                        "search_type": 0,
+                        "search_terms": "Test text",
+                        "search_results": [
+                            "https://example.com/2",
+                            "https://example.com/3",
+                        ],
+                    },
+                    {
+                        "search_type": 0,
+                        "search_terms": "Test text",
+                        "search_results": ["https://example.com/3"],
+                    },
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            response.data["searches"][0]["id"],
+            response.data["searches"][1]["id"],
+        )
+        self.assertEqual(response.data["searches"][0]["id"], search.pk)
+        self.assertEqual(Search.objects.count(), 3)
+        self.assertEqual(Result.objects.count(), 3)
+        self.assertEqual(search.results.count(), 3)
+        self.assertEqual(SearchResult.objects.count(), 4)
+
+    def test_search_batch_number_of_queries(self):
+        def searches(size, prefix):
+            return [
+                {
+                    "search_type": 0,
+                    "search_terms": f"{prefix} {i}",
+                    "search_results": [
+                        f"https://example.com/{prefix}/{i}/1",
+                        f"https://example.com/{prefix}/{i}/2",
+                    ],
+                }
+                for i in range(size)
+            ]
+
+        self.client.post(
+            self.url, {"searches": searches(2, "warmup")}, format="json"
+        )
+        with self.assertNumQueries(8):
+            self.client.post(
+                self.url, {"searches": searches(5, "small")}, format="json"
+            )
+        with self.assertNumQueries(8):
+            self.client.post(
+                self.url, {"searches": searches(100, "large")}, format="json"
+            )
+        self.assertEqual(SearchResult.objects.count(), 214)
+
+    def test_search_batch_with_logged_in_user(self):
+        user = UserProfileFactory(email="test@example.com", password="test")
+        self.client.post(
+            reverse("api_login"),
+            {"username": "test@example.com", "password": "test"},
+        )
+        response = self.client.post(
+            self.url,
+            {"searches": [{"search_type": 0, "search_terms": "Test text"}]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        search = Search.objects.get()
+        self.assertEqual(search.user_id, user.pk)
+        user.refresh_from_db()
+        self.assertEqual(user.last_posting_time, search.modified)
+
+
 class APIHistoriesTests(APITestCase):
     def test_history_create_invalid(self):
         url = reverse("search:api_histories")
@@ -314,3 +504,988 @@ class APIHistoriesTests(APITestCase):
         history = History.objects.last()
         user.refresh_from_db()
         self.assertEqual(user.last_posting_time, history.modified)
+
+
+class HashTests(TestCase):
+    def test_get_hash(self):
+        url = "https://example.com/" + "a" * 2000
+        self.assertEqual(get_hash(url), get_hash(url))
+        self.assertNotEqual(get_hash(url), get_hash(url + "b"))
+        self.assertTrue(-(2**63) <= get_hash(url) < 2**63)
+
+    def test_hash_saved_with_models(self):
+        result = Result.objects.create(url="https://example.com")
+        self.assertEqual(result.url_hash, get_hash("https://example.com"))
+        search = Search.objects.create(search_terms="Test text")
+        self.assertEqual(search.search_terms_hash, get_hash("Test text"))
+        search.search_terms = "Test text 2"
+        search.save()
+        search.refresh_from_db()
+        self.assertEqual(search.search_terms_hash, get_hash("Test text 2"))
+        history = upsert_history(0, "https://example.com")
+        self.assertEqual(history.url_hash, get_hash("https://example.com"))
+
+    def test_colliding_url_hashes(self):
+        urls = ["https://example.com/a", "https://example.com/b"]
+        with mock.patch("search.models.get_hash", return_value=1), mock.patch(
+            "search.utils.get_hash", return_value=1
+        ):
+            save_searches(
+                [
+                    {
+                        "search_type": Search.GOOGLE,
+                        "search_terms": "test",
+                        "search_results": urls,
+                    }
+                ],
+                1,
+            )
+            click_url({"url": urls[1], "search_term": "test", "user_id": 1})
+        self.assertEqual(
+            list(
+                SearchResult.objects.order_by("result__url").values_list(
+                    "result__url", "count"
+                )
+            ),
+            [(urls[0], 0), (urls[1], 1)],
+        )
+
+    def test_colliding_history_url_hashes(self):
+        urls = ["https://example.com/a", "https://example.com/b"]
+        with mock.patch("search.utils.get_hash", return_value=1):
+            upsert_history(1, urls[0], "A")
+            upsert_history(1, urls[1], "B")
+            upsert_history(1, urls[1])
+        self.assertEqual(
+            list(
+                History.objects.order_by("url").values_list(
+                    "url", "title", "count"
+                )
+            ),
+            [(urls[0], "A", 1), (urls[1], "B", 2)],
+        )
+
+
+class HistoryUpsertTests(TestCase):
+    def test_upsert_history(self):
+        history = upsert_history(0, "https://example.com", "Title")
+        self.assertEqual(history.count, 1)
+        self.assertEqual(history.title, "Title")
+        with self.assertNumQueries(1):
+            history_2 = upsert_history(
+                0, "https://example.com", "", "https://google.com"
+            )
+        self.assertEqual(history_2.pk, history.pk)
+        self.assertEqual(history_2.count, 2)
+        history.refresh_from_db()
+        self.assertEqual(history.count, 2)
+        self.assertEqual(history.title, "Title")
+        self.assertEqual(history.last_origin, "https://google.com")
+        self.assertTrue(history.modified >= history.created)
+
+    def test_upsert_histories(self):
+        upsert_history(1, "https://example.com/1")
+        with self.assertNumQueries(1):
+            histories = upsert_histories(
+                [
+                    {"user_id": 1, "url": "https://example.com/1"},
+                    {"user_id": 1, "url": "https://example.com/2"},
+                    {"user_id": 1, "url": "https://example.com/1", "count": 3},
+                    {"user_id": 2, "url": "https://example.com/1"},
+                ]
+            )
+        self.assertEqual(len(histories), 3)
+        self.assertEqual(History.objects.count(), 3)
+        self.assertEqual(
+            History.objects.get(user_id=1, url="https://example.com/1").count,
+            5,
+        )
+        self.assertEqual(
+            History.objects.get(user_id=2, url="https://example.com/1").count,
+            1,
+        )
+        self.assertEqual(upsert_histories([]), [])
+
+
+class ClickUrlTests(TestCase):
+    def setUp(self):
+        self.search = Search.objects.create(search_terms="Test text", user_id=1)
+        self.result = Result.objects.create(url="https://example.com/1")
+        self.search.results.add(self.result)
+
+    def click(self, url, search_term="Test text", user_id=1):
+        with self.assertNumQueries(1):
+            return click_url(
+                {"url": url, "search_term": search_term, "user_id": user_id}
+            )
+
+    def test_click_shown_result(self):
+        self.assertTrue(self.click("https://example.com/1"))
+        self.assertTrue(self.click("https://example.com/1"))
+        search_result = SearchResult.objects.get()
+        self.assertEqual(search_result.count, 2)
+        activity = UserDailyActivity.objects.get()
+        self.assertEqual((activity.user_id, activity.clicks), (1, 2))
+
+    def test_click_new_result(self):
+        self.assertTrue(self.click("https://example.com/2"))
+        search_result = SearchResult.objects.get(
+            result__url="https://example.com/2"
+        )
+        self.assertEqual(search_result.search, self.search)
+        self.assertEqual(search_result.count, 1)
+        # Clicked in another search of the user
+        search = Search.objects.create(search_terms="Other", user_id=1)
+        self.assertTrue(self.click("https://example.com/2", "Other"))
+        self.assertEqual(
+            Result.objects.filter(url="https://example.com/2").count(), 1
+        )
+        self.assertEqual(
+            SearchResult.objects.get(
+                search=search, result__url__endswith="2"
+            ).count,
+            1,
+        )
+
+    def test_click_unknown_search(self):
+        self.assertFalse(self.click("https://example.com/2", "Other"))
+        self.assertFalse(self.click("https://example.com/1", user_id=2))
+        self.assertFalse(
+            Result.objects.filter(url="https://example.com/2").exists()
+        )
+        self.assertEqual(SearchResult.objects.get().count, 0)
+        self.assertFalse(UserDailyActivity.objects.exists())
+
+    def test_click_anonymous_search(self):
+        self.search.user_id = 0
+        self.search.save()
+        self.assertTrue(self.click("https://example.com/1", user_id=0))
+        self.assertEqual(SearchResult.objects.get().count, 1)
+        self.assertFalse(UserDailyActivity.objects.exists())
+
+    def test_click_last_search(self):
+        # Saved twice before the searches were merged
+        search = Search.objects.create(search_terms="Test text", user_id=1)
+        search.results.add(self.result)
+        self.assertTrue(self.click("https://example.com/1"))
+        self.assertEqual(
+            SearchResult.objects.get(search=search).count,
+            1,
+        )
+        self.assertEqual(
+            SearchResult.objects.get(search=self.search).count,
+            0,
+        )
+
+
+class ClickRecorderTests(TransactionTestCase):
+    def setUp(self):
+        search = Search.objects.create(search_terms="Test text")
+        search.results.add(Result.objects.create(url="https://example.com/1"))
+        self.recorder = ClickRecorder()
+        patcher = mock.patch("search.views.CLICK_RECORDER", self.recorder)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def track_click(self):
+        response = self.client.get(
+            reverse("search:search_tracking"),
+            {
+                "url": "'https://example.com/1'",
+                "search_term": "'Test text'",
+            },
+        )
+        self.assertRedirects(
+            response, "https://example.com/1", fetch_redirect_response=False
+        )
+
+    def test_sync(self):
+        self.track_click()
+        self.assertEqual(SearchResult.objects.get().count, 1)
+        self.assertEqual(self.recorder.stats()["saved"], 1)
+
+    @override_settings(SEARCH_CLICKS_ASYNC="thread")
+    def test_thread(self):
+        # The redirect does not wait for the database
+        with mock.patch("search.clicks.click_url") as slow_click_url:
+            saving = threading.Event()
+            slow_click_url.side_effect = lambda data: saving.wait(5)
+            self.track_click()
+            self.assertEqual(self.recorder.stats()["saved"], 0)
+            saving.set()
+            self.recorder.queue.join()
+        self.assertEqual(self.recorder.stats()["saved"], 1)
+
+        self.track_click()
+        self.recorder.queue.join()
+        self.assertEqual(SearchResult.objects.get().count, 1)
+        self.assertEqual(
+            self.recorder.stats(),
+            {
+                "queued": 2,
+                "saved": 2,
+                "dropped": 0,
+                "failed": 0,
+                "mode": "thread",
+                "depth": 0,
+            },
+        )
+
+    @override_settings(SEARCH_CLICKS_ASYNC="thread")
+    def test_thread_drops_clicks_when_full(self):
+        self.recorder = ClickRecorder(queue_size=1)
+        with mock.patch.object(self.recorder, "start"), mock.patch(
+            "search.views.CLICK_RECORDER", self.recorder
+        ):
+            self.track_click()
+            self.track_click()
+        stats = self.recorder.stats()
+        self.assertEqual((stats["queued"], stats["dropped"]), (1, 1))
+        self.assertEqual(stats["depth"], 1)
+
+    @override_settings(
+        CELERY_TASK_ALWAYS_EAGER=True, SEARCH_CLICKS_ASYNC="celery"
+    )
+    def test_celery(self):
+        self.track_click()
+        self.assertEqual(SearchResult.objects.get().count, 1)
+        self.assertEqual(self.recorder.stats()["queued"], 1)
+
+        with mock.patch(
+            "search.clicks.publish_once", side_effect=OperationalError
+        ) as publish_mock:
+            self.track_click()
+        self.assertEqual(self.recorder.stats()["dropped"], 1)
+        self.assertEqual(SearchResult.objects.get().count, 1)
+        # Waiting at most 0.5s for the broker
+        self.assertEqual(publish_mock.call_args[0][2], 0.5)
+
+        with mock.patch("search.clicks.publish_once", side_effect=TimeoutError):
+            self.track_click()
+        self.assertEqual(self.recorder.stats()["dropped"], 2)
+
+
+class HistorySpoolTests(APITestCase):
+    def setUp(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        settings_override = override_settings(
+            HISTORY_WRITE_BEHIND=True, HISTORY_SPOOL_DIR=spool_dir
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_history_write_behind(self):
+        url = reverse("search:api_histories")
+        data = {
+            "url": "https://example.com",
+            "title": "Title",
+            "last_origin": "https://google.com",
+        }
+        HistorySpool().flush()
+        for _ in range(3):
+            response = self.client.post(url, data)
+            self.assertEqual(response.status_code, 202)
+        self.client.post(url, {"url": "https://example.com/2"})
+        self.assertEqual(History.objects.count(), 0)
+        self.assertEqual(HistorySpool().stats()["depth"], 4)
+
+        FlushHistorySpoolJob().execute()
+        self.assertEqual(History.objects.count(), 2)
+        history = History.objects.get(url="https://example.com")
+        self.assertEqual(history.count, 3)
+        self.assertEqual(history.title, "Title")
+        stats = HistorySpool().stats()
+        self.assertEqual(stats["depth"], 0)
+        self.assertEqual(stats["last_flush_visits"], 4)
+
+        user = UserProfileFactory(email="test@example.com", password="test")
+        self.client.post(
+            reverse("api_login"),
+            {"username": "test@example.com", "password": "test"},
+        )
+        self.client.post(url, data)
+        self.client.post(url, {"url": "https://example.com"})
+        with self.assertNumQueries(5):
+            FlushHistorySpoolJob().execute()
+        history.refresh_from_db()
+        self.assertEqual(history.count, 3)
+        user_history = History.objects.get(user_id=user.pk)
+        self.assertEqual(user_history.count, 2)
+        self.assertEqual(user_history.title, "Title")
+        user.refresh_from_db()
+        self.assertIsNotNone(user.last_posting_time)
+        activity = UserDailyActivity.objects.get(user_id=user.pk)
+        self.assertEqual(activity.history_count, 2)
+
+    def test_history_spool_stats(self):
+        url = reverse("search:api_history_spool_stats")
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 403)
+
+        HistorySpool().append({"user_id": 0, "url": "https://example.com"})
+        setup_tests_admin(self.client)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["depth"], 1)
+
+
+class SearchDataRetentionTests(TestCase):
+    def test_purge_search_data(self):
+        old_date = timezone.now() - timedelta(days=31)
+        old_history = upsert_history(0, "https://example.com/old")
+        upsert_history(0, "https://example.com/new")
+        # Created long ago but visited again recently
+        visited_history = upsert_history(0, "https://example.com/visited")
+        old_search = Search.objects.create(search_terms="Old")
+        Search.objects.create(search_terms="New")
+        History.objects.filter(pk=old_history.pk).update(
+            created=old_date, modified=old_date
+        )
+        History.objects.filter(pk=visited_history.pk).update(created=old_date)
+        Search.objects.filter(pk=old_search.pk).update(
+            created=old_date, modified=old_date
+        )
+
+        PurgeSearchDataJob().execute()
+        self.assertEqual(History.objects.count(), 3)
+
+        with override_settings(SEARCH_DATA_RETENTION_DAYS=30):
+            PurgeSearchDataJob().execute()
+        self.assertFalse(History.objects.filter(pk=old_history.pk).exists())
+        self.assertEqual(History.objects.count(), 2)
+        self.assertFalse(Search.objects.filter(pk=old_search.pk).exists())
+        self.assertEqual(Search.objects.count(), 1)
+
+
+class UserDailyActivityTests(APITestCase):
+    def test_record_activities(self):
+        now = timezone.now()
+        yesterday = now - timedelta(days=1)
+        record_activities(
+            [
+                {"user_id": 0, "time": now, "histories": 1},
+                {"user_id": 1, "time": yesterday, "histories": 1},
+                {"user_id": 1, "time": now, "histories": 2},
+                {"user_id": 1, "time": now, "searches": 1, "clicks": 3},
+            ]
+        )
+        self.assertFalse(UserDailyActivity.objects.filter(user_id=0).exists())
+        self.assertEqual(UserDailyActivity.objects.count(), 2)
+        activity = UserDailyActivity.objects.get(user_id=1, day=now.date())
+        self.assertEqual(activity.history_count, 2)
+        self.assertEqual(activity.search_count, 1)
+        self.assertEqual(activity.clicks, 3)
+        self.assertEqual(activity.last_activity, now)
+
+        record_activities([{"user_id": 1, "time": yesterday, "searches": 1}])
+        activity = UserDailyActivity.objects.get(
+            user_id=1, day=yesterday.date()
+        )
+        self.assertEqual(activity.history_count, 1)
+        self.assertEqual(activity.search_count, 1)
+
+    def test_ingest_activities(self):
+        user = UserProfileFactory(email="test@example.com", password="test")
+        self.client.post(
+            reverse("api_login"),
+            {"username": "test@example.com", "password": "test"},
+        )
+        histories_url = reverse("search:api_histories")
+        for _ in range(2):
+            self.client.post(histories_url, {"url": "https://example.com"})
+        self.client.post(
+            reverse("search:api_search"),
+            {"search_type": 0, "search_terms": "Test text"},
+        )
+        self.client.post(
+            reverse("search:api_search_batch"),
+            {
+                "searches": [
+                    {"search_type": 0, "search_terms": "Test text"},
+                    {"search_type": 1, "search_terms": "Test text 2"},
+                ]
+            },
+            format="json",
+        )
+        self.client.post(
+            histories_url,
+            {"url": "https://example.com", "search_term": "Test text"},
+        )
+
+        activity = UserDailyActivity.objects.get(user_id=user.pk)
+        self.assertEqual(activity.day, timezone.now().date())
+        self.assertEqual(activity.history_count, 2)
+        self.assertEqual(activity.search_count, 3)
+        self.assertEqual(activity.clicks, 1)
+        user.refresh_from_db()
+        self.assertGreaterEqual(activity.last_activity, user.last_posting_time)
+
+
+def search_urls(query):
+    _, results = get_search_index().search(query)
+    return [result["url"] for result in results]
+
+
+def click_result(url, times=1):
+    for _ in range(times):
+        click_url({"url": url, "search_term": "python tutorial", "user_id": 1})
+
+
+class SearchEngineTests(APITestCase):
+    def setUp(self):
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        settings_override = override_settings(SEARCH_INDEX_DIR=index_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        save_searches(
+            [
+                {
+                    "search_type": Search.GOOGLE,
+                    "search_terms": "python tutorial",
+                    "search_results": [
+                        "https://docs.python.org/3/tutorial/",
+                        "https://realpython.com/python-first-steps/",
+                        "https://example.com/snakes",
+                    ],
+                }
+            ],
+            1,
+        )
+        upsert_history(1, "https://example.com/snakes", "Snake care guide")
+
+    def test_search(self):
+        update_search_index(full=True)
+        self.assertEqual(
+            search_urls("Python tutorial"),
+            [
+                "https://docs.python.org/3/tutorial/",
+                "https://realpython.com/python-first-steps/",
+                "https://example.com/snakes",
+            ],
+        )
+        self.assertEqual(
+            search_urls("snake care"), ["https://example.com/snakes"]
+        )
+        self.assertEqual(search_urls("care"), ["https://example.com/snakes"])
+        self.assertEqual(search_urls("unknown"), [])
+        self.assertEqual(search_urls(""), [])
+        _, results = get_search_index().search("care")
+        self.assertEqual(results[0]["title"], "Snake care guide")
+        self.assertEqual(
+            results[0]["id"],
+            Result.objects.get(url="https://example.com/snakes").pk,
+        )
+
+    def test_last_title(self):
+        with freeze_time(timezone.now() + timedelta(hours=1)):
+            upsert_history(2, "https://example.com/snakes", "About snakes")
+        upsert_history(3, "https://example.com/snakes", "")
+        update_search_index(full=True)
+        _, results = get_search_index().search("snakes")
+        self.assertEqual(results[0]["title"], "About snakes")
+        self.assertEqual(search_urls("care"), [])
+
+    def test_clicks_ranking(self):
+        update_search_index()
+        click_result("https://realpython.com/python-first-steps/", 5)
+        stats = update_search_index()
+        self.assertEqual((stats["documents"], stats["segments"]), (1, 2))
+        self.assertFalse(stats["merged"])
+        self.assertEqual(
+            search_urls("python tutorial"),
+            [
+                "https://realpython.com/python-first-steps/",
+                "https://docs.python.org/3/tutorial/",
+                "https://example.com/snakes",
+            ],
+        )
+        # The clicked result is replaced by the new segment
+        total, _ = get_search_index().search("python")
+        self.assertEqual(total, 3)
+
+    @override_settings(SEARCH_INDEX_MAX_SEGMENTS=2)
+    def test_incremental_update(self):
+        update_search_index()
+        stats = update_search_index()
+        self.assertEqual((stats["documents"], stats["segments"]), (0, 1))
+
+        save_searches(
+            [
+                {
+                    "search_type": Search.GOOGLE,
+                    "search_terms": "django",
+                    "search_results": ["https://djangoproject.com/"],
+                }
+            ],
+            1,
+        )
+        stats = update_search_index()
+        self.assertEqual((stats["documents"], stats["segments"]), (1, 2))
+        self.assertEqual(search_urls("django"), ["https://djangoproject.com/"])
+
+        # Merged when there are too many segments
+        click_result("https://example.com/snakes")
+        stats = update_search_index()
+        self.assertEqual((stats["documents"], stats["segments"]), (4, 1))
+        self.assertTrue(stats["merged"])
+        self.assertEqual(
+            len(os.listdir(settings.SEARCH_INDEX_DIR)),
+            # The segment, the 2 previous ones, the manifest and the lock
+            5,
+        )
+        self.assertEqual(search_urls("django"), ["https://djangoproject.com/"])
+
+    def test_update_keeps_previous_segments(self):
+        update_search_index()
+        # Read by a process before the update, opened after it
+        manifest = read_manifest(settings.SEARCH_INDEX_DIR)
+        update_search_index(full=True)
+        for name in manifest["segments"]:
+            Segment(os.path.join(settings.SEARCH_INDEX_DIR, name))
+
+        update_search_index(full=True)
+        for name in manifest["segments"]:
+            self.assertFalse(
+                os.path.exists(os.path.join(settings.SEARCH_INDEX_DIR, name))
+            )
+
+    def test_search_api(self):
+        url = reverse("search:api_search_results")
+        response = self.client.get(url, {"q": "python"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 0)
+
+        update_search_index()
+        with override_settings(
+            SEARCH_RESULTS_PAGE_SIZE=2
+        ), self.assertNumQueries(0):
+            response = self.client.get(url, {"q": "python", "page": 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 3)
+        self.assertEqual(response.data["page"], 2)
+        self.assertEqual(
+            [result["url"] for result in response.data["results"]],
+            ["https://example.com/snakes"],
+        )
+        response = self.client.get(url, {"q": "python", "page": "0"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_guppy_search(self):
+        update_search_index()
+        with self.assertNumQueries(0):
+            response = self.client.get(
+                reverse("search:guppy_search"), {"q": "care"}
+            )
+        self.assertContains(response, "Snake care guide")
+        self.assertContains(response, reverse("search:search_tracking"))
+        self.assertContains(response, reverse("search:guppy_search_shown"))
+        self.assertFalse(Search.objects.filter(search_type=Search.GUPPY))
+
+        url = reverse("search:guppy_search_shown")
+        self.assertEqual(self.client.get(url, {"q": "care"}).status_code, 405)
+        response = self.client.post(url, {"q": "care"})
+        self.assertEqual(response.status_code, 204)
+        search = Search.objects.get(search_type=Search.GUPPY)
+        self.assertEqual(search.search_terms, "care")
+        self.assertEqual(
+            [result.url for result in search.results.all()],
+            ["https://example.com/snakes"],
+        )
+
+
+def create_searches(terms, count):
+    Search.objects.bulk_create(
+        [
+            Search(
+                search_terms=terms, search_terms_hash=get_hash(terms), user_id=i
+            )
+            for i in range(count)
+        ]
+    )
+
+
+class AutocompleteTests(APITestCase):
+    def setUp(self):
+        autocomplete_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, autocomplete_dir)
+        settings_override = override_settings(AUTOCOMPLETE_DIR=autocomplete_dir)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        create_searches("python tutorial", 4)
+        create_searches(" Python  Tutorial", 1)
+        create_searches("python", 4)
+        create_searches("pycharm", 3)
+        # Not searched enough
+        create_searches("pyramid", 2)
+        create_searches("snake", 3)
+
+    def test_complete(self):
+        self.assertEqual(update_suggestions(), {"terms": 4})
+        suggestions = get_suggestions()
+        self.assertEqual(
+            suggestions.complete("Py"),
+            [
+                {"terms": "python tutorial", "count": 5},
+                {"terms": "python", "count": 4},
+                {"terms": "pycharm", "count": 3},
+            ],
+        )
+        self.assertEqual(
+            [item["terms"] for item in suggestions.complete("python ")],
+            ["python tutorial"],
+        )
+        self.assertEqual(
+            [item["terms"] for item in suggestions.complete("py", 2)],
+            ["python tutorial", "python"],
+        )
+        self.assertEqual(suggestions.complete("pyr"), [])
+        self.assertEqual(suggestions.complete(""), [])
+        self.assertEqual(suggestions.complete("zebra"), [])
+
+    def test_incremental_update(self):
+        update_suggestions()
+        update_suggestions()
+        self.assertEqual(
+            SearchTermFrequency.objects.get(terms="python tutorial").count, 5
+        )
+        create_searches("pyramid", 1)
+        update_suggestions()
+        self.assertEqual(
+            SearchTermFrequency.objects.get(terms="pyramid").count, 3
+        )
+        self.assertEqual(
+            [item["terms"] for item in get_suggestions().complete("pyr")],
+            ["pyramid"],
+        )
+        # Counted again from the searches
+        SearchTermFrequency.objects.update(count=0)
+        update_suggestions(full=True)
+        self.assertEqual(
+            SearchTermFrequency.objects.get(terms="python tutorial").count, 5
+        )
+        # The version, the previous one, the manifest and the lock
+        self.assertEqual(len(os.listdir(settings.AUTOCOMPLETE_DIR)), 4)
+
+    def test_repeated_searches(self):
+        update_suggestions()
+        # Searched again by the users who searched it
+        save_searches(
+            [{"search_type": Search.GOOGLE, "search_terms": "pyramid"}] * 2, 1
+        )
+        update_suggestions()
+        self.assertEqual(
+            SearchTermFrequency.objects.get(terms="pyramid").count, 4
+        )
+        response = self.client.post(
+            reverse("search:api_search"),
+            {"search_type": Search.GOOGLE, "search_terms": "pyramid"},
+        )
+        self.assertEqual(response.status_code, 201)
+        update_suggestions()
+        self.assertEqual(
+            SearchTermFrequency.objects.get(terms="pyramid").count, 5
+        )
+        self.assertEqual(
+            Search.objects.filter(search_terms="pyramid").count(), 2
+        )
+        update_suggestions(full=True)
+        self.assertEqual(
+            SearchTermFrequency.objects.get(terms="pyramid").count, 5
+        )
+
+    def test_update_keeps_previous_version(self):
+        update_suggestions()
+        # Read by a process before the update, opened after it
+        manifest_path = os.path.join(settings.AUTOCOMPLETE_DIR, "manifest.json")
+        with open(manifest_path) as file:
+            version = json.load(file)["version"]
+        update_suggestions()
+        self.assertTrue(
+            os.path.isfile(
+                os.path.join(settings.AUTOCOMPLETE_DIR, version, "terms.bin")
+            )
+        )
+        update_suggestions()
+        self.assertFalse(
+            os.path.exists(os.path.join(settings.AUTOCOMPLETE_DIR, version))
+        )
+
+    def test_complete_random_terms(self):
+        generator = random.Random(0)
+        frequencies = {
+            "".join(
+                generator.choices("abc é", k=generator.randint(1, 6))
+            ): generator.randint(1, 20)
+            for _ in range(300)
+        }
+        directory = os.path.join(settings.AUTOCOMPLETE_DIR, "random")
+        write_suggestions(os.path.join(directory, "1"), frequencies.items())
+        with open(os.path.join(directory, "manifest.json"), "w") as file:
+            json.dump({"version": "1", "updated_at": None}, file)
+        suggestions = Suggestions(directory)
+        for prefix in ["a", "ab", "é", "c a", "b", "cc"]:
+            expected = sorted(
+                (
+                    (-count, terms.encode())
+                    for terms, count in frequencies.items()
+                    if terms.startswith(prefix)
+                ),
+            )[:10]
+            self.assertEqual(
+                [
+                    (item["terms"], item["count"])
+                    for item in suggestions.complete(prefix)
+                ],
+                [(terms.decode(), -count) for count, terms in expected],
+            )
+
+    def test_autocomplete_api(self):
+        update_suggestions()
+        url = reverse("search:api_search_autocomplete")
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {"q": "pyt"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.data,
+            {
+                "q": "pyt",
+                "suggestions": [
+                    {"terms": "python tutorial", "count": 5},
+                    {"terms": "python", "count": 4},
+                ],
+            },
+        )
+
+
+def search_python_docs(user_id):
+    save_searches(
+        [
+            {
+                "search_type": Search.GUPPY,
+                "search_terms": " Python  docs"
+                if user_id % 2
+                else "python docs",
+                "search_results": [
+                    "https://docs.python.org/3/",
+                    "https://user@www.Python.org:443/doc/",
+                ],
+            }
+        ],
+        user_id,
+    )
+
+
+def click_python_docs(user_id, times=1):
+    search_terms = " Python  docs" if user_id % 2 else "python docs"
+    for _ in range(times):
+        click_url(
+            {
+                "url": "https://docs.python.org/3/",
+                "search_term": search_terms,
+                "user_id": user_id,
+            }
+        )
+
+
+class SearchAnalyticsTests(APITestCase):
+    def test_rollup_clicks(self):
+        with freeze_time("2021-02-01 10:30"):
+            search_python_docs(1)
+            search_python_docs(2)
+            click_python_docs(1)
+            click_python_docs(2)
+            # Searched again
+            search_python_docs(1)
+            click_python_docs(1)
+        with freeze_time("2021-02-01 10:40"):
+            self.assertEqual(rollup_clicks(), {"impressions": 6, "clicks": 3})
+            # Counted once
+            self.assertEqual(rollup_clicks(), {"impressions": 0, "clicks": 0})
+        self.assertEqual(
+            list(
+                ResultClickHour.objects.order_by("domain").values_list(
+                    "terms", "domain", "hour", "impressions", "clicks"
+                )
+            ),
+            [
+                (
+                    "python docs",
+                    "docs.python.org",
+                    datetime(2021, 2, 1, 10, tzinfo=timezone.utc),
+                    3,
+                    3,
+                ),
+                (
+                    "python docs",
+                    "python.org",
+                    datetime(2021, 2, 1, 10, tzinfo=timezone.utc),
+                    3,
+                    0,
+                ),
+            ],
+        )
+
+        with freeze_time("2021-02-01 23:40"):
+            search_python_docs(2)
+            click_python_docs(2)
+        with freeze_time("2021-02-01 23:47"):
+            # Shown after the end of the next rollup
+            search_python_docs(3)
+        with freeze_time("2021-02-01 23:50"):
+            self.assertEqual(rollup_clicks(), {"impressions": 2, "clicks": 1})
+        with freeze_time("2021-02-02 00:10"):
+            self.assertEqual(rollup_clicks(), {"impressions": 2, "clicks": 0})
+        self.assertEqual(
+            list(
+                ResultClickDay.objects.filter(domain="docs.python.org")
+                .order_by("day")
+                .values_list("day", "impressions", "clicks")
+            ),
+            [(date(2021, 2, 1), 5, 4)],
+        )
+        self.assertEqual(ClickRollup.objects.count(), 3)
+
+        with freeze_time("2021-03-05"):
+            rollup_clicks()
+        self.assertFalse(ResultClickHour.objects.exists())
+        self.assertEqual(ResultClickDay.objects.count(), 2)
+
+    def test_repeated_searches_ctr(self):
+        with freeze_time("2021-02-01 10:30"):
+            for _ in range(3):
+                search_python_docs(1)
+                click_python_docs(1)
+            # Clicked again from the same page
+            click_python_docs(1)
+        with freeze_time("2021-02-01 10:40"):
+            self.assertEqual(rollup_clicks(), {"impressions": 6, "clicks": 3})
+            self.assertEqual(
+                get_top_results("python docs")[0],
+                {
+                    "url": "https://docs.python.org/3/",
+                    "impressions": 3,
+                    "clicks": 3,
+                    "ctr": 1.0,
+                },
+            )
+        with freeze_time("2021-02-01 10:50"):
+            search_python_docs(1)
+        with freeze_time("2021-02-01 11:00"):
+            click_python_docs(1, 2)
+        with freeze_time("2021-02-01 11:10"):
+            self.assertEqual(rollup_clicks(), {"impressions": 2, "clicks": 1})
+            self.assertLessEqual(
+                max(row["ctr"] for row in get_domain_ctrs()), 1
+            )
+
+    @freeze_time("2021-02-10 12:00")
+    def test_reports(self):
+        for _ in range(3):
+            search_python_docs(1)
+            click_python_docs(1)
+        with freeze_time("2021-02-08 12:00"):
+            for _ in range(4):
+                save_searches(
+                    [
+                        {
+                            "search_type": Search.GUPPY,
+                            "search_terms": "snakes",
+                            "search_results": ["https://example.com/snakes"],
+                        }
+                    ],
+                    1,
+                )
+                click_url(
+                    {
+                        "url": "https://example.com/snakes",
+                        "search_term": "snakes",
+                        "user_id": 1,
+                    }
+                )
+        with freeze_time("2021-02-10 12:10"):
+            rollup_clicks()
+
+        self.assertEqual(
+            get_top_results("Python Docs"),
+            [
+                {
+                    "url": "https://docs.python.org/3/",
+                    "impressions": 3,
+                    "clicks": 3,
+                    "ctr": 1.0,
+                },
+                {
+                    "url": "https://user@www.Python.org:443/doc/",
+                    "impressions": 3,
+                    "clicks": 0,
+                    "ctr": 0.0,
+                },
+            ],
+        )
+        self.assertEqual(
+            [row["domain"] for row in get_domain_ctrs()],
+            ["example.com", "docs.python.org", "python.org"],
+        )
+        self.assertEqual(
+            [row["domain"] for row in get_domain_ctrs(days=1)],
+            ["docs.python.org", "python.org"],
+        )
+        self.assertEqual(
+            get_trending_queries(),
+            [
+                {
+                    "terms": "python docs",
+                    "clicks": 3,
+                    "baseline_clicks": 0,
+                    "score": 3.0,
+                }
+            ],
+        )
+        self.assertEqual(
+            [row["terms"] for row in get_trending_queries(hours=72)],
+            ["snakes", "python docs"],
+        )
+
+    def test_analytics_api(self):
+        search_python_docs(1)
+        click_python_docs(1)
+        with freeze_time(timezone.now() + timedelta(minutes=10)):
+            rollup_clicks()
+
+        url = reverse("search:api_search_analytics_top_results")
+        response = self.client.get(url, {"q": "python docs"})
+        self.assertEqual(response.status_code, 403)
+
+        setup_tests_admin(self.client)
+        response = self.client.get(url, {"q": "python docs", "limit": 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["days"], 7)
+        self.assertEqual(
+            response.data["results"],
+            [
+                {
+                    "url": "https://docs.python.org/3/",
+                    "impressions": 1,
+                    "clicks": 1,
+                    "ctr": 1.0,
+                }
+            ],
+        )
+        response = self.client.get(url, {"q": "python docs", "days": 0})
+        self.assertEqual(response.status_code, 400)
+
+        url = reverse("search:api_search_analytics_domains")
+        response = self.client.get(url)
+        self.assertEqual(
+            [row["domain"] for row in response.data["domains"]],
+            ["docs.python.org", "python.org"],
+        )
+        url = reverse("search:api_search_analytics_trending")
+        response = self.client.get(url, {"hours": "a"})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(url, {"hours": 1})
+        self.assertEqual(response.data["queries"][0]["terms"], "python docs")
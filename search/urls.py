@@ -21,11 +21,56 @@ app_name = "search"
 urlpatterns = [
     path("", views.home, name="home"),
     path("api/search/", views.SearchView.as_view(), name="api_search"),
+    path(
+        "api/search/batch/",
+        views.SearchBatchView.as_view(),
+        name="api_search_batch",
+    ),
     path(
         "api/histories/",
         views.HistoryCreateView.as_view(),
         name="api_histories",
     ),
+    path(
+        "api/histories/spool/",
+        views.history_spool_stats,
+        name="api_history_spool_stats",
+    ),
+    path(
+        "api/search/results/",
+        views.search_results,
+        name="api_search_results",
+    ),
+    path(
+        "api/search/autocomplete/",
+        views.search_autocomplete,
+        name="api_search_autocomplete",
+    ),
+    path(
+        "api/search/analytics/top-results/",
+        views.search_analytics_top_results,
+        name="api_search_analytics_top_results",
+    ),
+    path(
+        "api/search/analytics/domains/",
+        views.search_analytics_domains,
+        name="api_search_analytics_domains",
+    ),
+    path(
+        "api/search/analytics/trending/",
+        views.search_analytics_trending,
+        name="api_search_analytics_trending",
+    ),
     path("search/", views.guppy_search, name="guppy_search"),
+    path(
+        "search/shown/",
+        views.guppy_search_shown,
+        name="guppy_search_shown",
+    ),
     path("search-tracking/", views.search_tracking, name="search_tracking"),
+    path(
+        "search-tracking/stats/",
+        views.search_clicks_stats,
+        name="search_clicks_stats",
+    ),
 ]
@@ -1,17 +1,426 @@
-from django.db.models import F
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, List, Tuple, Type, Union
 
-from .models import Result, Search, SearchResult
+from django.db import connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
 
+from accounts.models import UserProfile
 
-def click_url(data) -> None:
-    if "search_term" in data and data["search_term"]:
-        searchs = Search.objects.filter(
-            search_terms=data["search_term"], user_id=data["user_id"]
+from .models import History, Result, Search, SearchResult, get_hash
+
+HISTORY_UPSERT_BATCH_SIZE = 1000
+HISTORY_UPSERT_SQL = """
+INSERT INTO search_history
+    (created, modified, url, title, last_origin, user_id, count, url_hash)
+VALUES {values}
+ON CONFLICT (user_id, url_hash, url) DO UPDATE SET
+    count = search_history.count + EXCLUDED.count,
+    modified = GREATEST(search_history.modified, EXCLUDED.modified),
+    title = COALESCE(NULLIF(EXCLUDED.title, ''), search_history.title),
+    last_origin = COALESCE(
+        NULLIF(EXCLUDED.last_origin, ''), search_history.last_origin
+    )
+RETURNING
+    id, created, modified, url, title, last_origin, user_id, count, url_hash
+"""
+USER_DAILY_ACTIVITY_BATCH_SIZE = 1000
+USER_DAILY_ACTIVITY_UPSERT_SQL = """
+INSERT INTO search_userdailyactivity
+    (user_id, day, history_count, search_count, clicks, last_activity)
+VALUES {values}
+ON CONFLICT (user_id, day) DO UPDATE SET
+    history_count = (
+        search_userdailyactivity.history_count + EXCLUDED.history_count
+    ),
+    search_count = (
+        search_userdailyactivity.search_count + EXCLUDED.search_count
+    ),
+    clicks = search_userdailyactivity.clicks + EXCLUDED.clicks,
+    last_activity = GREATEST(
+        search_userdailyactivity.last_activity, EXCLUDED.last_activity
+    )
+"""
+# Add a click to the result of the last search of the user for the terms,
+# and to the daily activity of the user, in a single statement
+CLICK_UPSERT_SQL = """
+WITH clicked_search AS (
+    SELECT id FROM search_search
+    WHERE search_terms_hash = %(search_terms_hash)s
+        AND search_terms = %(search_terms)s
+        AND user_id = %(user_id)s
+    ORDER BY id DESC
+    LIMIT 1
+), new_result AS (
+    INSERT INTO search_result (url, url_hash)
+    SELECT %(url)s, %(url_hash)s WHERE EXISTS (SELECT FROM clicked_search)
+    ON CONFLICT (url_hash, url) DO NOTHING
+    RETURNING id
+), clicked_result AS (
+    SELECT id FROM new_result
+    UNION ALL
+    SELECT id FROM search_result
+    WHERE url_hash = %(url_hash)s AND url = %(url)s
+), click AS (
+    INSERT INTO search_searchresult (
+        created,
+        modified,
+        search_id,
+        result_id,
+        count,
+        impressions,
+        rolled_up_impressions,
+        rolled_up_clicks
+    )
+    SELECT %(now)s, %(now)s, clicked_search.id, clicked_result.id, 1, 1, 0, 0
+    FROM clicked_search, clicked_result
+    ON CONFLICT (search_id, result_id) DO UPDATE SET
+        count = search_searchresult.count + 1,
+        modified = EXCLUDED.modified
+    RETURNING id
+), activity AS (
+    INSERT INTO search_userdailyactivity
+        (user_id, day, history_count, search_count, clicks, last_activity)
+    SELECT %(user_id)s, %(day)s, 0, 0, 1, %(now)s
+    FROM click
+    WHERE %(user_id)s <> 0
+    ON CONFLICT (user_id, day) DO UPDATE SET
+        clicks = search_userdailyactivity.clicks + 1,
+        last_activity = GREATEST(
+            search_userdailyactivity.last_activity, EXCLUDED.last_activity
+        )
+)
+SELECT COUNT(*) FROM click
+"""
+
+
+def click_url(data) -> bool:
+    """
+    Count a click on a result of a search of the user in a single statement
+    Return whether the clicked search was found
+    """
+    if not data.get("search_term"):
+        return False
+    now = timezone.now()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            CLICK_UPSERT_SQL,
+            {
+                "search_terms_hash": get_hash(data["search_term"]),
+                "search_terms": data["search_term"],
+                "user_id": data["user_id"] or 0,
+                "url": data["url"],
+                "url_hash": get_hash(data["url"]),
+                "now": now,
+                "day": timezone.localtime(now, timezone.utc).date(),
+            },
+        )
+        return bool(cursor.fetchone()[0])
+
+
+def save_searches(searches: List[Dict], user_id: int) -> List[Search]:
+    """
+    Save a batch of searches (with their results) posted by one user
+    using a fixed number of queries regardless of the batch size.
+    Searches matching an existing (search_type, search_terms) pair of the
+    user are touched and counted instead of being duplicated.
+    """
+    now = timezone.now()
+    # Merge duplicated searches of the batch, keeping the results order
+    results_by_key = {}  # type: Dict[Tuple[int, str], Dict[str, None]]
+    counts = Counter()  # type: Counter[Tuple[int, str]]
+    for item in searches:
+        key = (item["search_type"], item["search_terms"])
+        counts[key] += 1
+        result_urls = results_by_key.setdefault(key, {})
+        for url in item.get("search_results", []):
+            result_urls[url] = None
+
+    with transaction.atomic():
+        searches_by_key = {}  # type: Dict[Tuple[int, str], Search]
+        existing_searches = Search.objects.filter(
+            user_id=user_id,
+            search_terms_hash__in={get_hash(key[1]) for key in results_by_key},
+        ).order_by("pk")
+        for search in existing_searches:
+            key = (search.search_type, search.search_terms)
+            if key in results_by_key:
+                searches_by_key.setdefault(key, search)
+        if searches_by_key:
+            Search.objects.filter(
+                pk__in=[search.pk for search in searches_by_key.values()]
+            ).update(
+                modified=now,
+                count=F("count")
+                + Case(
+                    *[
+                        When(pk=search.pk, then=Value(counts[key]))
+                        for key, search in searches_by_key.items()
+                        if counts[key] > 1
+                    ],
+                    default=Value(1),
+                    output_field=IntegerField(),
+                ),
+            )
+            for key, search in searches_by_key.items():
+                search.modified = now
+                search.count += counts[key]
+
+        new_searches = Search.objects.bulk_create(
+            [
+                Search(
+                    search_type=key[0],
+                    search_terms=key[1],
+                    search_terms_hash=get_hash(key[1]),
+                    user_id=user_id,
+                    count=counts[key],
+                )
+                for key in results_by_key
+                if key not in searches_by_key
+            ]
         )
-        if searchs.exists():
-            search = searchs.first()
-            result, _ = Result.objects.get_or_create(url=data["url"])
-            search.results.add(result.pk)
-            SearchResult.objects.filter(result=result, search=search).update(
-                count=F("count") + 1
+        for search in new_searches:
+            searches_by_key[(search.search_type, search.search_terms)] = search
+
+        urls = {url for items in results_by_key.values() for url in items}
+        if urls:
+            Result.objects.bulk_create(
+                [Result(url=url, url_hash=get_hash(url)) for url in urls],
+                ignore_conflicts=True,
+            )
+            result_ids = dict(
+                Result.objects.filter(
+                    url_hash__in=[get_hash(url) for url in urls], url__in=urls
+                ).values_list("url", "pk")
+            )
+            # Times each result was shown by each search of the batch
+            impressions = Counter()  # type: Counter[Tuple[int, int]]
+            for key, items in results_by_key.items():
+                for url in items:
+                    pair = (searches_by_key[key].pk, result_ids[url])
+                    impressions[pair] += counts[key]
+            existing_pairs = {
+                (search_id, result_id): pk
+                for pk, search_id, result_id in SearchResult.objects.filter(
+                    search_id__in={pair[0] for pair in impressions},
+                    result_id__in=result_ids.values(),
+                ).values_list("pk", "search_id", "result_id")
+                if (search_id, result_id) in impressions
+            }
+            if existing_pairs:
+                # Shown again, for the click-through rates
+                SearchResult.objects.filter(
+                    pk__in=existing_pairs.values()
+                ).update(
+                    modified=now,
+                    impressions=F("impressions")
+                    + Case(
+                        *[
+                            When(pk=pk, then=Value(impressions[pair]))
+                            for pair, pk in existing_pairs.items()
+                            if impressions[pair] > 1
+                        ],
+                        default=Value(1),
+                        output_field=IntegerField(),
+                    ),
+                )
+            SearchResult.objects.bulk_create(
+                [
+                    SearchResult(
+                        search_id=pair[0],
+                        result_id=pair[1],
+                        impressions=count,
+                    )
+                    for pair, count in impressions.items()
+                    if pair not in existing_pairs
+                ],
+                # Added by a concurrent request in the meantime
+                ignore_conflicts=True,
+            )
+
+        record_activities(
+            [{"user_id": user_id, "time": now, "searches": len(searches)}]
+        )
+        # Update `last_posting_time` of user profile
+        if user_id:
+            UserProfile.objects.filter(pk=user_id).update(
+                last_posting_time=max(
+                    search.modified for search in searches_by_key.values()
+                )
+            )
+
+    return [
+        searches_by_key[(item["search_type"], item["search_terms"])]
+        for item in searches
+    ]
+
+
+def upsert_history(
+    user_id: int, url: str, title: str = "", last_origin: str = ""
+) -> History:
+    """
+    Add a visit to the History of an url in a single statement
+    """
+    return upsert_histories(
+        [
+            {
+                "user_id": user_id,
+                "url": url,
+                "title": title,
+                "last_origin": last_origin,
+            }
+        ]
+    )[0]
+
+
+def upsert_histories(visits: Iterable[Dict[str, Any]]) -> List[History]:
+    """
+    Add many visits to the History counts.
+    Each visit may set its `count` (defaults to 1) and `visited` time.
+    Empty titles and origins keep the saved ones.
+    """
+    now = timezone.now()
+    # A statement can not update the same row twice, merge the visits first
+    merged = {}  # type: Dict[Tuple[int, str], List[Any]]
+    for visit in visits:
+        visited = visit.get("visited") or now
+        title = visit.get("title") or ""
+        last_origin = visit.get("last_origin") or ""
+        key = (visit["user_id"], visit["url"])
+        if key in merged:
+            row = merged[key]
+            row[1] = max(row[1], visited)
+            row[3] = title or row[3]
+            row[4] = last_origin or row[4]
+            row[6] += visit.get("count", 1)
+        else:
+            merged[key] = [
+                visited,
+                visited,
+                visit["url"],
+                title,
+                last_origin,
+                visit["user_id"],
+                visit.get("count", 1),
+                get_hash(visit["url"]),
+            ]
+
+    histories = []
+    rows = list(merged.values())
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), HISTORY_UPSERT_BATCH_SIZE):
+            end = start + HISTORY_UPSERT_BATCH_SIZE
+            batch = rows[start:end]
+            cursor.execute(
+                HISTORY_UPSERT_SQL.format(
+                    values=", ".join(
+                        ["(%s, %s, %s, %s, %s, %s, %s, %s)"] * len(batch)
+                    )
+                ),
+                [value for row in batch for value in row],
+            )
+            histories += [History(*row) for row in cursor.fetchall()]
+
+    return histories
+
+
+def update_last_posting_times(histories: Iterable[History]) -> None:
+    """
+    Update `last_posting_time` of the user profiles who posted histories
+    """
+    last_posting_times = {}  # type: Dict[int, datetime]
+    for history in histories:
+        if history.user_id:
+            last_posting_times[history.user_id] = max(
+                history.modified,
+                last_posting_times.get(history.user_id, history.modified),
+            )
+    for user_id, last_posting_time in last_posting_times.items():
+        UserProfile.objects.filter(pk=user_id).update(
+            last_posting_time=last_posting_time
+        )
+
+
+def record_activities(activities: Iterable[Dict[str, Any]]) -> None:
+    """
+    Add activities to the daily rollup of their users in a single statement.
+    Each activity has a `user_id`, a `time` and its `histories`, `searches`
+    and `clicks` counts (default to 0).
+    Activities of anonymous users are not recorded.
+    """
+    merged = {}  # type: Dict[Tuple[int, date], List[Any]]
+    for activity in activities:
+        if not activity["user_id"]:
+            continue
+        time = activity["time"]
+        day = timezone.localtime(time, timezone.utc).date()
+        row = merged.setdefault(
+            (activity["user_id"], day),
+            [activity["user_id"], day, 0, 0, 0, time],
+        )
+        row[2] += activity.get("histories", 0)
+        row[3] += activity.get("searches", 0)
+        row[4] += activity.get("clicks", 0)
+        row[5] = max(row[5], time)
+
+    rows = list(merged.values())
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), USER_DAILY_ACTIVITY_BATCH_SIZE):
+            end = start + USER_DAILY_ACTIVITY_BATCH_SIZE
+            batch = rows[start:end]
+            cursor.execute(
+                USER_DAILY_ACTIVITY_UPSERT_SQL.format(
+                    values=", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(batch))
+                ),
+                [value for row in batch for value in row],
+            )
+
+
+def backfill_hashes(
+    model, field: str, hash_field: str, batch_size: int = 1000
+) -> int:
+    """
+    Fill the missing hashes of a model in batches
+    Return the number of updated rows
+    """
+    updated = 0
+    while True:
+        rows = list(
+            model.objects.filter(**{f"{hash_field}__isnull": True})
+            .order_by("pk")
+            .values_list("pk", field)[:batch_size]
+        )
+        if not rows:
+            return updated
+        objects = []
+        for row_id, value in rows:
+            obj = model(pk=row_id)
+            setattr(obj, hash_field, get_hash(value))
+            objects.append(obj)
+        model.objects.bulk_update(objects, [hash_field])
+        updated += len(objects)
+
+
+def purge_search_data(days: int, batch_size: int = 10000) -> Dict[str, int]:
+    """
+    Delete the histories and searches neither created nor updated
+    during the last N days
+    Return the number of deleted rows per model
+    """
+    cutoff = timezone.now() - timedelta(days=days)
+    deleted = {}
+    models = (History, Search)  # type: Tuple[Type[Union[History, Search]], ...]
+    for model in models:
+        deleted[model.__name__] = 0
+        while True:
+            ids = list(
+                model.objects.filter(
+                    created__lt=cutoff, modified__lt=cutoff
+                ).values_list("pk", flat=True)[:batch_size]
             )
+            if not ids:
+                break
+            model.objects.filter(pk__in=ids).delete()
+            deleted[model.__name__] += len(ids)
+    return deleted
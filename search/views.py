@@ -1,21 +1,41 @@
+import time
 import urllib
 
 from rest_framework import generics, mixins, status
+from rest_framework.decorators import api_view, permission_classes
 from rest_framework.exceptions import ValidationError
 from rest_framework.generics import CreateAPIView
-from rest_framework.permissions import AllowAny
+from rest_framework.permissions import AllowAny, IsAdminUser
 from rest_framework.response import Response
 
 from django.conf import settings
+from django.db import transaction
+from django.db.models import F
 from django.http.response import HttpResponse
 from django.shortcuts import redirect, render
+from django.views.decorators.http import require_POST
 
 from accounts.models import UserProfile
 
+from .analytics import get_domain_ctrs, get_top_results, get_trending_queries
+from .autocomplete import get_suggestions
+from .clicks import CLICK_RECORDER
+from .engine import get_search_index
 from .forms import SearchForm
-from .models import History, Search
-from .serializers import HistorySerialzer, SimpleSearchSerializer
-from .utils import click_url
+from .models import Search, get_hash
+from .serializers import (
+    HistorySerialzer,
+    SearchBatchSerializer,
+    SimpleSearchSerializer,
+)
+from .spool import HistorySpool
+from .utils import (
+    click_url,
+    record_activities,
+    save_searches,
+    update_last_posting_times,
+    upsert_history,
+)
 
 
 def home(request):
@@ -39,11 +59,70 @@ def home(request):
 
 
 def guppy_search(request):
+    query = request.GET.get("q", "")
+    total, results = get_search_index().search(
+        query, settings.SEARCH_RESULTS_PAGE_SIZE
+    )
     template = "search/search.html"
-    context = {"q": request.GET["q"]}
+    context = {"q": query, "results": results, "total": total}
     return render(request, template, context)
 
 
+@require_POST
+def guppy_search_shown(request):
+    """
+    Save the results of a Guppy search, posted by its page once shown,
+    for the click-through ranking
+    """
+    query = request.POST.get("q", "")
+    _, results = get_search_index().search(
+        query, settings.SEARCH_RESULTS_PAGE_SIZE
+    )
+    if query and results:
+        save_searches(
+            [
+                {
+                    "search_type": Search.GUPPY,
+                    "search_terms": query,
+                    "search_results": [result["url"] for result in results],
+                }
+            ],
+            request.user.pk or 0,
+        )
+    return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+
+@api_view(("GET",))
+@permission_classes([AllowAny])
+def search_results(request):
+    """
+    Results of the Guppy search engine for the `q` query, by pages
+    """
+    query = request.query_params.get("q", "")
+    try:
+        page = int(request.query_params.get("page", 1))
+    except ValueError:
+        page = 0
+    if page < 1:
+        raise ValidationError({"page": "A positive integer is required."})
+
+    started = time.monotonic()
+    total, results = get_search_index().search(
+        query,
+        settings.SEARCH_RESULTS_PAGE_SIZE,
+        (page - 1) * settings.SEARCH_RESULTS_PAGE_SIZE,
+    )
+    return Response(
+        {
+            "q": query,
+            "page": page,
+            "count": total,
+            "results": results,
+            "took": time.monotonic() - started,
+        }
+    )
+
+
 def search_tracking(request):
     queries = request.GET
     user_id = request.user.pk
@@ -57,7 +136,7 @@ def search_tracking(request):
 
         serializer = HistorySerialzer(data=data)
         if serializer.is_valid(raise_exception=True):
-            click_url(data)
+            CLICK_RECORDER.record(data)
             return redirect(data["url"])
 
     return HttpResponse("Unauthorized", status=status.HTTP_401_UNAUTHORIZED)
@@ -98,17 +177,26 @@ class SearchView(mixins.CreateModelMixin, generics.GenericAPIView):
         if serializer.is_valid(raise_exception=True):
             searchs = Search.objects.filter(
                 search_type=data["search_type"],
+                search_terms_hash=get_hash(data["search_terms"]),
                 search_terms=data["search_terms"],
                 user_id=user_id,
             )
-            if searchs.count():
+            made_before = searchs.count()
+            if made_before:
                 search = searchs.first()
                 serializer = self.serializer_class(
                     search,
                     data=data,
                 )
                 serializer.is_valid(raise_exception=True)
-            serializer.save()
+            search = serializer.save()
+            if made_before:
+                # Each search is counted, for the autocomplete
+                Search.objects.filter(pk=search.pk).update(count=F("count") + 1)
+                search.count += 1
+            record_activities(
+                [{"user_id": user_id, "time": search.modified, "searches": 1}]
+            )
 
             # Update `last_posting_time` of user profile
             UserProfile.objects.filter(pk=data["user_id"]).update(
@@ -120,6 +208,41 @@ class SearchView(mixins.CreateModelMixin, generics.GenericAPIView):
         raise ValidationError(serializer.errors)
 
 
+class SearchBatchView(generics.GenericAPIView):
+    """
+    The view for posting many searches at once
+    """
+
+    serializer_class = SearchBatchSerializer
+    permission_classes = [AllowAny]
+
+    def post(self, request):
+        """
+        Save all posted searches and their results
+        """
+        user_id = request.user.pk
+        if user_id is None:
+            user_id = 0
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        searches = save_searches(serializer.validated_data["searches"], user_id)
+
+        return Response(
+            {
+                "searches": [
+                    {
+                        "id": search.pk,
+                        "search_type": search.search_type,
+                        "search_terms": search.search_terms,
+                        "modified": search.modified,
+                    }
+                    for search in searches
+                ]
+            },
+            status.HTTP_201_CREATED,
+        )
+
+
 class HistoryCreateView(CreateAPIView):
     """
     The view for create History
@@ -142,25 +265,40 @@ class HistoryCreateView(CreateAPIView):
         )
 
         if serializer.is_valid(raise_exception=True):
-            if "search_term" not in data or not data["search_term"]:
-                histories = History.objects.filter(
-                    url=data["url"],
-                    user_id=user_id,
+            if settings.HISTORY_WRITE_BEHIND and not data.get("search_term"):
+                # The visit is written later by the spool flusher
+                HistorySpool().append(
+                    {
+                        "user_id": user_id,
+                        "url": serializer.validated_data["url"],
+                        "title": serializer.validated_data.get("title", ""),
+                        "last_origin": serializer.validated_data.get(
+                            "last_origin", ""
+                        ),
+                    }
                 )
-                if histories.count():
-                    history = histories.first()
-                    data["count"] = history.count + 1
-                    serializer = self.serializer_class(
-                        history,
-                        data=data,
-                    )
-                    serializer.is_valid(raise_exception=True)
-                serializer.save()
-
-                # Update `last_posting_time` of user profile
-                UserProfile.objects.filter(pk=data["user_id"]).update(
-                    last_posting_time=serializer.data["modified"]
+                return Response(
+                    serializer.validated_data, status=status.HTTP_202_ACCEPTED
                 )
+            if "search_term" not in data or not data["search_term"]:
+                with transaction.atomic():
+                    history = upsert_history(
+                        user_id,
+                        serializer.validated_data["url"],
+                        serializer.validated_data.get("title", ""),
+                        serializer.validated_data.get("last_origin", ""),
+                    )
+                    update_last_posting_times([history])
+                    record_activities(
+                        [
+                            {
+                                "user_id": user_id,
+                                "time": history.modified,
+                                "histories": 1,
+                            }
+                        ]
+                    )
+                serializer = self.serializer_class(history)
             else:
                 # Track clicked URL
                 click_url(data)
@@ -168,3 +306,108 @@ class HistoryCreateView(CreateAPIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
 
         raise ValidationError(serializer.errors)
+
+
+@api_view(("GET",))
+@permission_classes([IsAdminUser])
+def history_spool_stats(request):
+    """
+    Metrics of the History write-behind spool
+    """
+
+    return Response(HistorySpool().stats())
+
+
+@api_view(("GET",))
+@permission_classes([AllowAny])
+def search_autocomplete(request):
+    """
+    Most searched terms starting with the `q` prefix
+    """
+    return Response(
+        {
+            "q": request.query_params.get("q", ""),
+            "suggestions": get_suggestions().complete(
+                request.query_params.get("q", ""),
+                settings.AUTOCOMPLETE_MAX_SUGGESTIONS,
+            ),
+        }
+    )
+
+
+def get_positive_int(request, name: str, default: int, maximum: int) -> int:
+    try:
+        value = int(request.query_params.get(name, default))
+    except ValueError:
+        value = 0
+    if not 0 < value <= maximum:
+        raise ValidationError(
+            {name: f"An integer between 1 and {maximum} is required."}
+        )
+    return value
+
+
+@api_view(("GET",))
+@permission_classes([IsAdminUser])
+def search_analytics_top_results(request):
+    """
+    Results clicked the most for the `q` search terms during the last days
+    """
+    query = request.query_params.get("q", "")
+    days = get_positive_int(request, "days", 7, 366)
+    limit = get_positive_int(
+        request, "limit", 10, settings.SEARCH_ANALYTICS_MAX_ROWS
+    )
+    return Response(
+        {
+            "q": query,
+            "days": days,
+            "results": get_top_results(query, days, limit),
+        }
+    )
+
+
+@api_view(("GET",))
+@permission_classes([IsAdminUser])
+def search_analytics_domains(request):
+    """
+    Click-through rates of the most clicked domains during the last days
+    """
+    days = get_positive_int(request, "days", 7, 366)
+    limit = get_positive_int(
+        request, "limit", 10, settings.SEARCH_ANALYTICS_MAX_ROWS
+    )
+    return Response({"days": days, "domains": get_domain_ctrs(days, limit)})
+
+
+@api_view(("GET",))
+@permission_classes([IsAdminUser])
+def search_analytics_trending(request):
+    """
+    Search terms clicked during the last hours the most above their clicks
+    of the previous days
+    """
+    hours = get_positive_int(request, "hours", 24, 24 * 7)
+    days = get_positive_int(
+        request, "baseline_days", 7, settings.SEARCH_ANALYTICS_HOURLY_DAYS
+    )
+    limit = get_positive_int(
+        request, "limit", 10, settings.SEARCH_ANALYTICS_MAX_ROWS
+    )
+    return Response(
+        {
+            "hours": hours,
+            "baseline_days": days,
+            "queries": get_trending_queries(hours, days * 24, limit),
+        }
+    )
+
+
+@api_view(("GET",))
+@permission_classes([IsAdminUser])
+def search_clicks_stats(request):
+    """
+    Counters of the clicks recorded by this process
+    """
+
+    return Response(CLICK_RECORDER.stats())
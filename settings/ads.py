@@ -0,0 +1,19 @@
+"""
+Settings of the ads server `guppy.ads_asgi`: the settings of the
+environment named by ADS_ENVIRONMENT (local, staging or production),
+serving the ads URLs only
+"""
+import os
+
+if os.environ.get("ADS_ENVIRONMENT") == "production":
+    from .production import *
+elif os.environ.get("ADS_ENVIRONMENT") == "staging":
+    from .staging import *
+else:
+    from .local import *
+
+# The other middlewares are sync only, each request would wait for a thread
+MIDDLEWARE = ADS_ASGI_MIDDLEWARE
+ROOT_URLCONF = "advertisers.async_urls"
+
+os.environ["DJANGO_SETTINGS_MODULE"] = "settings.ads"
@@ -277,6 +277,9 @@ COMPRESS_ENABLED = True
 
 STRIPE_SECRET_KEY = os.environ.get("STRIPE_SECRET_KEY")
 STRIPE_PUBLISHABLE_KEY = os.environ.get("STRIPE_PUBLISHABLE_KEY")
+# Seconds to wait for Stripe, and connections kept open by each worker
+STRIPE_TIMEOUT = 10
+STRIPE_POOL_SIZE = 10
 
 HONEYPOT_FIELD_NAME = "guppy"
 
@@ -288,6 +291,84 @@ MESSAGE_TAGS = {
     messages.ERROR: "alert-danger",
 }
 
+# The maximum number of searches accepted by the search batch API
+SEARCH_BATCH_MAX_SIZE = 500
+
+# Spool page visits and write them with the minutely job
+# instead of writing them in the request
+HISTORY_WRITE_BEHIND = False
+HISTORY_SPOOL_DIR = os.path.join(BASE_DIR, "spool", "history")
+
+# Count the search result clicks after the redirect: None to count them in
+# the request, "celery" by a task or "thread" by a thread of the process
+SEARCH_CLICKS_ASYNC = None
+# Clicks waiting for the thread, the next ones are dropped
+SEARCH_CLICKS_QUEUE_SIZE = 1000
+# Seconds to connect to the broker and publish the task of a click, in
+# "celery" mode
+SEARCH_CLICKS_PUBLISH_TIMEOUT = 0.5
+
+# Inverted index of the results searched by Guppy, updated hourly
+SEARCH_INDEX_DIR = os.path.join(BASE_DIR, "search_index")
+# Rebuild the index in one segment when the updates added N segments
+SEARCH_INDEX_MAX_SEGMENTS = 24
+# Boost of the results by their clicks: score * (1 + N * log(1 + clicks))
+SEARCH_CLICK_WEIGHT = 0.5
+SEARCH_RESULTS_PAGE_SIZE = 10
+
+# Search terms suggested by the autocomplete API, updated hourly
+AUTOCOMPLETE_DIR = os.path.join(BASE_DIR, "autocomplete")
+# Only the terms searched N times are suggested, rare searches stay private
+AUTOCOMPLETE_MIN_COUNT = 3
+AUTOCOMPLETE_MAX_TERMS = 100000
+AUTOCOMPLETE_MAX_SUGGESTIONS = 10
+# Seconds before the last update from which the searches are checked again,
+# for the ones saved by transactions still running during the update
+AUTOCOMPLETE_OVERLAP = 300
+
+# Clicks of the search results rolled up hourly by (search terms, result):
+# the results shown during the last N seconds wait for the next rollup
+SEARCH_ANALYTICS_DELAY = 5 * 60
+# Keep the hourly rollups N days, the daily ones are kept
+SEARCH_ANALYTICS_HOURLY_DAYS = 30
+SEARCH_ANALYTICS_MAX_ROWS = 100
+
+# Delete the histories and searches older than N days (None to keep all)
+SEARCH_DATA_RETENTION_DAYS = None
+
+# Save the IP of a user at most once per N seconds
+IP_TRACKER_INTERVAL = 60 * 60
+# Number of (user, ip) pairs remembered by each process
+IP_TRACKER_CACHE_SIZE = 10000
+# Send the new IPs to save by batches of N, or after N seconds
+IP_TRACKER_BATCH_SIZE = 100
+IP_TRACKER_FLUSH_INTERVAL = 10
+# Seconds to connect to the broker and publish a batch, which is dropped
+# and saved again by the next requests after it
+IP_TRACKER_PUBLISH_TIMEOUT = 0.5
+# Recipients of a campaign sent by each email task, over one connection
+EMAIL_CHUNK_SIZE = 100
+# Send again the emails claimed by a task which did not finish in N seconds
+EMAIL_CLAIM_TIMEOUT = 10 * 60
+# Hours of signups checked by the hourly email jobs for missed users
+EMAIL_CATCH_UP_HOURS = 24
+
+# Rebuild the in-process ad inventory at least every N seconds
+AD_INVENTORY_MAX_AGE = 300
+# Number of requested ad dimensions memoized by the ad inventory
+AD_SIZES_CACHE_SIZE = 4096
+# Refresh the pacing weights of the budgeted ads every N seconds
+AD_PACING_INTERVAL = 30
+# Maximum weight of an ad behind its budget, unbudgeted ads weigh 1
+AD_MAX_PACING_WEIGHT = 4.0
+# Seconds the ads checker answers can be cached by browsers and proxies
+ADS_CHECKER_MAX_AGE = 60
+# Middlewares of the ads server `guppy.ads_asgi`
+ADS_ASGI_MIDDLEWARE = [
+    "corsheaders.middleware.CorsMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+]
+
 BASE_URL = "http://localhost:8000"
 LOGIN_URL = "/login/"
 INTERNAL_IPS = ("127.0.0.1", "localhost", "162.243.168.41")